@@ -0,0 +1,239 @@
+import hashlib
+import os
+import uuid
+
+from fastapi import UploadFile
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import or_, select
+from sqlalchemy.exc import IntegrityError
+
+from app.config import MAX_IMAGE_BYTES
+from app.database import get_db_session, run_db
+from app.media import CONTENT_HASH
+from app.storage import storage
+from app.thumbnails import remove_preview
+from app.upload_service import save_upload
+from database.models import Attachment, Message, RoomMembers
+
+# Files are stored once per upload directory as "<sha256><ext>" and counted by
+# how many messages / rooms / profiles point at them. The directory name is
+# the attachment "kind", e.g. uploads/messages -> "messages", and the object
+# itself lives in ``storage`` under "<kind>/<filename>".
+
+
+def content_filename(sha256: str, original_name: str | None) -> str:
+    ext = os.path.splitext(original_name or "")[1].lower()
+    return f"{sha256}{ext}"
+
+
+def staging_key(owner_id: int, sha256: str, original_name: str | None) -> str:
+    # Direct uploads land here, under the never-served tmp/, until adopted
+    return f"tmp/direct/{owner_id}/{content_filename(sha256, original_name)}"
+
+
+def visible_to(db, user_id: int, directory: str, filename: str) -> bool:
+    # The caller can already open a message carrying this file
+    rooms = select(RoomMembers.room_id).where(RoomMembers.user_id == user_id)
+    return (
+        db.query(Message.id)
+        .filter(
+            Message.file_url == f"/{directory}/{filename}",
+            or_(
+                Message.sender_id == user_id,
+                Message.receiver_id == user_id,
+                Message.room_id.in_(rooms),
+            ),
+        )
+        .first()
+        is not None
+    )
+
+
+def acquire(
+    directory: str,
+    sha256: str,
+    owner_id: int,
+    original_name: str | None = None,
+    mimetype: str | None = None,
+) -> str | None:
+    """Take a reference to stored content by hash alone, without the bytes.
+
+    A hash is not proof of holding the file, so this only succeeds for
+    content the owner can already see, or that they just uploaded straight
+    to their staging key (where storage checked the hash). Anything else
+    must be uploaded, and ``commit_file`` deduplicates it then.
+    """
+    if not CONTENT_HASH.match(sha256 or ""):
+        return None
+    kind = os.path.basename(directory)
+    staged = staging_key(owner_id, sha256, original_name)
+    with get_db_session() as db:
+        while True:
+            row = (
+                db.query(Attachment)
+                .filter_by(kind=kind, sha256=sha256)
+                .with_for_update()
+                .first()
+            )
+            if row is not None:
+                key = f"{kind}/{row.filename}"
+                if visible_to(db, owner_id, directory, row.filename):
+                    if not storage.exists(key):
+                        return None
+                elif storage.verified_size(staged, sha256) is not None:
+                    if storage.exists(key):
+                        storage.delete(staged)
+                    else:
+                        storage.move(staged, key)  # heal a lost copy
+                else:
+                    return None
+                row.ref_count += 1
+                db.commit()
+                return row.filename
+
+            size = storage.verified_size(staged, sha256)
+            if size is None:
+                return None
+            filename = content_filename(sha256, original_name)
+            db.add(
+                Attachment(
+                    kind=kind,
+                    sha256=sha256,
+                    filename=filename,
+                    size=size,
+                    mimetype=mimetype,
+                    ref_count=1,
+                )
+            )
+            try:
+                db.commit()
+            except IntegrityError:
+                # Someone stored the same content first; take a reference to theirs
+                db.rollback()
+                continue
+            storage.move(staged, f"{kind}/{filename}")
+            return filename
+
+
+def is_known(directory: str, sha256: str, user_id: int) -> bool:
+    # Answering for content the caller cannot see would let anyone probe by hash
+    kind = os.path.basename(directory)
+    with get_db_session() as db:
+        row = db.query(Attachment.filename).filter_by(kind=kind, sha256=sha256).first()
+        return row is not None and visible_to(db, user_id, directory, row.filename)
+
+
+def commit_file(
+    directory: str,
+    tmp_path: str,
+    sha256: str,
+    size: int,
+    original_name: str | None,
+    mimetype: str | None = None,
+) -> str:
+    """Adopt a fully written temp file, deduplicating on its hash."""
+    kind = os.path.basename(directory)
+    with get_db_session() as db:
+        while True:
+            row = (
+                db.query(Attachment)
+                .filter_by(kind=kind, sha256=sha256)
+                .with_for_update()
+                .first()
+            )
+            if row is not None:
+                key = f"{kind}/{row.filename}"
+                if storage.exists(key):
+                    os.remove(tmp_path)
+                else:
+                    storage.save(key, tmp_path, mimetype)  # heal a lost copy
+                row.ref_count += 1
+                db.commit()
+                return row.filename
+
+            filename = content_filename(sha256, original_name)
+            db.add(
+                Attachment(
+                    kind=kind,
+                    sha256=sha256,
+                    filename=filename,
+                    size=size,
+                    mimetype=mimetype,
+                    ref_count=1,
+                )
+            )
+            try:
+                db.commit()
+            except IntegrityError:
+                # Someone stored the same content first; take a reference to theirs
+                db.rollback()
+                continue
+            storage.save(f"{kind}/{filename}", tmp_path, mimetype)
+            return filename
+
+
+def release(directory: str, filename: str | None):
+    """Drop one reference and delete the file once nothing points at it."""
+    if not filename:
+        return
+    kind = os.path.basename(directory)
+    filename = os.path.basename(filename)
+    with get_db_session() as db:
+        row = (
+            db.query(Attachment)
+            .filter_by(kind=kind, filename=filename)
+            .with_for_update()
+            .first()
+        )
+        if row is not None:
+            row.ref_count -= 1
+            if row.ref_count > 0:
+                db.commit()
+                return
+            db.delete(row)
+            db.commit()
+    # Unreferenced (or a legacy uuid-named file that predates the store)
+    storage.delete(f"{kind}/{filename}")
+    remove_preview(os.path.join(directory, filename))
+
+
+def _write_hashed(path: str, data: bytes) -> str:
+    with open(path, "wb") as f:
+        f.write(data)
+    return hashlib.sha256(data).hexdigest()
+
+
+def temp_path(directory: str) -> str:
+    return os.path.join(directory, f".{uuid.uuid4().hex}.upload")
+
+
+async def store_bytes(
+    data: bytes, directory: str, original_name: str | None, mimetype: str | None
+) -> str:
+    tmp_path = temp_path(directory)
+    sha256 = await run_in_threadpool(_write_hashed, tmp_path, data)
+    return await run_db(
+        commit_file, directory, tmp_path, sha256, len(data), original_name, mimetype
+    )
+
+
+async def store_upload(
+    upload: UploadFile, directory: str, max_bytes: int = MAX_IMAGE_BYTES
+) -> str:
+    stored = await save_upload(
+        upload, directory, os.path.basename(temp_path(directory)), max_bytes
+    )
+    return await run_db(
+        commit_file,
+        directory,
+        stored.path,
+        stored.sha256,
+        stored.size,
+        upload.filename,
+        upload.content_type,
+    )
+
+
+async def release_file(directory: str, filename: str | None):
+    if filename:
+        await run_db(release, directory, filename)
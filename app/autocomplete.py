@@ -0,0 +1,261 @@
+import asyncio
+import functools
+from collections.abc import Callable
+
+from sqlalchemy import case, func, or_
+from sqlalchemy.orm import Session
+
+from app.broker import broker
+from app.cache import TTLCache
+from app.config import SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL
+from app.database import get_db_session, run_db
+from database.models import Chatroom, RoomMembers, User
+
+# Autocomplete for users and rooms, called on every keystroke. PostgreSQL
+# answers from the trigram indexes added by migration 9b4d7e2a6f13: prefix
+# matches first, and only when there are none a typo-tolerant similarity match.
+# Results are plain dicts (never password hashes) cached per normalized query.
+#
+# Keystroke bursts mostly never reach the database: a query whose shorter
+# prefix is cached with a complete (untruncated) result is answered by
+# filtering that result, and identical queries in flight share one DB call.
+# User and room writes call ``search_changed`` so no worker keeps serving
+# results from before the change.
+
+AUTOCOMPLETE_LIMIT = 10
+
+# key -> {"results": [...], "complete": bool}; complete means every prefix
+# match is in results, so longer queries can be served by filtering it
+search_cache = TTLCache(SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL)
+# Reported by /metrics/cache next to search_cache.stats()
+search_stats = {"lookups": 0, "narrowed": 0, "coalesced": 0, "queries": 0}
+# key -> (generation the load started in, its future)
+_pending: dict[tuple, tuple[int, asyncio.Future]] = {}
+# Bumped on every invalidation; a load that started before one is not cached
+_generation = 0
+
+
+def normalize(query: str) -> str:
+    return " ".join(query.lower().split())
+
+
+def prefix_pattern(query: str) -> str:
+    escaped = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return escaped + "%"
+
+
+def user_result(user: User) -> dict:
+    return {
+        "id": user.id,
+        "username": user.username,
+        "first_name": user.first_name,
+        "last_name": user.last_name,
+        "profile_image": user.profile_image,
+    }
+
+
+def room_result(room: Chatroom) -> dict:
+    return {
+        "id": room.id,
+        "roomname": room.roomname,
+        "is_private": room.is_private,
+        "image": room.image,
+        "created_by": room.created_by,
+    }
+
+
+def _is_postgres(db: Session) -> bool:
+    return db.get_bind().dialect.name == "postgresql"
+
+
+def user_rank(result: dict, query: str) -> tuple | None:
+    # Same order as _match_users, for filtering a cached wider result
+    username = result["username"].lower()
+    if username == query:
+        rank = 0
+    elif username.startswith(query):
+        rank = 1
+    elif result["first_name"].lower().startswith(query):
+        rank = 2
+    elif result["last_name"].lower().startswith(query):
+        rank = 3
+    else:
+        return None
+    return rank, len(result["username"]), result["username"]
+
+
+def room_rank(result: dict, query: str) -> tuple | None:
+    roomname = result["roomname"].lower()
+    if not roomname.startswith(query):
+        return None
+    return roomname != query, len(result["roomname"]), result["id"]
+
+
+def _match_users(db: Session, query: str, room_id: int | None) -> tuple[list[User], bool]:
+    username = func.lower(User.username)
+    first_name = func.lower(User.first_name)
+    last_name = func.lower(User.last_name)
+    base = db.query(User)
+    if room_id is not None:
+        base = base.join(RoomMembers).filter(RoomMembers.room_id == room_id)
+
+    pattern = prefix_pattern(query)
+    # Exact username, then username prefix, then first / last name prefix
+    rank = case(
+        (username == query, 0),
+        (username.like(pattern, escape="\\"), 1),
+        (first_name.like(pattern, escape="\\"), 2),
+        else_=3,
+    )
+    users = (
+        base.filter(
+            or_(
+                username.like(pattern, escape="\\"),
+                first_name.like(pattern, escape="\\"),
+                last_name.like(pattern, escape="\\"),
+            )
+        )
+        .order_by(rank, func.length(User.username), User.username)
+        .limit(AUTOCOMPLETE_LIMIT)
+        .all()
+    )
+    if users or not _is_postgres(db):
+        return users, False
+
+    # No prefix hit: probably a typo, so fall back to trigram similarity
+    similarity = func.greatest(
+        func.similarity(username, query),
+        func.similarity(first_name, query),
+        func.similarity(last_name, query),
+    )
+    return (
+        base.filter(
+            or_(
+                username.op("%")(query),
+                first_name.op("%")(query),
+                last_name.op("%")(query),
+            )
+        )
+        .order_by(similarity.desc(), User.username)
+        .limit(AUTOCOMPLETE_LIMIT)
+        .all()
+    ), True
+
+
+def _match_rooms(db: Session, query: str) -> tuple[list[Chatroom], bool]:
+    roomname = func.lower(Chatroom.roomname)
+    rooms = (
+        db.query(Chatroom)
+        .filter(roomname.like(prefix_pattern(query), escape="\\"))
+        .order_by((roomname == query).desc(), func.length(Chatroom.roomname), Chatroom.id)
+        .limit(AUTOCOMPLETE_LIMIT)
+        .all()
+    )
+    if rooms or not _is_postgres(db):
+        return rooms, False
+    return (
+        db.query(Chatroom)
+        .filter(roomname.op("%")(query))
+        .order_by(func.similarity(roomname, query).desc(), Chatroom.id)
+        .limit(AUTOCOMPLETE_LIMIT)
+        .all()
+    ), True
+
+
+def load_users(query: str, room_id: int | None) -> dict:
+    with get_db_session() as db:
+        users, fuzzy = _match_users(db, query, room_id)
+        return {
+            "results": [user_result(user) for user in users],
+            "complete": not fuzzy and len(users) < AUTOCOMPLETE_LIMIT,
+        }
+
+
+def load_rooms(query: str) -> dict:
+    with get_db_session() as db:
+        rooms, fuzzy = _match_rooms(db, query)
+        return {
+            "results": [room_result(room) for room in rooms],
+            "complete": not fuzzy and len(rooms) < AUTOCOMPLETE_LIMIT,
+        }
+
+
+def narrow(kind: str, scope: int | None, query: str, rank: Callable) -> tuple[dict, float] | None:
+    # "alic" after "ali" (or "al") returned everything that matched
+    for end in range(len(query) - 1, 0, -1):
+        wider_key = (kind, scope, query[:end])
+        # A narrowed entry is only as fresh as the result it was cut from
+        ttl = search_cache.expires_in(wider_key)
+        wider = search_cache.peek(wider_key)
+        if wider is None or ttl is None:
+            continue
+        if not wider["complete"]:
+            return None
+        ranked = [(rank(result, query), result) for result in wider["results"]]
+        ranked = sorted((item for item in ranked if item[0] is not None), key=lambda item: item[0])
+        results = [result for _, result in ranked]
+        # Nothing left may mean a typo, which only the database can match
+        return ({"results": results, "complete": True}, ttl) if results else None
+    return None
+
+
+async def lookup(
+    kind: str, scope: int | None, query: str, rank: Callable, load: Callable, *args
+) -> list[dict]:
+    key = (kind, scope, query)
+    search_stats["lookups"] += 1
+    entry = search_cache.get(key)
+    if entry is None:
+        narrowed = narrow(kind, scope, query, rank)
+        if narrowed is not None:
+            entry, ttl = narrowed
+            search_stats["narrowed"] += 1
+            search_cache.set(key, entry, ttl)
+    if entry is None:
+        # Single flight: concurrent identical queries wait on the same DB call
+        pending = _pending.get(key)
+        if pending is None:
+            search_stats["queries"] += 1
+            pending = (_generation, asyncio.ensure_future(run_db(load, *args)))
+            _pending[key] = pending
+            pending[1].add_done_callback(functools.partial(_settled, key))
+        else:
+            search_stats["coalesced"] += 1
+        generation, future = pending
+        entry = await asyncio.shield(future)
+        if generation == _generation:
+            search_cache.set(key, entry)
+    return entry["results"]
+
+
+def _settled(key: tuple, future: asyncio.Future):
+    # An invalidation may already have replaced this load with a newer one
+    pending = _pending.get(key)
+    if pending is not None and pending[1] is future:
+        del _pending[key]
+
+
+async def search_changed():
+    # Published so every worker drops its results, not just this one
+    await broker.publish("search:all", "invalidate")
+
+
+async def _drop_results(_key: str, _message: str):
+    global _generation
+    _generation += 1
+    search_cache.clear()
+    # Loads already running started before the change: later lookups start anew
+    _pending.clear()
+
+
+broker.subscribe("search:", _drop_results)
+
+
+async def autocomplete_users(query: str, room_id: int | None = None) -> list[dict]:
+    query = normalize(query)
+    return await lookup("users", room_id, query, user_rank, load_users, query, room_id)
+
+
+async def autocomplete_rooms(query: str) -> list[dict]:
+    query = normalize(query)
+    return await lookup("rooms", None, query, room_rank, load_rooms, query)
@@ -0,0 +1,103 @@
+import asyncio
+import logging
+from collections.abc import Awaitable, Callable
+
+from app.config import BROKER_URL
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[str, str], Awaitable[None]]
+
+
+class InMemoryBroker:
+    """Single-process broker: publishing delivers straight to local handlers."""
+
+    def __init__(self):
+        # channel prefix -> handler(key, message), e.g. "room:" -> handler("12", msg)
+        self.handlers: dict[str, Handler] = {}
+
+    def subscribe(self, prefix: str, handler: Handler):
+        self.handlers[prefix] = handler
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def publish(self, channel: str, message: str):
+        await self.dispatch(channel, message)
+
+    async def dispatch(self, channel: str, message: str):
+        for prefix, handler in self.handlers.items():
+            if channel.startswith(prefix):
+                await handler(channel[len(prefix) :], message)
+
+
+class RedisBroker(InMemoryBroker):
+    """Fan-out through Redis pub/sub so every worker sees every publish.
+
+    ``client`` only needs ``publish()`` and ``pubsub()`` with ``psubscribe()``,
+    ``listen()`` and ``aclose()``, so a local fake can stand in for Redis.
+    """
+
+    def __init__(self, url: str | None = None, client=None, namespace: str = "chat:"):
+        super().__init__()
+        if client is None:
+            try:
+                import redis.asyncio as redis
+            except ImportError as exc:
+                raise RuntimeError(
+                    "BROKER_URL points at Redis but the 'redis' package is not installed"
+                ) from exc
+            client = redis.from_url(url)
+        self.client = client
+        self.namespace = namespace
+        self.pubsub = None
+        self.reader: asyncio.Task | None = None
+        self.started = False
+
+    async def start(self):
+        if self.started:
+            return
+        self.started = True
+        self.pubsub = self.client.pubsub()
+        await self.pubsub.psubscribe(f"{self.namespace}*")
+        self.reader = asyncio.create_task(self.read_loop())
+
+    async def stop(self):
+        if self.reader is not None:
+            self.reader.cancel()
+            self.reader = None
+        if self.pubsub is not None:
+            await self.pubsub.aclose()
+            self.pubsub = None
+        self.started = False
+
+    async def publish(self, channel: str, message: str):
+        # Our own subscription delivers it locally, so no direct dispatch here
+        await self.client.publish(self.namespace + channel, message)
+
+    async def read_loop(self):
+        async for item in self.pubsub.listen():
+            if item.get("type") != "pmessage":
+                continue
+            channel = item["channel"]
+            data = item["data"]
+            if isinstance(channel, bytes):
+                channel = channel.decode()
+            if isinstance(data, bytes):
+                data = data.decode()
+            try:
+                await self.dispatch(channel[len(self.namespace) :], data)
+            except Exception:
+                logger.exception("Failed to deliver broker message on %s", channel)
+
+
+def create_broker(url: str | None = BROKER_URL) -> InMemoryBroker:
+    if url and url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBroker(url)
+    return InMemoryBroker()
+
+
+broker = create_broker()
@@ -0,0 +1,72 @@
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after ``ttl`` seconds."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.data.get(key, _MISSING)
+            if entry is not _MISSING and entry[0] > now:
+                self.data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not _MISSING:
+                del self.data[key]
+            self.misses += 1
+            return default
+
+    def peek(self, key, default=None):
+        # Like get() but leaves hit/miss stats and LRU order alone
+        with self.lock:
+            entry = self.data.get(key, _MISSING)
+            if entry is not _MISSING and entry[0] > time.monotonic():
+                return entry[1]
+            return default
+
+    def expires_in(self, key) -> float | None:
+        # Seconds the entry has left, None once it is gone
+        with self.lock:
+            entry = self.data.get(key, _MISSING)
+            if entry is _MISSING:
+                return None
+            left = entry[0] - time.monotonic()
+            return left if left > 0 else None
+
+    def set(self, key, value, ttl: float | None = None):
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self.lock:
+            self.data[key] = (expires, value)
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def pop(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self.data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
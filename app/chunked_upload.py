@@ -0,0 +1,322 @@
+import asyncio
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import struct
+import time
+import uuid
+
+from fastapi import WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+
+from app.attachment_store import acquire, commit_file
+from app.config import MAX_UPLOAD_BYTES, UPLOAD_CHUNK_SIZE, UPLOAD_TMP_TTL
+from app.connection_manager import ClientConnection
+from app.database import run_db
+from app.frames import encode
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_TMP_DIR = os.path.join("uploads", "tmp")
+os.makedirs(UPLOAD_TMP_DIR, exist_ok=True)
+
+# Binary chunk frame: 16-byte upload id, 8-byte big-endian offset, then data
+CHUNK_HEADER = struct.Struct(">16sQ")
+
+
+class UploadError(ValueError):
+    def __init__(self, message: str, offset: int | None = None, status_code: int = 400):
+        super().__init__(message)
+        self.offset = offset
+        self.status_code = status_code
+
+
+def safe_filename(filename: str) -> str:
+    return os.path.basename(filename or "file").replace(" ", "_")
+
+
+def parse_chunk(frame: bytes) -> tuple[str, int, bytes]:
+    if len(frame) < CHUNK_HEADER.size:
+        raise UploadError("Malformed chunk frame")
+    raw_id, offset = CHUNK_HEADER.unpack_from(frame)
+    return uuid.UUID(bytes=raw_id).hex, offset, frame[CHUNK_HEADER.size :]
+
+
+def _append(path: str, offset: int, data: bytes) -> int:
+    with open(path, "r+b" if os.path.exists(path) else "wb") as f:
+        f.seek(offset)
+        f.write(data)
+        f.truncate()
+        return f.tell()
+
+
+def hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ChunkedUploadStore:
+    """Resumable uploads staged on disk as ``<id>.part`` plus ``<id>.json``.
+
+    The committed offset is simply the size of the ``.part`` file, so an
+    upload can continue after a reconnect (or on another worker sharing the
+    same disk) from wherever the last chunk landed. Uploads nobody has
+    touched for ``ttl`` seconds are swept away.
+
+    The plain methods do blocking file I/O; coroutines go through
+    ``write``/``complete`` or wrap them in ``run_in_threadpool``.
+    """
+
+    def __init__(
+        self,
+        directory: str = UPLOAD_TMP_DIR,
+        max_bytes: int = MAX_UPLOAD_BYTES,
+        ttl: float = UPLOAD_TMP_TTL,
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        # upload_id -> (offset hashed so far, running sha256)
+        self.hashers: dict[str, tuple] = {}
+        self.sweeper: asyncio.Task | None = None
+
+    def part_path(self, upload_id: str) -> str:
+        return os.path.join(self.directory, f"{upload_id}.part")
+
+    def meta_path(self, upload_id: str) -> str:
+        return os.path.join(self.directory, f"{upload_id}.json")
+
+    def create(self, owner_id: int, filename: str, mimetype: str, size: int, caption: str = "") -> dict:
+        if size < 0:
+            raise UploadError("Invalid upload size")
+        if size > self.max_bytes:
+            raise UploadError(f"File exceeds the {self.max_bytes} byte limit", status_code=413)
+        meta = {
+            "upload_id": uuid.uuid4().hex,
+            "owner_id": owner_id,
+            "filename": safe_filename(filename),
+            "mimetype": mimetype or "application/octet-stream",
+            "size": size,
+            "text": caption or "",
+        }
+        with open(self.meta_path(meta["upload_id"]), "w") as f:
+            json.dump(meta, f)
+        open(self.part_path(meta["upload_id"]), "wb").close()
+        return meta
+
+    def get(self, upload_id: str, owner_id: int) -> dict:
+        try:
+            upload_id = uuid.UUID(str(upload_id)).hex
+            with open(self.meta_path(upload_id)) as f:
+                meta = json.load(f)
+        except (ValueError, OSError):
+            raise UploadError("Unknown upload", status_code=404) from None
+        if meta["owner_id"] != owner_id:
+            raise UploadError("Unknown upload", status_code=404)
+        return meta
+
+    def offset(self, upload_id: str) -> int:
+        try:
+            return os.path.getsize(self.part_path(upload_id))
+        except OSError:
+            return 0
+
+    def append(self, upload_id: str, owner_id: int, offset: int, data: bytes) -> tuple[dict, int]:
+        meta = self.get(upload_id, owner_id)
+        current = self.offset(meta["upload_id"])
+        if offset != current:
+            raise UploadError("Offset mismatch", current, status_code=409)
+        if offset + len(data) > meta["size"]:
+            raise UploadError("Chunk exceeds declared size", current, status_code=413)
+        return meta, _append(self.part_path(meta["upload_id"]), offset, data)
+
+    async def write(self, upload_id: str, owner_id: int, offset: int, data: bytes) -> int:
+        meta, new_offset = await run_in_threadpool(self.append, upload_id, owner_id, offset, data)
+
+        # Hash as bytes stream in; a resumed upload in another process rehashes on completion
+        hashed = self.hashers.get(meta["upload_id"])
+        if offset == 0:
+            hashed = (0, hashlib.sha256())
+        if hashed and hashed[0] == offset:
+            hashed[1].update(data)
+            self.hashers[meta["upload_id"]] = (new_offset, hashed[1])
+        else:
+            self.hashers.pop(meta["upload_id"], None)
+        return new_offset
+
+    def finished(self, upload_id: str, owner_id: int) -> dict:
+        meta = self.get(upload_id, owner_id)
+        current = self.offset(meta["upload_id"])
+        if current != meta["size"]:
+            raise UploadError("Upload incomplete", current, status_code=409)
+        meta["part_path"] = self.part_path(meta["upload_id"])
+        return meta
+
+    async def complete(self, upload_id: str, owner_id: int) -> dict:
+        # Leaves the finished .part in place for the attachment store to adopt
+        meta = await run_in_threadpool(self.finished, upload_id, owner_id)
+        current = meta["size"]
+        hashed = self.hashers.pop(meta["upload_id"], None)
+        if hashed and hashed[0] == current:
+            meta["sha256"] = hashed[1].hexdigest()
+        else:
+            meta["sha256"] = await run_in_threadpool(hash_file, meta["part_path"])
+        return meta
+
+    def discard(self, upload_id: str):
+        self.hashers.pop(upload_id, None)
+        for path in (self.part_path(upload_id), self.meta_path(upload_id)):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def sweep(self, now: float | None = None) -> int:
+        """Delete uploads whose files have not changed for ``ttl`` seconds."""
+        cutoff = (now or time.time()) - self.ttl
+        last_touched: dict[str, float] = {}
+        for entry in os.scandir(self.directory):
+            upload_id, ext = os.path.splitext(entry.name)
+            if ext in (".part", ".json"):
+                try:
+                    mtime = entry.stat().st_mtime
+                except OSError:
+                    continue
+                last_touched[upload_id] = max(mtime, last_touched.get(upload_id, 0))
+        stale = [upload_id for upload_id, mtime in last_touched.items() if mtime < cutoff]
+        for upload_id in stale:
+            with contextlib.suppress(OSError):
+                self.discard(upload_id)
+        return len(stale)
+
+    async def sweep_loop(self):
+        while True:
+            try:
+                removed = await run_in_threadpool(self.sweep)
+                if removed:
+                    logger.info("Removed %d abandoned uploads", removed)
+            except Exception:
+                logger.exception("Upload sweep failed")
+            await asyncio.sleep(min(self.ttl, 3600))
+
+    async def start(self):
+        if self.sweeper is None:
+            self.sweeper = asyncio.create_task(self.sweep_loop())
+
+    async def stop(self):
+        if self.sweeper is not None:
+            self.sweeper.cancel()
+            self.sweeper = None
+
+
+upload_store = ChunkedUploadStore()
+
+
+async def receive_frame(websocket: WebSocket) -> str | bytes:
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000))
+    if message.get("bytes") is not None:
+        return message["bytes"]
+    return message.get("text") or ""
+
+
+async def handle_upload_frame(
+    conn: ClientConnection, owner_id: int, frame: dict | bytes, directory: str
+) -> dict | None:
+    """Drive the init/chunk/commit protocol for one frame.
+
+    Returns the upload's metadata (with ``path`` under ``directory``) once a
+    commit succeeds so the caller can store and fan out the file message;
+    otherwise replies on the connection itself and returns None.
+    """
+    upload_id = frame.get("upload_id") if isinstance(frame, dict) else None
+    try:
+        if isinstance(frame, bytes):
+            upload_id, offset, data = parse_chunk(frame)
+            offset = await upload_store.write(upload_id, owner_id, offset, data)
+            await conn.send(
+                encode({"type": "upload_progress", "upload_id": upload_id, "offset": offset})
+            )
+            return None
+
+        if frame["type"] == "upload_init":
+            if frame.get("sha256") and not upload_id:
+                # Content we already store is attached without sending any bytes
+                filename = await run_db(
+                    acquire,
+                    directory,
+                    frame["sha256"],
+                    owner_id,
+                    frame.get("filename"),
+                    frame.get("mimetype"),
+                )
+                if filename:
+                    await conn.send(
+                        encode({"type": "upload_ready", "upload_id": None, "deduplicated": True})
+                    )
+                    return {
+                        "path": os.path.join(directory, filename),
+                        "mimetype": frame.get("mimetype") or "application/octet-stream",
+                        "text": frame.get("text") or "",
+                    }
+            if upload_id:
+                meta = await run_in_threadpool(upload_store.get, upload_id, owner_id)
+            else:
+                size = frame.get("size", 0)
+                if isinstance(size, bool) or not isinstance(size, int):
+                    raise UploadError("Invalid upload size")
+                meta = await run_in_threadpool(
+                    upload_store.create,
+                    owner_id,
+                    frame.get("filename"),
+                    frame.get("mimetype"),
+                    size,
+                    frame.get("text"),
+                )
+            offset = await run_in_threadpool(upload_store.offset, meta["upload_id"])
+            await conn.send(
+                encode(
+                    {
+                        "type": "upload_ready",
+                        "upload_id": meta["upload_id"],
+                        "offset": offset,
+                        "chunk_size": UPLOAD_CHUNK_SIZE,
+                    }
+                )
+            )
+            return None
+
+        if frame["type"] == "upload_commit":
+            meta = await upload_store.complete(upload_id, owner_id)
+            filename = await run_db(
+                commit_file,
+                directory,
+                meta["part_path"],
+                meta["sha256"],
+                meta["size"],
+                meta["filename"],
+                meta["mimetype"],
+            )
+            await run_in_threadpool(upload_store.discard, meta["upload_id"])
+            meta["path"] = os.path.join(directory, filename)
+            return meta
+
+        if frame["type"] == "upload_abort":
+            meta = await run_in_threadpool(upload_store.get, upload_id, owner_id)
+            await run_in_threadpool(upload_store.discard, meta["upload_id"])
+    except UploadError as exc:
+        await conn.send(
+            encode(
+                {
+                    "type": "upload_error",
+                    "upload_id": upload_id,
+                    "detail": str(exc),
+                    "offset": exc.offset,
+                }
+            )
+        )
+    return None
@@ -8,3 +8,49 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 60))
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", 50))
+HISTORY_MAX_PAGE_SIZE = int(os.getenv("HISTORY_MAX_PAGE_SIZE", 200))
+BROKER_URL = os.getenv("BROKER_URL")
+SEND_QUEUE_SIZE = int(os.getenv("SEND_QUEUE_SIZE", 256))
+# "disconnect" closes a socket whose queue overflows, "drop" discards its oldest frame
+SLOW_CONSUMER_POLICY = os.getenv("SLOW_CONSUMER_POLICY", "disconnect")
+# Threads serving blocking DB calls from WebSocket handlers; keep it within the
+# engine's connection pool (5 + 10 overflow by default)
+DB_EXECUTOR_WORKERS = int(os.getenv("DB_EXECUTOR_WORKERS", 10))
+# Write-behind message persistence (PostgreSQL only), off by default
+MESSAGE_WRITE_BEHIND = os.getenv("MESSAGE_WRITE_BEHIND", "false").lower() in ("1", "true", "yes")
+MESSAGE_BATCH_SIZE = int(os.getenv("MESSAGE_BATCH_SIZE", 200))
+MESSAGE_FLUSH_INTERVAL = float(os.getenv("MESSAGE_FLUSH_INTERVAL", 0.05))
+MESSAGE_QUEUE_SIZE = int(os.getenv("MESSAGE_QUEUE_SIZE", 10000))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 10000))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", 300))
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", 50000))
+TOKEN_CACHE_TTL = float(os.getenv("TOKEN_CACHE_TTL", 300))
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", 100 * 1024 * 1024))
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", 256 * 1024))
+# Staged chunked uploads untouched this long (seconds) are deleted
+UPLOAD_TMP_TTL = float(os.getenv("UPLOAD_TMP_TTL", 24 * 3600))
+MAX_IMAGE_BYTES = int(os.getenv("MAX_IMAGE_BYTES", 10 * 1024 * 1024))
+# Image previews (needs Pillow); thumbnails are rendered in a process pool
+THUMBNAIL_SIZE = int(os.getenv("THUMBNAIL_SIZE", 320))
+THUMBNAIL_WORKERS = int(os.getenv("THUMBNAIL_WORKERS", 2))
+PREVIEW_CACHE_SIZE = int(os.getenv("PREVIEW_CACHE_SIZE", 10000))
+# Object storage for uploads: unset keeps them on local disk, "s3://bucket/prefix"
+# uses S3 (S3_ENDPOINT_URL points at MinIO or another S3-compatible service)
+STORAGE_URL = os.getenv("STORAGE_URL")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL")
+S3_URL_EXPIRES = int(os.getenv("S3_URL_EXPIRES", 3600))
+# Read frames arriving within this window are acknowledged as one watermark
+READ_ACK_DELAY = float(os.getenv("READ_ACK_DELAY", 0.25))
+# Most recent distinct watermarks sent in a room's "seen_by" frame
+SEEN_BY_STEPS = int(os.getenv("SEEN_BY_STEPS", 100))
+# Presence: idle sockets get a ping every PRESENCE_PING_INTERVAL seconds and are
+# dropped after PRESENCE_IDLE_TIMEOUT without any frame; online/offline changes
+# are batched for PRESENCE_DEBOUNCE seconds so quick reconnects cancel out
+PRESENCE_PING_INTERVAL = float(os.getenv("PRESENCE_PING_INTERVAL", 25))
+PRESENCE_IDLE_TIMEOUT = float(os.getenv("PRESENCE_IDLE_TIMEOUT", 60))
+PRESENCE_DEBOUNCE = float(os.getenv("PRESENCE_DEBOUNCE", 1))
+PRESENCE_QUERY_LIMIT = int(os.getenv("PRESENCE_QUERY_LIMIT", 500))
+# Autocomplete results for hot prefixes are kept briefly in process
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", 5000))
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", 30))
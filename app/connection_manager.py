@@ -1,63 +1,220 @@
+import asyncio
+import contextlib
+from collections import deque
+from collections.abc import Callable
+
 from fastapi import WebSocket
-from typing import Dict, Tuple, List, Union
-import json
+
+from app.broker import InMemoryBroker
+from app.broker import broker as default_broker
+from app.config import SEND_QUEUE_SIZE, SLOW_CONSUMER_POLICY
+from app.frames import encode
+
+
+class ClientConnection:
+    """A socket plus its outbound frames, drained by its own writer task.
+
+    Fan-out frames (``offer``) are bounded by ``queue_size`` and trip the
+    slow-consumer policy when the client falls behind. Replies the client
+    asked for (``send``: history pages, errors, upload progress) are written
+    in the same order but never count toward that limit; they get their own
+    ``queue_size`` slots and wait for room instead, so a long history page
+    cannot get the socket closed with 1013.
+    """
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        on_close: Callable[["ClientConnection"], None] | None = None,
+        queue_size: int = SEND_QUEUE_SIZE,
+        policy: str = SLOW_CONSUMER_POLICY,
+    ):
+        self.websocket = websocket
+        self.on_close = on_close
+        self.policy = policy
+        self.queue_size = queue_size
+        # (frame, is_reply) in write order, and how many of each are waiting
+        self.frames: deque[tuple[str, bool]] = deque()
+        self.backlog = 0
+        self.replies = 0
+        self.pending = asyncio.Event()
+        self.reply_room = asyncio.Event()
+        self.closed = False
+        self.writer = asyncio.create_task(self.write_loop())
+
+    def offer(self, msg: str) -> bool:
+        # Never awaits, so one slow client cannot hold up the rest of a fan-out
+        if self.closed:
+            return False
+        if self.backlog >= self.queue_size:
+            if self.policy != "drop":
+                self.close(code=1013)
+                return False
+            self.drop_oldest()
+        self.frames.append((msg, False))
+        self.backlog += 1
+        self.pending.set()
+        return True
+
+    def drop_oldest(self):
+        for index, (_, is_reply) in enumerate(self.frames):
+            if not is_reply:
+                del self.frames[index]
+                self.backlog -= 1
+                return
+
+    async def send(self, msg: str) -> bool:
+        while self.replies >= self.queue_size and not self.closed:
+            self.reply_room.clear()
+            await self.reply_room.wait()
+        if self.closed:
+            return False
+        self.frames.append((msg, True))
+        self.replies += 1
+        self.pending.set()
+        return True
+
+    def drain(self):
+        # Wakes any send() blocked on frames nobody will write out
+        self.frames.clear()
+        self.backlog = self.replies = 0
+        self.reply_room.set()
+
+    async def write_loop(self):
+        try:
+            while True:
+                while not self.frames:
+                    self.pending.clear()
+                    await self.pending.wait()
+                msg, is_reply = self.frames.popleft()
+                if is_reply:
+                    self.replies -= 1
+                    self.reply_room.set()
+                else:
+                    self.backlog -= 1
+                await self.websocket.send_text(msg)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Dead socket: stop writing and let the manager forget it
+            self.closed = True
+            self.drain()
+            if self.on_close:
+                self.on_close(self)
+
+    def close(self, code: int | None = None):
+        if self.closed:
+            return
+        self.closed = True
+        self.writer.cancel()
+        self.drain()
+        if self.on_close:
+            self.on_close(self)
+        if code is not None:
+            asyncio.create_task(self.close_socket(code))
+
+    async def close_socket(self, code: int):
+        with contextlib.suppress(Exception):
+            await self.websocket.close(code=code)
+
 
 class ConnectionManager:
-    def __init__(self):
-        self.rooms_active_user: dict[int, list[WebSocket]] = {}
+    def __init__(self, broker: InMemoryBroker | None = None):
+        self.rooms_active_user: dict[int, list[ClientConnection]] = {}
+        self.broker = broker or default_broker
+        self.broker.subscribe("room:", self.deliver)
 
-    async def connect(self, websocket: WebSocket, roomid: int):
+    async def connect(self, websocket: WebSocket, roomid: int) -> ClientConnection:
+        await self.broker.start()
         await websocket.accept()
         if roomid not in self.rooms_active_user:
             self.rooms_active_user[roomid] = []
-        self.rooms_active_user[roomid].append(websocket)
+        conn = ClientConnection(websocket, on_close=lambda conn: self.prune(conn, roomid))
+        self.rooms_active_user[roomid].append(conn)
+        return conn
+
+    async def brodcast(self, msg: str | dict, roomid: int):
+        if isinstance(msg, dict):
+            msg = encode(msg)
+        # Every worker subscribed to the broker delivers to its own sockets
+        await self.broker.publish(f"room:{roomid}", msg)
 
-    async def brodcast(self, msg: str, roomid: int):
+    async def deliver(self, key: str, msg: str):
+        roomid = int(key)
         if roomid in self.rooms_active_user:
-            for user in self.rooms_active_user[roomid]:
-                await user.send_text(msg)
+            for conn in list(self.rooms_active_user[roomid]):
+                conn.offer(msg)
 
-    def disconnect(self, websocket: WebSocket, roomid: int):
+    def prune(self, conn: ClientConnection, roomid: int):
         if roomid in self.rooms_active_user:
-            self.rooms_active_user[roomid].remove(websocket)
+            if conn in self.rooms_active_user[roomid]:
+                self.rooms_active_user[roomid].remove(conn)
             if not self.rooms_active_user[roomid]:
                 del self.rooms_active_user[roomid]
 
+    def disconnect(self, websocket: WebSocket, roomid: int):
+        for conn in list(self.rooms_active_user.get(roomid, [])):
+            if conn.websocket is websocket:
+                conn.close()
+
 class UserConnectionManager:
-    def __init__(self):
-        # user_id -> list of (receiver_id, websocket) connections
-        self.active_user: Dict[int, List[Tuple[int, WebSocket]]] = {}
-    
-    async def connect(self,sender_id : int, receiver_id : int, websocket: WebSocket):
+    def __init__(self, broker: InMemoryBroker | None = None):
+        # user_id -> list of (receiver_id, connection) pairs
+        self.active_user: dict[int, list[tuple[int, ClientConnection]]] = {}
+        self.broker = broker or default_broker
+        self.broker.subscribe("dm:", self.deliver)
+
+    async def connect(self,sender_id : int, receiver_id : int, websocket: WebSocket) -> ClientConnection:
+        await self.broker.start()
         await websocket.accept()
         if sender_id not in self.active_user:
             self.active_user[sender_id] = []
-        self.active_user[sender_id].append((receiver_id, websocket))
+        conn = ClientConnection(
+            websocket, on_close=lambda conn: self.prune(sender_id, receiver_id, conn)
+        )
+        self.active_user[sender_id].append((receiver_id, conn))
+        return conn
 
-    async def send_msg(self, sender_id: int, receiver_id: int, msg: Union[str, dict]):
+    async def send_msg(self, sender_id: int, receiver_id: int, msg: str | dict):
         if isinstance(msg, dict):
-            msg = json.dumps(msg)  # convert dict to JSON string
+            msg = encode(msg)  # encoded once for every recipient
+        await self.broker.publish(f"dm:{sender_id}:{receiver_id}", msg)
+
+    async def deliver(self, key: str, msg: str):
+        sender_id, receiver_id = (int(part) for part in key.split(":"))
 
         # Send to receiver if connected
         if receiver_id in self.active_user:
-            for receiver, websocket in self.active_user[receiver_id]:
+            for receiver, conn in list(self.active_user[receiver_id]):
                 if receiver == sender_id:
-                    await websocket.send_text(msg)
+                    conn.offer(msg)
 
         # Optionally: also send to sender if connected (e.g., for delivery status)
         if sender_id in self.active_user:
-            for receiver, websocket in self.active_user[sender_id]:
+            for receiver, conn in list(self.active_user[sender_id]):
                 if receiver == receiver_id:
-                    await websocket.send_text(msg)
+                    conn.offer(msg)
 
-    async def disconnect(self, sender_id: int, receiver_id: int, websocket: WebSocket):
+    def offer_to_watchers(self, frames: dict[int, str]):
+        # frames: peer id -> frame for every local socket chatting with that peer
+        for connections in list(self.active_user.values()):
+            for receiver_id, conn in connections:
+                if receiver_id in frames:
+                    conn.offer(frames[receiver_id])
+
+    def prune(self, sender_id: int, receiver_id: int, conn: ClientConnection):
         if sender_id in self.active_user:
-            # Filter out the exact (receiver_id, websocket) pair
+            # Filter out the exact (receiver_id, connection) pair
             self.active_user[sender_id] = [
-                (rid, ws) for (rid, ws) in self.active_user[sender_id]
-                if not (rid == receiver_id and ws == websocket)
+                (rid, c) for (rid, c) in self.active_user[sender_id]
+                if not (rid == receiver_id and c is conn)
             ]
 
             # If sender has no more connections, remove the sender
             if not self.active_user[sender_id]:
                 del self.active_user[sender_id]
+
+    async def disconnect(self, sender_id: int, receiver_id: int, websocket: WebSocket):
+        for rid, conn in list(self.active_user.get(sender_id, [])):
+            if rid == receiver_id and conn.websocket is websocket:
+                conn.close()
@@ -0,0 +1,71 @@
+import json
+from datetime import datetime
+
+try:
+    import orjson
+except ImportError:  # optional speedup
+    orjson = None
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+class FrameError(ValueError):
+    """A client frame with a missing or mistyped field."""
+
+
+def encode(payload: dict) -> str:
+    # Encode an outbound event once; the same string is queued for every recipient
+    if orjson is not None:
+        return orjson.dumps(payload, default=str).decode()
+    return json.dumps(payload, default=str, separators=(",", ":"))
+
+
+def error_frame(detail: str) -> dict:
+    return {"type": "error", "detail": detail}
+
+
+def int_field(frame: dict, key: str, minimum: int = 0) -> int | None:
+    value = frame.get(key)
+    if value is None:
+        return None
+    # bool is an int subclass, but true is never a message id
+    if isinstance(value, bool) or not isinstance(value, int) or value < minimum:
+        raise FrameError(f"'{key}' must be an integer >= {minimum}")
+    return value
+
+
+def str_field(frame: dict, key: str) -> str:
+    value = frame.get(key)
+    if not isinstance(value, str):
+        raise FrameError(f"'{key}' must be a string")
+    return value
+
+
+def preview_frame(message_id: int, file_url: str, preview: dict) -> dict:
+    # Follows a file message once its thumbnail is ready
+    return {"type": "file_preview", "message_id": message_id, "file_url": file_url, **preview}
+
+
+def timestamp(ts: datetime | None) -> str | None:
+    return ts.strftime(TIMESTAMP_FORMAT) if ts else None
+
+
+def message_frame(
+    frame_type: str,
+    message_id: int | None,
+    sender: str,
+    text: str | None,
+    ts: datetime | None = None,
+    file_url: str | None = None,
+    **fields,
+) -> dict:
+    # Shared shape for text, file and status events
+    return {
+        "type": frame_type,
+        "message_id": message_id,
+        "timestamp": timestamp(ts or datetime.now()),
+        "sender": sender,
+        "text": text,
+        "file_url": file_url,
+        **fields,
+    }
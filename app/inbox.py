@@ -0,0 +1,351 @@
+from sqlalchemy import and_, case, func, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from app.room_directory import record_activity
+from app.utils import page_size
+from database.models import (
+    Chatroom,
+    ConversationSummary,
+    Message,
+    RoomMembers,
+    User,
+    conversation_key,
+)
+
+# Maintains conversation_summaries, the materialized /home inbox for direct
+# chats: one row per user and peer with the latest message and how many are
+# unread, written in the same transaction as the messages / statuses they
+# reflect. Rooms are not fanned out per member: their inbox entries come from
+# the chatroom's last message and each member's read watermark.
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+
+def message_row(message: Message) -> dict:
+    return {
+        "id": message.id,
+        "sender_id": message.sender_id,
+        "receiver_id": message.receiver_id,
+        "room_id": message.room_id,
+        "sent_at": message.sent_at,
+        "status": message.status,
+    }
+
+
+def _newer(current, candidate_id, candidate):
+    # Commits can land out of order, so only ever move a summary forward
+    return case(
+        (candidate_id > func.coalesce(ConversationSummary.last_message_id, 0), candidate),
+        else_=current,
+    )
+
+
+def _upsert(db: Session, values: list[dict], conflict_column: str):
+    dialect = postgresql if db.get_bind().dialect.name == "postgresql" else sqlite
+    stmt = dialect.insert(ConversationSummary).values(values)
+    excluded = stmt.excluded
+    db.execute(
+        stmt.on_conflict_do_update(
+            index_elements=["user_id", conflict_column],
+            set_={
+                "last_message_id": _newer(
+                    ConversationSummary.last_message_id,
+                    excluded.last_message_id,
+                    excluded.last_message_id,
+                ),
+                "last_message_at": _newer(
+                    ConversationSummary.last_message_at,
+                    excluded.last_message_id,
+                    excluded.last_message_at,
+                ),
+                "unread_count": ConversationSummary.unread_count + excluded.unread_count,
+            },
+        )
+    )
+
+
+def record_messages(db: Session, rows: list[dict]):
+    """Fold newly inserted messages (see ``message_row``) into the summaries."""
+    direct: dict[tuple[int, int], dict] = {}
+    rooms: dict[int, dict] = {}
+    for row in rows:
+        if row["receiver_id"] is not None:
+            sides = (
+                (row["sender_id"], row["receiver_id"], 0),
+                (row["receiver_id"], row["sender_id"], int(row["status"] != "read")),
+            )
+            for owner_id, peer_id, unread in sides:
+                entry = direct.setdefault(
+                    (owner_id, peer_id),
+                    {
+                        "user_id": owner_id,
+                        "peer_id": peer_id,
+                        "last_message_id": 0,
+                        "last_message_at": None,
+                        "unread_count": 0,
+                    },
+                )
+                if row["id"] > entry["last_message_id"]:
+                    entry["last_message_id"] = row["id"]
+                    entry["last_message_at"] = row["sent_at"]
+                entry["unread_count"] += unread
+        elif row["room_id"] is not None:
+            last = rooms.get(row["room_id"])
+            if last is None or row["id"] > last["id"]:
+                rooms[row["room_id"]] = row
+
+    if direct:
+        _upsert(db, list(direct.values()), "peer_id")
+
+    # Rooms keep no per-member rows: the chatroom's last message is all that
+    # moves, and members' unread counts are derived from it when read
+    for room_id, last in rooms.items():
+        record_activity(db, room_id, last["id"], last["sent_at"])
+
+
+def refresh_unread(db: Session, pairs: set[tuple[int, int]]):
+    """Recount unread direct messages for (receiver_id, sender_id) pairs."""
+    for receiver_id, sender_id in pairs:
+        unread = (
+            select(func.count(Message.id))
+            .where(
+                Message.receiver_id == receiver_id,
+                Message.sender_id == sender_id,
+                Message.status != "read",
+            )
+            .scalar_subquery()
+        )
+        db.execute(
+            update(ConversationSummary)
+            .where(
+                ConversationSummary.user_id == receiver_id,
+                ConversationSummary.peer_id == sender_id,
+            )
+            .values(unread_count=unread)
+            .execution_options(synchronize_session=False)
+        )
+
+
+def refresh_unread_for(db: Session, message_ids: list[int]):
+    if not message_ids:
+        return
+    pairs = db.execute(
+        select(Message.receiver_id, Message.sender_id)
+        .where(Message.id.in_(message_ids), Message.receiver_id.isnot(None))
+        .distinct()
+    )
+    refresh_unread(db, {tuple(pair) for pair in pairs})
+
+
+def mark_read_up_to(
+    db: Session, reader_id: int, peer_id: int, up_to: int | None = None
+) -> int | None:
+    """Advance the reader's watermark for a direct chat in one write.
+
+    ``up_to=None`` marks the whole conversation read. Returns the new
+    watermark, or None when it did not move.
+    """
+    summary = (
+        db.query(ConversationSummary)
+        .filter_by(user_id=reader_id, peer_id=peer_id)
+        .with_for_update()
+        .first()
+    )
+    if summary is None or summary.last_message_id is None:
+        return None
+    latest = summary.last_message_id
+    up_to = latest if up_to is None else min(int(up_to), latest)
+    previous = summary.last_read_message_id or 0
+    if up_to <= previous:
+        return None
+
+    # Per-message status stays in step for clients that still render it
+    received = (
+        Message.conversation_key == conversation_key(reader_id, peer_id),
+        Message.receiver_id == reader_id,
+        Message.status != "read",
+    )
+    db.execute(
+        update(Message)
+        .where(*received, Message.id > previous, Message.id <= up_to)
+        .values(status="read")
+        .execution_options(synchronize_session=False)
+    )
+    summary.last_read_message_id = up_to
+    if up_to == latest:
+        summary.unread_count = 0
+    else:
+        summary.unread_count = (
+            db.query(func.count(Message.id)).filter(*received, Message.id > up_to).scalar()
+        )
+    db.commit()
+    return up_to
+
+
+def mark_room_read_up_to(
+    db: Session, user_id: int, room_id: int, up_to: int | None = None
+) -> int | None:
+    """Advance a member's watermark for a room: one row, whatever the room size."""
+    latest = db.query(func.max(Message.id)).filter(Message.room_id == room_id).scalar()
+    if latest is None:
+        return None
+    up_to = latest if up_to is None else min(int(up_to), latest)
+    moved = db.execute(
+        update(RoomMembers)
+        .where(
+            RoomMembers.user_id == user_id,
+            RoomMembers.room_id == room_id,
+            func.coalesce(RoomMembers.last_read_message_id, 0) < up_to,
+        )
+        .values(last_read_message_id=up_to)
+        .execution_options(synchronize_session=False)
+    )
+    if not moved.rowcount:
+        return None
+    db.commit()
+    return up_to
+
+
+def room_unread(db: Session, user_id: int, room_ids: list[int] | None = None) -> dict:
+    """Count unread messages per room the user is in, keyed by room id.
+
+    Each count is a range on ix_messages_room_id_id: the messages after the
+    member's watermark up to the room's last message, less their own.
+    """
+    query = (
+        db.query(RoomMembers.room_id, func.count(Message.id))
+        .join(Chatroom, Chatroom.id == RoomMembers.room_id)
+        .join(
+            Message,
+            and_(
+                Message.room_id == RoomMembers.room_id,
+                Message.id > func.coalesce(RoomMembers.last_read_message_id, 0),
+                Message.id <= Chatroom.last_message_id,
+            ),
+        )
+        .filter(RoomMembers.user_id == user_id, Message.sender_id != user_id)
+    )
+    if room_ids is not None:
+        query = query.filter(RoomMembers.room_id.in_(room_ids))
+    return dict(query.group_by(RoomMembers.room_id).all())
+
+
+def fetch_unread(db: Session, user_id: int) -> dict:
+    # Direct chats straight from the summaries; rooms from their watermarks
+    rows = (
+        db.query(ConversationSummary)
+        .filter(
+            ConversationSummary.user_id == user_id,
+            ConversationSummary.peer_id.isnot(None),
+            ConversationSummary.unread_count > 0,
+        )
+        .all()
+    )
+    conversations = [
+        {
+            "type": "personal",
+            "receiver_id": row.peer_id,
+            "room_id": None,
+            "unread_count": row.unread_count,
+            "last_read_message_id": row.last_read_message_id,
+        }
+        for row in rows
+    ]
+    unread = room_unread(db, user_id)
+    if unread:
+        watermarks = dict(
+            db.query(RoomMembers.room_id, RoomMembers.last_read_message_id).filter(
+                RoomMembers.user_id == user_id, RoomMembers.room_id.in_(list(unread))
+            )
+        )
+        conversations.extend(
+            {
+                "type": "group",
+                "receiver_id": None,
+                "room_id": room_id,
+                "unread_count": count,
+                "last_read_message_id": watermarks.get(room_id),
+            }
+            for room_id, count in unread.items()
+        )
+    return {
+        "total": sum(entry["unread_count"] for entry in conversations),
+        "conversations": conversations,
+    }
+
+
+def fetch_inbox(
+    db: Session, user_id: int, before: int | None = None, limit: int | None = None
+) -> dict:
+    limit = page_size(limit)
+    # Each side is already in last-message order; take a page of both and merge
+    direct = (
+        db.query(ConversationSummary, Message, User)
+        .join(Message, Message.id == ConversationSummary.last_message_id)
+        # Skips summaries whose peer has since been deleted
+        .join(User, User.id == ConversationSummary.peer_id)
+        .filter(ConversationSummary.user_id == user_id)
+    )
+    rooms = (
+        db.query(RoomMembers, Message, Chatroom)
+        .join(Chatroom, Chatroom.id == RoomMembers.room_id)
+        .join(Message, Message.id == Chatroom.last_message_id)
+        .filter(RoomMembers.user_id == user_id)
+    )
+    if before is not None:
+        direct = direct.filter(ConversationSummary.last_message_id < before)
+        rooms = rooms.filter(Chatroom.last_message_id < before)
+    # Message ids grow with time, so the latest message id orders the inbox
+    rows = sorted(
+        direct.order_by(ConversationSummary.last_message_id.desc()).limit(limit + 1).all()
+        + rooms.order_by(Chatroom.last_message_id.desc()).limit(limit + 1).all(),
+        key=lambda row: row[1].id,
+        reverse=True,
+    )
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    unread = room_unread(
+        db, user_id, [row[2].id for row in rows if isinstance(row[2], Chatroom)]
+    )
+
+    conversations = []
+    for owner, message, other in rows:
+        last_message = {
+            "message_id": message.id,
+            "sender_id": message.sender_id,
+            "content": message.content,
+            "status": message.status,
+            "timestamp": message.sent_at.strftime(TIMESTAMP_FORMAT),
+            "file_url": message.file_url,
+            "file_type": message.file_type,
+        }
+        if isinstance(other, User):
+            conversations.append(
+                {
+                    "type": "personal",
+                    "receiver_id": other.id,
+                    "receiver_full_name": f"{other.first_name} {other.last_name}",
+                    "username": other.username,
+                    "unread_count": owner.unread_count,
+                    "last_read_message_id": owner.last_read_message_id,
+                    "last_message": last_message,
+                }
+            )
+        else:
+            conversations.append(
+                {
+                    "type": "group",
+                    "room_id": other.id,
+                    "roomname": other.roomname,
+                    "content": message.content,
+                    "timestamp": last_message["timestamp"],
+                    "unread_count": unread.get(other.id, 0),
+                    "last_message": last_message,
+                }
+            )
+    return {
+        "conversations": conversations,
+        "next_before": rows[-1][1].id if rows and has_more else None,
+        "has_more": has_more,
+    }
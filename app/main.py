@@ -1,16 +1,48 @@
-import os
+from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
 
-from app.database import engine
-from app.routes import auth, chats, communication, home, profile, search, user_to_user
+from app import thumbnails
+from app.broker import broker
+from app.chunked_upload import upload_store
+from app.database import db_executor, engine
+from app.media import MediaFiles
+from app.message_writer import message_writer
+from app.presence import presence
+from app.routes import (
+    attachments,
+    auth,
+    chats,
+    communication,
+    home,
+    metrics,
+    profile,
+    search,
+    user_to_user,
+)
+from app.routes import presence as presence_routes
+from app.storage import storage
 from database.models import Base
 
 Base.metadata.create_all(bind=engine)
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    await broker.start()
+    await upload_store.start()
+    yield
+    # Before broker.stop so peers hear that this node's users went offline
+    await presence.stop()
+    await broker.stop()
+    await message_writer.stop()
+    db_executor.shutdown()
+    thumbnails.shutdown()
+    await upload_store.stop()
+
+
+app = FastAPI(lifespan=lifespan)
 origins = [
     "http://127.0.0.1:8000",
     "http://localhost:8000",
@@ -32,29 +64,22 @@ app.include_router(auth.router)
 app.include_router(profile.router)
 app.include_router(search.router)
 app.include_router(user_to_user.router)
-
-app.mount(
-    "/profile_images",
-    StaticFiles(directory=profile.UPLOAD_PROFILE_DIR),  # app/uploads/profile_pics/
-    name="profile_images",
-)
-
-app.mount(
-    "/uploads/messages",  # URL path where files can be accessed
-    StaticFiles(
-        directory=os.path.join("uploads", "messages")
-    ),  # Correct path to the 'uploads/messages' directory
-    name="message_files",
-)
-
-app.mount(
-    "/uploads/group-image",  # URL path where files can be accessed
-    StaticFiles(
-        directory=os.path.join("uploads", "group-image")
-    ),  # Correct path to the 'uploads/messages' directory
-    name="group-images",
-)
+app.include_router(attachments.router)
 
 app.include_router(home.router)
+app.include_router(presence_routes.router)
+app.include_router(metrics.router)
 app.include_router(user_to_user.router)
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+
+if storage.presigned:
+    # Objects live in a bucket; media URLs redirect to pre-signed downloads
+    app.include_router(attachments.media_router)
+else:
+    app.mount(
+        "/profile_images",
+        MediaFiles(directory=profile.UPLOAD_PROFILE_DIR),  # app/uploads/profile_pics/
+        name="profile_images",
+    )
+    # One mount covers messages/, group-image/, thumbnails/ and profile_pics/;
+    # staged chunked uploads in tmp/ are never served
+    app.mount("/uploads", MediaFiles(directory="uploads", hidden=("tmp",)), name="uploads")
@@ -0,0 +1,231 @@
+import gzip
+import mimetypes
+import os
+import re
+from email.utils import formatdate
+
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.responses import Response
+
+try:
+    import brotli
+except ImportError:  # optional: gzip variants only
+    brotli = None
+
+# Every stored name is content-addressed (or a legacy uuid), so a URL never
+# changes meaning and can be cached for good by browsers and CDNs
+IMMUTABLE = "public, max-age=31536000, immutable"
+CHUNK_SIZE = 256 * 1024
+CONTENT_HASH = re.compile(r"^[0-9a-f]{64}$")
+RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+# Worth shipping a .gz/.br next to the original; images/video are already packed
+COMPRESSIBLE_TYPES = {
+    "application/javascript",
+    "application/json",
+    "application/pdf",
+    "application/xml",
+    "image/svg+xml",
+}
+MIN_COMPRESS_BYTES = 1024
+# (Accept-Encoding token, file suffix) in order of preference
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+
+def is_compressible(mimetype: str | None) -> bool:
+    mimetype = (mimetype or "").split(";")[0].strip()
+    return mimetype.startswith("text/") or mimetype in COMPRESSIBLE_TYPES
+
+
+def precompress(path: str, mimetype: str | None):
+    """Write .gz (and .br with brotli installed) variants beside a stored file."""
+    if not is_compressible(mimetype) or os.path.getsize(path) < MIN_COMPRESS_BYTES:
+        return
+    with open(path, "rb") as f:
+        data = f.read()
+    variants = [(".gz", gzip.compress(data, 9, mtime=0))]
+    if brotli is not None:
+        variants.append((".br", brotli.compress(data)))
+    for suffix, encoded in variants:
+        if len(encoded) < len(data):
+            with open(path + suffix, "wb") as f:
+                f.write(encoded)
+
+
+def remove_variants(path: str):
+    for _, suffix in ENCODINGS:
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def strong_etag(path: str, stat_result: os.stat_result) -> str:
+    stem = os.path.splitext(os.path.basename(path))[0]
+    if CONTENT_HASH.match(stem):
+        return f'"{stem}"'
+    return f'"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+
+
+def etag_matches(header: str, etag: str) -> bool:
+    # If-None-Match uses weak comparison, so W/"x" matches "x"
+    tags = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return "*" in tags or etag in tags
+
+
+def accepted_encodings(header: str | None) -> set[str]:
+    accepted = set()
+    for part in (header or "").split(","):
+        token, _, params = part.strip().partition(";")
+        if params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            accepted.add(token.strip().lower())
+    return accepted
+
+
+def parse_range(header: str, size: int) -> tuple[int, int] | None:
+    """Single "bytes=" range as (start, end) inclusive; None to serve it all.
+
+    Multi-range requests are answered with the full body, which HTTP allows.
+    Raises ValueError when the range cannot be satisfied.
+    """
+    match = RANGE.match(header.strip())
+    if not match:
+        return None
+    start, end = match.groups()
+    if not start:
+        if not end:
+            return None
+        # Suffix range: the last N bytes
+        start, end = max(0, size - int(end)), size - 1
+    else:
+        start, end = int(start), min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise ValueError("Range not satisfiable")
+    return start, end
+
+
+class MediaFileResponse(Response):
+    """Serve (part of) a file, handing it to the server for zero-copy when it can."""
+
+    def __init__(
+        self,
+        path: str,
+        headers: dict,
+        start: int = 0,
+        length: int = 0,
+        status_code: int = 200,
+    ):
+        super().__init__(status_code=status_code, headers=headers)
+        self.path = path
+        self.start = start
+        self.length = length
+
+    async def __call__(self, scope, _receive, send):
+        await send(
+            {
+                "type": "http.response.start",
+                "status": self.status_code,
+                "headers": self.raw_headers,
+            }
+        )
+        if scope["method"] == "HEAD" or not self.length:
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        extensions = scope.get("extensions") or {}
+        f = await run_in_threadpool(open, self.path, "rb")
+        try:
+            if "http.response.zerocopysend" in extensions:
+                await send(
+                    {
+                        "type": "http.response.zerocopysend",
+                        "file": f,
+                        "offset": self.start,
+                        "count": self.length,
+                    }
+                )
+                return
+            await run_in_threadpool(f.seek, self.start)
+            remaining = self.length
+            while remaining:
+                chunk = await run_in_threadpool(f.read, min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send(
+                    {"type": "http.response.body", "body": chunk, "more_body": bool(remaining)}
+                )
+            if remaining:
+                # File shrank underneath us; close the body rather than hang
+                await send({"type": "http.response.body", "body": b""})
+        finally:
+            await run_in_threadpool(f.close)
+
+
+class MediaFiles(StaticFiles):
+    """``StaticFiles`` for immutable uploads.
+
+    Adds strong ETags (the content hash when the name is one), long-lived
+    immutable caching, single byte-range requests for media seeking,
+    precompressed ``.br``/``.gz`` variants and zero-copy sends where the
+    server supports them. Dot-files (in-flight temp files) and any
+    ``hidden`` top-level directories are never served.
+    """
+
+    def __init__(self, *args, hidden: tuple[str, ...] = (), **kwargs):
+        super().__init__(*args, **kwargs)
+        self.hidden = set(hidden)
+
+    async def get_response(self, path: str, scope):
+        parts = [part for part in re.split(r"[\\/]", path) if part and part != "."]
+        if (parts and parts[0] in self.hidden) or any(p.startswith(".") for p in parts):
+            raise HTTPException(status_code=404)
+        return await super().get_response(path, scope)
+
+    def file_response(self, full_path, stat_result, scope, status_code: int = 200):
+        full_path = str(full_path)
+        request_headers = Headers(scope=scope)
+        media_type = mimetypes.guess_type(full_path)[0] or "application/octet-stream"
+        range_header = request_headers.get("range")
+        size = stat_result.st_size
+        etag = strong_etag(full_path, stat_result)
+        headers = {
+            "last-modified": formatdate(stat_result.st_mtime, usegmt=True),
+            "cache-control": IMMUTABLE,
+            "accept-ranges": "bytes",
+        }
+
+        if is_compressible(media_type):
+            headers["vary"] = "Accept-Encoding"
+            accepted = accepted_encodings(request_headers.get("accept-encoding"))
+            for encoding, suffix in ENCODINGS:
+                # Ranges refer to the identity body, so those are served unencoded
+                if not range_header and encoding in accepted and os.path.exists(full_path + suffix):
+                    full_path += suffix
+                    size = os.path.getsize(full_path)
+                    etag = f'{etag[:-1]}-{encoding}"'
+                    headers["content-encoding"] = encoding
+                    break
+        headers["etag"] = etag
+
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match and etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=headers)
+
+        headers["content-type"] = media_type
+        if_range = request_headers.get("if-range")
+        if range_header and (not if_range or if_range == etag):
+            try:
+                byte_range = parse_range(range_header, size)
+            except ValueError:
+                headers["content-range"] = f"bytes */{size}"
+                return Response(status_code=416, headers=headers)
+            if byte_range is not None:
+                start, end = byte_range
+                headers["content-range"] = f"bytes {start}-{end}/{size}"
+                headers["content-length"] = str(end - start + 1)
+                return MediaFileResponse(full_path, headers, start, end - start + 1, 206)
+
+        headers["content-length"] = str(size)
+        return MediaFileResponse(full_path, headers, 0, size, status_code)
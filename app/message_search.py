@@ -0,0 +1,141 @@
+import html
+import re
+
+from sqlalchemy import and_, column, func, literal_column, or_, select, table
+from sqlalchemy.orm import Session
+
+from app.frames import timestamp
+from database.models import (
+    TEXT_SEARCH_CONFIG,
+    Message,
+    RoomMembers,
+    User,
+    conversation_key,
+)
+
+# Matches are marked with private-use characters inside the database, then the
+# snippet is HTML-escaped and the markers become <mark> tags, so message text can
+# never inject markup into the highlight
+MARK_START, MARK_STOP = "\ue000", "\ue001"
+SNIPPET_WORDS = 16
+TOKEN = re.compile(r"\w+", re.UNICODE)
+
+fts = table("messages_fts", column("rowid"))
+search_vector = literal_column("messages.search_vector")
+
+
+def fts5_query(text: str) -> str:
+    # Quote every word so user input can never be read as FTS5 query syntax
+    return " ".join(f'"{token}"' for token in TOKEN.findall(text))
+
+
+def visible_to(user_id: int):
+    """Messages in rooms the user belongs to and their own direct chats."""
+    rooms = select(RoomMembers.room_id).where(RoomMembers.user_id == user_id)
+    return or_(
+        Message.room_id.in_(rooms),
+        and_(
+            Message.receiver_id.isnot(None),
+            or_(Message.sender_id == user_id, Message.receiver_id == user_id),
+        ),
+    )
+
+
+def highlight(snippet: str | None) -> str:
+    return (
+        html.escape(snippet or "")
+        .replace(MARK_START, "<mark>")
+        .replace(MARK_STOP, "</mark>")
+    )
+
+
+def _postgres_rows(db: Session, text: str, filters: list, offset: int, limit: int):
+    query = func.websearch_to_tsquery(TEXT_SEARCH_CONFIG, text)
+    rank = func.ts_rank_cd(search_vector, query)
+    # Rank and page on the GIN index first; headlines are only built for the page
+    page = (
+        select(Message.id, rank.label("rank"))
+        .where(search_vector.op("@@")(query), *filters)
+        .order_by(rank.desc(), Message.id.desc())
+        .offset(offset)
+        .limit(limit)
+        .subquery()
+    )
+    headline = func.ts_headline(
+        TEXT_SEARCH_CONFIG,
+        Message.content,
+        query,
+        f"StartSel={MARK_START}, StopSel={MARK_STOP}, "
+        f"MaxWords={SNIPPET_WORDS}, MinWords={SNIPPET_WORDS // 3}, MaxFragments=2",
+    )
+    return db.execute(
+        select(Message, User.first_name, User.last_name, page.c.rank, headline)
+        .join(page, page.c.id == Message.id)
+        .join(User, User.id == Message.sender_id)
+        .order_by(page.c.rank.desc(), Message.id.desc())
+    ).all()
+
+
+def _sqlite_rows(db: Session, text: str, filters: list, offset: int, limit: int):
+    match = fts5_query(text)
+    if not match:
+        return []
+    fts_table = literal_column("messages_fts")
+    # bm25() is lower-is-better; flip it so both backends rank high to low
+    rank = -func.bm25(fts_table)
+    snippet = func.snippet(fts_table, 0, MARK_START, MARK_STOP, "…", SNIPPET_WORDS)
+    return db.execute(
+        select(Message, User.first_name, User.last_name, rank.label("rank"), snippet)
+        .select_from(fts)
+        .join(Message, Message.id == fts.c.rowid)
+        .join(User, User.id == Message.sender_id)
+        .where(fts_table.op("MATCH")(match), *filters)
+        .order_by(rank.desc(), Message.id.desc())
+        .offset(offset)
+        .limit(limit)
+    ).all()
+
+
+def search_messages(
+    db: Session,
+    user_id: int,
+    text: str,
+    room_id: int | None = None,
+    peer_id: int | None = None,
+    offset: int = 0,
+    limit: int = 20,
+) -> dict:
+    """Ranked full-text search over what ``user_id`` can read.
+
+    ``room_id`` / ``peer_id`` narrow it to one room or direct chat. Results
+    come best match first; pass ``next_offset`` back as ``offset`` for more.
+    """
+    filters = [visible_to(user_id)]
+    if room_id is not None:
+        filters.append(Message.room_id == room_id)
+    if peer_id is not None:
+        filters.append(Message.conversation_key == conversation_key(user_id, peer_id))
+
+    fetch = _postgres_rows if db.get_bind().dialect.name == "postgresql" else _sqlite_rows
+    rows = fetch(db, text, filters, offset, limit + 1)
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    return {
+        "results": [
+            {
+                "message_id": message.id,
+                "room_id": message.room_id,
+                "sender_id": message.sender_id,
+                "receiver_id": message.receiver_id,
+                "sender": f"{first_name} {last_name}",
+                "timestamp": timestamp(message.sent_at),
+                "file_url": message.file_url,
+                "snippet": highlight(snippet),
+                "rank": round(float(rank), 6),
+            }
+            for message, first_name, last_name, rank, snippet in rows
+        ],
+        "next_offset": offset + limit if has_more else None,
+        "has_more": has_more,
+    }
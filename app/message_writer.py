@@ -0,0 +1,238 @@
+import asyncio
+import logging
+from datetime import datetime
+
+from sqlalchemy import insert, text, update
+from sqlalchemy.exc import DataError, IntegrityError
+
+from app.config import (
+    MESSAGE_BATCH_SIZE,
+    MESSAGE_FLUSH_INTERVAL,
+    MESSAGE_QUEUE_SIZE,
+    MESSAGE_WRITE_BEHIND,
+)
+from app.database import engine, get_db_session, run_db
+from app.inbox import record_messages, refresh_unread_for
+from database.models import Message
+
+logger = logging.getLogger(__name__)
+
+# The database refuses these rows as written; retrying cannot help
+PERMANENT_ERRORS = (IntegrityError, DataError)
+
+COLUMNS = (
+    "id",
+    "content",
+    "sender_id",
+    "room_id",
+    "receiver_id",
+    "conversation_key",
+    "sent_at",
+    "status",
+    "file_url",
+    "file_type",
+)
+
+
+def reserve_message_ids(count: int) -> list[int]:
+    with get_db_session() as db:
+        rows = db.execute(
+            text(
+                "SELECT nextval(pg_get_serial_sequence('messages', 'id')) "
+                "FROM generate_series(1, :count)"
+            ),
+            {"count": count},
+        )
+        return [row[0] for row in rows]
+
+
+def insert_messages(rows: list[dict]):
+    with get_db_session() as db:
+        # executemany -> multi-row INSERT via SQLAlchemy's insertmanyvalues
+        db.execute(insert(Message), rows)
+        record_messages(db, rows)
+        db.commit()
+
+
+def update_message_statuses(rows: list[dict]):
+    with get_db_session() as db:
+        db.execute(update(Message), rows)
+        refresh_unread_for(db, [row["id"] for row in rows if row["status"] == "read"])
+        db.commit()
+
+
+class MessageWriter:
+    """Write-behind persistence for chat messages.
+
+    ``submit`` hands back a row with its id and timestamp already assigned so
+    the caller can broadcast straight away; a background task inserts queued
+    rows in batches of up to ``batch_size`` or every ``flush_interval`` seconds.
+    A full queue makes ``submit`` wait (backpressure) and ``stop`` drains
+    everything still queued. Flushes that fail for any other reason (an
+    outage, a failover) are retried with backoff for as long as it takes,
+    while that backpressure holds senders back. Only a batch the database
+    rejects outright (IntegrityError/DataError) is split up, and just the
+    rows it still rejects (say a foreign key to a deleted room) are logged
+    and dropped. Rows are otherwise only at risk if the process dies inside
+    the flush window.
+
+    Each message takes its own id from the sequence at ``submit`` time, so
+    ids follow send order across workers exactly as inline inserts do; the
+    history cursors, read watermarks and inbox ordering all rely on that.
+
+    Known gap: history reads go to the database, so a row still in
+    ``pending`` (at most ``flush_interval`` old) is not replayed by them.
+    Read watermarks do cover pending rows, see ``mark_read``.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = MESSAGE_WRITE_BEHIND,
+        batch_size: int = MESSAGE_BATCH_SIZE,
+        flush_interval: float = MESSAGE_FLUSH_INTERVAL,
+        max_pending: int = MESSAGE_QUEUE_SIZE,
+        retry_delay: float = 0.1,
+    ):
+        # Ids come from the messages sequence, which only PostgreSQL exposes
+        self.enabled = enabled and engine.dialect.name == "postgresql"
+        if enabled and not self.enabled:
+            logger.warning("Write-behind needs PostgreSQL; storing messages inline")
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.retry_delay = retry_delay
+        self.queue: asyncio.Queue | None = None
+        self.pending: dict[int, dict] = {}
+        self.flusher: asyncio.Task | None = None
+
+    def start(self):
+        if self.flusher is None:
+            self.queue = asyncio.Queue(maxsize=self.max_pending)
+            self.flusher = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.flusher is None:
+            return
+        await self.queue.put(None)
+        await self.flusher
+        self.flusher = None
+
+    async def next_id(self) -> int:
+        # One id per message: a reserved block per worker would let ids run
+        # ahead of (or behind) messages other workers send meanwhile
+        (message_id,) = await run_db(reserve_message_ids, 1)
+        return message_id
+
+    async def submit(self, **fields) -> dict:
+        self.start()
+        row = dict.fromkeys(COLUMNS)
+        row.update(fields)
+        row["content"] = row["content"] or ""
+        row["status"] = row["status"] or "sent"
+        row["id"] = await self.next_id()
+        row["sent_at"] = datetime.now()
+        self.pending[row["id"]] = row
+        await self.queue.put(row)
+        return row
+
+    def update_status(self, message_id: int, status: str) -> bool:
+        # Status changes for rows not yet flushed are folded into the pending row
+        row = self.pending.get(message_id)
+        if row is None:
+            return False
+        row["status"] = status
+        return True
+
+    def mark_read(self, receiver_id: int, sender_id: int, up_to: int | None = None) -> int:
+        # Fold a read watermark into direct messages not yet flushed; returns
+        # the highest id it covered
+        latest = 0
+        for row in self.pending.values():
+            if (
+                row["receiver_id"] == receiver_id
+                and row["sender_id"] == sender_id
+                and (up_to is None or row["id"] <= up_to)
+            ):
+                row["status"] = "read"
+                latest = max(latest, row["id"])
+        return latest
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            row = await self.queue.get()
+            if row is None:
+                return
+            batch = [row]
+            deadline = loop.time() + self.flush_interval
+            stopping = False
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    row = await asyncio.wait_for(self.queue.get(), timeout)
+                except TimeoutError:
+                    break
+                if row is None:
+                    stopping = True
+                    break
+                batch.append(row)
+            await self.flush(batch)
+            if stopping:
+                return
+
+    async def retrying(self, write, rows: list[dict]):
+        # Transient failures never give up; PERMANENT_ERRORS go to the caller
+        delay = self.retry_delay
+        attempt = 0
+        while True:
+            try:
+                return await run_db(write, rows)
+            except PERMANENT_ERRORS:
+                raise
+            except Exception:
+                attempt += 1
+                logger.exception(
+                    "Failed to write %d messages (attempt %d), retrying", len(rows), attempt
+                )
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 5)
+
+    async def insert_batch(self, snapshot: list[dict]) -> list[dict]:
+        """Insert rows, returning the ones that were stored."""
+        try:
+            await self.retrying(insert_messages, snapshot)
+            return snapshot
+        except PERMANENT_ERRORS:
+            logger.exception("Batch of %d messages rejected, inserting one by one", len(snapshot))
+
+        # Isolate the rejected rows so the rest of the batch still lands
+        stored = []
+        for row in snapshot:
+            try:
+                await self.retrying(insert_messages, [row])
+                stored.append(row)
+            except PERMANENT_ERRORS:
+                logger.exception("Dropping message %s the database rejects: %r", row["id"], row)
+        return stored
+
+    async def flush(self, batch: list[dict]):
+        snapshot = [dict(row) for row in batch]
+        stored = {row["id"]: row for row in await self.insert_batch(snapshot)}
+
+        # Statuses that changed while the batch was being inserted
+        late = []
+        for row in batch:
+            self.pending.pop(row["id"], None)
+            inserted = stored.get(row["id"])
+            if inserted is not None and row["status"] != inserted["status"]:
+                late.append({"id": row["id"], "status": row["status"]})
+        if late:
+            try:
+                await self.retrying(update_message_statuses, late)
+            except PERMANENT_ERRORS:
+                logger.exception("Failed to apply %d late status updates", len(late))
+
+
+message_writer = MessageWriter()
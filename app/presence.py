@@ -0,0 +1,268 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+from collections.abc import Awaitable, Callable, Iterable
+
+from app.broker import InMemoryBroker
+from app.broker import broker as default_broker
+from app.config import PRESENCE_DEBOUNCE, PRESENCE_IDLE_TIMEOUT, PRESENCE_PING_INTERVAL
+from app.connection_manager import ClientConnection
+from app.database import get_db_session, run_db
+from app.frames import encode
+from database.models import RoomMembers
+
+logger = logging.getLogger(__name__)
+
+# Called with {user_id: online} for users whose overall presence flipped
+Listener = Callable[[dict[int, bool]], Awaitable[None]]
+
+PING = encode({"type": "ping"})
+
+
+class PresenceSession:
+    """One device: a socket that keeps its user online while it is alive."""
+
+    def __init__(self, user_id: int, conn: ClientConnection):
+        self.user_id = user_id
+        self.conn = conn
+        self.last_seen = time.monotonic()
+
+    def touch(self):
+        # Any frame from the client (a pong or anything else) proves it is alive
+        self.last_seen = time.monotonic()
+
+
+class Presence:
+    """Who is online, aggregated over devices and app nodes.
+
+    Every socket is a ``PresenceSession``; a user is online while any of
+    their sessions on any node is. Sessions that stay silent get a ``ping``
+    frame every ``ping_interval`` and are dropped after ``idle_timeout``.
+
+    Nodes only tell each other when a user's local session count crosses
+    zero, batched per ``debounce`` window on ``presence:<node>``, so a
+    reconnect inside the window produces no traffic at all. Each node also
+    re-announces its online set every ``ping_interval`` as a lease; users of
+    a node that stops doing so (crashed) go offline after three intervals.
+    Listeners receive only overall online/offline flips.
+    """
+
+    def __init__(
+        self,
+        broker: InMemoryBroker | None = None,
+        debounce: float = PRESENCE_DEBOUNCE,
+        ping_interval: float = PRESENCE_PING_INTERVAL,
+        idle_timeout: float = PRESENCE_IDLE_TIMEOUT,
+        node_id: str | None = None,
+    ):
+        self.broker = broker or default_broker
+        self.debounce = debounce
+        self.ping_interval = ping_interval
+        self.idle_timeout = idle_timeout
+        self.lease = 3 * ping_interval
+        self.node_id = node_id or uuid.uuid4().hex
+        self.sessions: dict[int, set[PresenceSession]] = {}
+        # Local users as last announced, and those to re-check on the next flush
+        self.announced: set[int] = set()
+        self.pending: set[int] = set()
+        # node_id -> (its online users, lease expiry); counts: user -> nodes listing them
+        self.nodes: dict[str, tuple[set[int], float]] = {}
+        self.counts: dict[int, int] = {}
+        self.listeners: list[Listener] = []
+        self.timer: asyncio.Task | None = None
+        self.sweeper: asyncio.Task | None = None
+        self.broker.subscribe("presence:", self.on_presence)
+
+    def listen(self, listener: Listener):
+        self.listeners.append(listener)
+
+    def is_online(self, user_id: int) -> bool:
+        return user_id in self.counts
+
+    def online(self, user_ids: Iterable[int]) -> list[int]:
+        return sorted(user_id for user_id in set(user_ids) if user_id in self.counts)
+
+    def track(self, user_id: int, conn: ClientConnection) -> PresenceSession:
+        if self.sweeper is None:
+            self.sweeper = asyncio.create_task(self.sweep_loop())
+        session = PresenceSession(user_id, conn)
+        self.sessions.setdefault(user_id, set()).add(session)
+        self.changed(user_id)
+        return session
+
+    def untrack(self, session: PresenceSession):
+        sessions = self.sessions.get(session.user_id)
+        if not sessions or session not in sessions:
+            return
+        sessions.discard(session)
+        if not sessions:
+            del self.sessions[session.user_id]
+        self.changed(session.user_id)
+
+    def changed(self, user_id: int):
+        self.pending.add(user_id)
+        if self.timer is None:
+            self.timer = asyncio.create_task(self.flush_later())
+
+    async def flush_later(self):
+        await asyncio.sleep(self.debounce)
+        self.timer = None
+        pending, self.pending = self.pending, set()
+        # Only users whose local state differs from what peers were told
+        online = {user_id for user_id in pending if user_id in self.sessions} - self.announced
+        offline = {user_id for user_id in pending if user_id not in self.sessions} & self.announced
+        if online or offline:
+            self.announced = (self.announced | online) - offline
+            await self.announce({"online": sorted(online), "offline": sorted(offline)})
+
+    async def announce(self, body: dict):
+        await self.broker.publish(f"presence:{self.node_id}", encode(body))
+
+    async def on_presence(self, node_id: str, message: str):
+        body = json.loads(message)
+        users, _ = self.nodes.get(node_id, (set(), 0.0))
+        if "sync" in body:
+            listed = set(body["sync"])
+            online, offline = listed - users, users - listed
+        else:
+            online, offline = set(body["online"]) - users, set(body["offline"]) & users
+        self.nodes[node_id] = ((users | online) - offline, time.monotonic() + self.lease)
+        await self.apply(online, offline)
+
+    async def apply(self, online: set[int], offline: set[int]):
+        changes = {}
+        for user_id in online:
+            self.counts[user_id] = self.counts.get(user_id, 0) + 1
+            if self.counts[user_id] == 1:
+                changes[user_id] = True
+        for user_id in offline:
+            self.counts[user_id] -= 1
+            if not self.counts[user_id]:
+                del self.counts[user_id]
+                changes[user_id] = False
+        if changes:
+            for listener in self.listeners:
+                await listener(changes)
+
+    async def sweep_loop(self):
+        while True:
+            await asyncio.sleep(self.ping_interval)
+            try:
+                await self.sweep()
+            except Exception:
+                logger.exception("Presence sweep failed")
+
+    async def sweep(self):
+        now = time.monotonic()
+        for sessions in list(self.sessions.values()):
+            for session in list(sessions):
+                idle = now - session.last_seen
+                if session.conn.closed or idle >= self.idle_timeout:
+                    # Missed its heartbeats: the device is gone, close what is left
+                    self.untrack(session)
+                    session.conn.close(code=1001)
+                elif idle >= self.ping_interval:
+                    session.conn.offer(PING)
+
+        for node_id, (users, expires) in list(self.nodes.items()):
+            if node_id != self.node_id and expires < now:
+                del self.nodes[node_id]
+                await self.apply(set(), users)
+        # Renews our lease; a peer that missed a diff converges here too
+        await self.announce({"sync": sorted(self.announced)})
+
+    async def stop(self):
+        for task in (self.sweeper, self.timer):
+            if task is not None:
+                task.cancel()
+        self.sweeper = self.timer = None
+        if self.announced:
+            # Peers need not wait for our lease to run out
+            self.announced = set()
+            await self.announce({"sync": []})
+
+
+def load_room_members(room_id: int) -> set[int]:
+    with get_db_session() as db:
+        rows = db.query(RoomMembers.user_id).filter(RoomMembers.room_id == room_id)
+        return {user_id for (user_id,) in rows}
+
+
+class RoomPresence:
+    """Pushes member presence flips to the room sockets on this node.
+
+    Members are loaded once per room with local sockets; a batch of flips
+    becomes at most one ``presence`` frame per affected room::
+
+        {"type": "presence", "room_id": 3, "online": [7], "offline": [12]}
+    """
+
+    def __init__(self, deliver: Callable[[str, str], Awaitable[None]], presence: Presence):
+        self.deliver = deliver
+        self.presence = presence
+        self.members: dict[int, set[int]] = {}
+        self.sockets: dict[int, int] = {}
+        # user_id -> rooms in self.members they belong to
+        self.rooms_of: dict[int, set[int]] = {}
+        presence.listen(self.on_change)
+
+    async def join(self, room_id: int, user_id: int) -> dict:
+        # Returns the snapshot frame for the socket that just joined
+        self.sockets[room_id] = self.sockets.get(room_id, 0) + 1
+        if room_id not in self.members:
+            try:
+                members = await run_db(load_room_members, room_id)
+            except Exception:
+                self.leave(room_id)
+                raise
+            self.members[room_id] = members
+            for member_id in members:
+                self.rooms_of.setdefault(member_id, set()).add(room_id)
+        self.add_member(room_id, user_id)
+        return {
+            "type": "presence",
+            "room_id": room_id,
+            "online": self.presence.online(self.members[room_id]),
+            "offline": [],
+        }
+
+    def leave(self, room_id: int):
+        self.sockets[room_id] = self.sockets.get(room_id, 1) - 1
+        if self.sockets[room_id] <= 0:
+            self.sockets.pop(room_id, None)
+            for member_id in self.members.pop(room_id, ()):
+                self.drop_room(member_id, room_id)
+
+    def add_member(self, room_id: int, user_id: int):
+        if room_id in self.members:
+            self.members[room_id].add(user_id)
+            self.rooms_of.setdefault(user_id, set()).add(room_id)
+
+    def remove_member(self, room_id: int, user_id: int):
+        if room_id in self.members:
+            self.members[room_id].discard(user_id)
+            self.drop_room(user_id, room_id)
+
+    def drop_room(self, user_id: int, room_id: int):
+        rooms = self.rooms_of.get(user_id)
+        if rooms is not None:
+            rooms.discard(room_id)
+            if not rooms:
+                del self.rooms_of[user_id]
+
+    async def on_change(self, changes: dict[int, bool]):
+        frames: dict[int, dict] = {}
+        for user_id, online in changes.items():
+            for room_id in self.rooms_of.get(user_id, ()):
+                frame = frames.setdefault(
+                    room_id,
+                    {"type": "presence", "room_id": room_id, "online": [], "offline": []},
+                )
+                frame["online" if online else "offline"].append(user_id)
+        for room_id, frame in frames.items():
+            await self.deliver(str(room_id), encode(frame))
+
+
+presence = Presence()
@@ -0,0 +1,41 @@
+import asyncio
+from collections.abc import Awaitable, Callable
+
+from app.config import READ_ACK_DELAY
+
+
+class ReadBatcher:
+    """Coalesce a socket's read frames into one watermark write.
+
+    Scrolling through a backlog sends a read frame per message; only the
+    highest id matters, so ``mark`` just raises the pending watermark and
+    ``commit`` runs once per ``delay`` window with the latest value.
+    """
+
+    def __init__(self, commit: Callable[[int], Awaitable[None]], delay: float = READ_ACK_DELAY):
+        self.commit = commit
+        self.delay = delay
+        self.up_to = 0
+        self.timer: asyncio.Task | None = None
+
+    def mark(self, up_to: int):
+        self.up_to = max(self.up_to, int(up_to))
+        if self.timer is None:
+            self.timer = asyncio.create_task(self.wait_and_flush())
+
+    async def wait_and_flush(self):
+        await asyncio.sleep(self.delay)
+        self.timer = None  # from here on close() must not cancel us
+        await self.flush()
+
+    async def flush(self):
+        up_to, self.up_to = self.up_to, 0
+        if up_to:
+            await self.commit(up_to)
+
+    async def close(self):
+        # Socket is going away: write what we have instead of dropping it
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        await self.flush()
@@ -0,0 +1,131 @@
+import hashlib
+from datetime import datetime
+
+from sqlalchemy import func, update
+from sqlalchemy.orm import Session
+
+from app.frames import timestamp
+from app.thumbnails import cached_preview
+from app.utils import page_size
+from database.models import Chatroom, RoomMembers
+
+# The /getgroups directory reads member counts and last activity straight off
+# the chatroom row; these helpers keep them current in the same transaction as
+# the membership change or messages they reflect. Every such change also bumps
+# Chatroom.version, which is what the directory's ETag is built from.
+
+GROUP_IMAGE_URL = "/uploads/group-image"
+
+
+def adjust_member_count(db: Session, room_id: int, delta: int):
+    db.execute(
+        update(Chatroom)
+        .where(Chatroom.id == room_id)
+        .values(member_count=Chatroom.member_count + delta, version=Chatroom.version + 1)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def record_activity(db: Session, room_id: int, message_id: int, sent_at: datetime | None):
+    # Commits can land out of order, so only ever move it forward
+    db.execute(
+        update(Chatroom)
+        .where(Chatroom.id == room_id, func.coalesce(Chatroom.last_message_id, 0) < message_id)
+        .values(
+            last_message_id=message_id,
+            last_activity_at=sent_at,
+            version=Chatroom.version + 1,
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+
+def touch_room(room: Chatroom):
+    # For edits made through the ORM object (name, image, privacy)
+    room.version = Chatroom.version + 1
+
+
+def directory_query(
+    db: Session, entities: tuple, user_id: int, show: str, before: int | None, limit: int
+):
+    query = db.query(*entities)
+    if show == "joined":
+        query = query.join(RoomMembers, RoomMembers.room_id == Chatroom.id).filter(
+            RoomMembers.user_id == user_id
+        )
+    elif show in ("public", "private"):
+        query = query.filter(Chatroom.is_private.is_(show == "private"))
+    if before is not None:
+        query = query.filter(Chatroom.id < before)
+    return query.order_by(Chatroom.id.desc()).limit(limit + 1)
+
+
+def directory_etag(
+    db: Session,
+    user_id: int,
+    show: str = "all",
+    before: int | None = None,
+    limit: int | None = None,
+) -> str:
+    """Validator for a ``fetch_directory`` page without building it.
+
+    Covers which rooms are on the page, each room's version, and the caller's
+    memberships (count and newest row, which move on every join and leave).
+    """
+    limit = page_size(limit)
+    rooms = directory_query(db, (Chatroom.id, Chatroom.version), user_id, show, before, limit).all()
+    memberships = (
+        db.query(func.count(RoomMembers.id), func.max(RoomMembers.id))
+        .filter(RoomMembers.user_id == user_id)
+        .one()
+    )
+    key = (user_id, show, before, limit, [tuple(room) for room in rooms], tuple(memberships))
+    return f'"{hashlib.blake2b(repr(key).encode(), digest_size=16).hexdigest()}"'
+
+
+def fetch_directory(
+    db: Session,
+    user_id: int,
+    show: str = "all",
+    before: int | None = None,
+    limit: int | None = None,
+) -> dict:
+    """One page of rooms, newest first; ``show`` is all/joined/public/private."""
+    limit = page_size(limit)
+    rooms = directory_query(db, (Chatroom,), user_id, show, before, limit).all()
+    has_more = len(rooms) > limit
+    rooms = rooms[:limit]
+
+    if show == "joined":
+        joined = {room.id for room in rooms}
+    elif rooms:
+        joined = {
+            room_id
+            for (room_id,) in db.query(RoomMembers.room_id).filter(
+                RoomMembers.user_id == user_id,
+                RoomMembers.room_id.in_([room.id for room in rooms]),
+            )
+        }
+    else:
+        joined = set()
+
+    return {
+        "rooms": [
+            {
+                "id": room.id,
+                "name": room.roomname,
+                "image_url": room.image,
+                "image_preview": (
+                    cached_preview(f"{GROUP_IMAGE_URL}/{room.image}") if room.image else None
+                ),
+                "is_private": room.is_private,
+                "member_count": room.member_count,
+                "last_message_id": room.last_message_id,
+                "last_activity_at": timestamp(room.last_activity_at),
+                "joined": room.id in joined,
+            }
+            for room in rooms
+        ],
+        "next_before": rooms[-1].id if rooms and has_more else None,
+        "has_more": has_more,
+    }
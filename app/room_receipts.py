@@ -0,0 +1,105 @@
+import asyncio
+from bisect import bisect_left
+from collections.abc import Awaitable, Callable
+
+from app.broker import InMemoryBroker
+from app.broker import broker as default_broker
+from app.config import READ_ACK_DELAY, SEEN_BY_STEPS
+from app.database import get_db_session, run_db
+from app.frames import encode
+from database.models import RoomMembers
+
+
+def load_room_watermarks(room_id: int) -> dict[int, int]:
+    with get_db_session() as db:
+        rows = db.query(RoomMembers.user_id, RoomMembers.last_read_message_id).filter(
+            RoomMembers.room_id == room_id, RoomMembers.last_read_message_id.isnot(None)
+        )
+        return dict(rows)
+
+
+class RoomReceipts:
+    """Group "seen by N" counts derived from per-member read watermarks.
+
+    Each member has one watermark per room (``room_members.last_read_message_id``),
+    so a message ``m`` is seen by every member whose watermark is >= ``m``.
+    Watermarks for rooms with local sockets are mirrored in memory and kept
+    current through the broker; changes are pushed as one coalesced
+    ``seen_by`` frame per room every ``delay`` seconds::
+
+        {"type": "seen_by", "room_id": 3, "steps": [[120, 5], [131, 2]]}
+
+    ``steps`` is ascending ``[watermark, count]``: message ``m`` is seen by the
+    count of the first step whose watermark is >= ``m`` (0 past the last one).
+    """
+
+    def __init__(
+        self,
+        deliver: Callable[[str, str], Awaitable[None]],
+        broker: InMemoryBroker | None = None,
+        delay: float = READ_ACK_DELAY,
+        max_steps: int = SEEN_BY_STEPS,
+    ):
+        self.deliver = deliver
+        self.broker = broker or default_broker
+        self.delay = delay
+        self.max_steps = max_steps
+        # room_id -> {user_id: watermark}, only for rooms with local sockets
+        self.watermarks: dict[int, dict[int, int]] = {}
+        self.sockets: dict[int, int] = {}
+        self.dirty: set[int] = set()
+        self.timer: asyncio.Task | None = None
+        self.broker.subscribe("seen:", self.on_seen)
+
+    async def join(self, room_id: int) -> dict:
+        # Returns the snapshot frame for the socket that just joined
+        self.sockets[room_id] = self.sockets.get(room_id, 0) + 1
+        if room_id not in self.watermarks:
+            try:
+                self.watermarks[room_id] = await run_db(load_room_watermarks, room_id)
+            except Exception:
+                self.leave(room_id)
+                raise
+        return self.frame(room_id)
+
+    def leave(self, room_id: int):
+        self.sockets[room_id] = self.sockets.get(room_id, 1) - 1
+        if self.sockets[room_id] <= 0:
+            self.sockets.pop(room_id, None)
+            self.watermarks.pop(room_id, None)
+            self.dirty.discard(room_id)
+
+    async def publish(self, room_id: int, user_id: int, watermark: int | None):
+        # None removes the member (they left the room)
+        await self.broker.publish(f"seen:{room_id}", f"{user_id}:{watermark or 0}")
+
+    async def on_seen(self, key: str, message: str):
+        room_id = int(key)
+        marks = self.watermarks.get(room_id)
+        if marks is None:
+            return  # no local sockets follow this room
+        user_id, watermark = (int(part) for part in message.split(":"))
+        if watermark:
+            marks[user_id] = max(marks.get(user_id, 0), watermark)
+        else:
+            marks.pop(user_id, None)
+        self.dirty.add(room_id)
+        if self.timer is None:
+            self.timer = asyncio.create_task(self.flush_later())
+
+    async def flush_later(self):
+        await asyncio.sleep(self.delay)
+        self.timer = None
+        rooms, self.dirty = self.dirty, set()
+        for room_id in rooms:
+            if room_id in self.watermarks:
+                await self.deliver(str(room_id), encode(self.frame(room_id)))
+
+    def frame(self, room_id: int) -> dict:
+        marks = sorted(self.watermarks.get(room_id, {}).values())
+        distinct = sorted(set(marks))[-self.max_steps :]
+        return {
+            "type": "seen_by",
+            "room_id": room_id,
+            "steps": [[mark, len(marks) - bisect_left(marks, mark)] for mark in distinct],
+        }
@@ -0,0 +1,181 @@
+import base64
+import binascii
+import os
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, Response
+from fastapi.responses import RedirectResponse
+
+from app.attachment_store import is_known, staging_key
+from app.chunked_upload import UploadError, upload_store
+from app.config import MAX_UPLOAD_BYTES, S3_URL_EXPIRES
+from app.database import run_db
+from app.schemas import DirectUpload
+from app.storage import storage
+from app.user_cache import CachedUser
+from app.utils import get_token_user
+
+# tus-style resumable uploads for message attachments. A finished upload is
+# attached to a message by sending {"type": "upload_commit", "upload_id": ...}
+# on the chat socket, exactly like a socket-streamed upload.
+router = APIRouter(prefix="/attachments", tags=["Attachments"])
+# With object storage, media URLs redirect to short-lived pre-signed URLs
+media_router = APIRouter(tags=["Media"])
+
+TUS_VERSION = "1.0.0"
+MESSAGE_UPLOAD_DIR = os.path.join("uploads", "messages")
+
+
+def parse_metadata(header: str | None) -> dict:
+    # "filename d29ybGQ=,filetype aW1hZ2UvcG5n" -> {"filename": "world", ...}
+    metadata = {}
+    for pair in (header or "").split(","):
+        if not pair.strip():
+            continue
+        key, _, value = pair.strip().partition(" ")
+        try:
+            metadata[key] = base64.b64decode(value).decode() if value else ""
+        except (binascii.Error, UnicodeDecodeError) as exc:
+            raise HTTPException(status_code=400, detail="Invalid Upload-Metadata") from exc
+    return metadata
+
+
+def tus_headers(**headers) -> dict:
+    return {"Tus-Resumable": TUS_VERSION, **headers}
+
+
+def upload_error(exc: UploadError) -> HTTPException:
+    headers = tus_headers()
+    if exc.offset is not None:
+        headers["Upload-Offset"] = str(exc.offset)
+    return HTTPException(status_code=exc.status_code, detail=str(exc), headers=headers)
+
+
+@router.post("", status_code=201)
+def create_upload(
+    upload_length: int = Header(...),
+    upload_metadata: str | None = Header(None),
+    user: CachedUser = Depends(get_token_user),
+):
+    metadata = parse_metadata(upload_metadata)
+    try:
+        meta = upload_store.create(
+            user.id,
+            metadata.get("filename"),
+            metadata.get("filetype"),
+            upload_length,
+            metadata.get("text"),
+        )
+    except UploadError as exc:
+        raise upload_error(exc) from exc
+    return Response(
+        status_code=201,
+        headers=tus_headers(
+            Location=f"/attachments/{meta['upload_id']}", **{"Upload-Offset": "0"}
+        ),
+    )
+
+
+@router.head("/{upload_id}")
+def get_upload_offset(upload_id: str, user: CachedUser = Depends(get_token_user)):
+    try:
+        meta = upload_store.get(upload_id, user.id)
+    except UploadError as exc:
+        raise upload_error(exc) from exc
+    return Response(
+        headers=tus_headers(
+            **{
+                "Upload-Offset": str(upload_store.offset(meta["upload_id"])),
+                "Upload-Length": str(meta["size"]),
+                "Cache-Control": "no-store",
+            }
+        )
+    )
+
+
+@router.patch("/{upload_id}", status_code=204)
+async def append_upload(
+    upload_id: str,
+    request: Request,
+    upload_offset: int = Header(...),
+    user: CachedUser = Depends(get_token_user),
+):
+    if request.headers.get("content-type") != "application/offset+octet-stream":
+        raise HTTPException(status_code=415, detail="Unsupported Content-Type")
+
+    offset = upload_offset
+    try:
+        # Body is streamed straight to the .part file; nothing is buffered whole
+        async for chunk in request.stream():
+            if chunk:
+                offset = await upload_store.write(upload_id, user.id, offset, chunk)
+    except UploadError as exc:
+        raise upload_error(exc) from exc
+    return Response(status_code=204, headers=tus_headers(**{"Upload-Offset": str(offset)}))
+
+
+@router.delete("/{upload_id}", status_code=204)
+def terminate_upload(upload_id: str, user: CachedUser = Depends(get_token_user)):
+    try:
+        meta = upload_store.get(upload_id, user.id)
+    except UploadError as exc:
+        raise upload_error(exc) from exc
+    upload_store.discard(meta["upload_id"])
+    return Response(status_code=204, headers=tus_headers())
+
+
+@router.get("/known/{sha256}")
+async def known_attachment(sha256: str, user: CachedUser = Depends(get_token_user)):
+    # Lets a client skip the upload entirely and send upload_init with sha256;
+    # only content the caller can already see counts as known
+    known = await run_db(is_known, MESSAGE_UPLOAD_DIR, sha256, user.id)
+    return {"sha256": sha256, "known": known}
+
+
+@router.post("/direct")
+async def direct_upload(payload: DirectUpload, user: CachedUser = Depends(get_token_user)):
+    """Pre-signed URL for uploading straight to object storage.
+
+    After the PUT succeeds, send ``upload_init`` with the same ``sha256``,
+    ``filename`` and ``mimetype`` on the chat socket to post the message.
+    """
+    if not storage.presigned:
+        raise HTTPException(
+            status_code=501, detail="Direct uploads need object storage; use /attachments"
+        )
+    if not 0 < payload.size <= MAX_UPLOAD_BYTES:
+        raise HTTPException(
+            status_code=413, detail=f"File exceeds the {MAX_UPLOAD_BYTES} byte limit"
+        )
+    if await run_db(is_known, MESSAGE_UPLOAD_DIR, payload.sha256, user.id):
+        return {"sha256": payload.sha256, "known": True}
+
+    # Uploading to the caller's own staging key is what proves they hold the
+    # bytes; upload_init moves it into place (or drops it if already stored)
+    key = staging_key(user.id, payload.sha256, payload.filename)
+    return {
+        "sha256": payload.sha256,
+        "known": False,
+        "upload": storage.upload_url(key, payload.mimetype, payload.size, payload.sha256),
+    }
+
+
+def redirect_to_object(key: str) -> RedirectResponse:
+    parts = key.split("/")
+    if parts[0] == "tmp" or any(not part or part.startswith(".") for part in parts):
+        raise HTTPException(status_code=404)
+    # The redirect itself may be cached, but not past the signature's lifetime
+    return RedirectResponse(
+        storage.url(key),
+        status_code=307,
+        headers={"Cache-Control": f"private, max-age={S3_URL_EXPIRES // 2}"},
+    )
+
+
+@media_router.get("/uploads/{key:path}")
+def object_url(key: str):
+    return redirect_to_object(key)
+
+
+@media_router.get("/profile_images/{filename}")
+def profile_image_url(filename: str):
+    return redirect_to_object(f"profile_pics/{filename}")
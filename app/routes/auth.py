@@ -1,16 +1,36 @@
 import os
-import uuid
 from datetime import UTC, datetime, timedelta
+from typing import Literal
 
-from fastapi import APIRouter, Depends, File, Form, HTTPException, UploadFile
+from fastapi import (
+    APIRouter,
+    Depends,
+    File,
+    Form,
+    Header,
+    HTTPException,
+    Query,
+    UploadFile,
+)
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 
-from app.config import ACCESS_TOKEN_EXPIRE_MINUTES, ALGORITHM, SECRET_KEY
-from app.database import get_db
+from app.attachment_store import store_upload
+from app.autocomplete import search_changed
+from app.config import (
+    ACCESS_TOKEN_EXPIRE_MINUTES,
+    ALGORITHM,
+    HISTORY_MAX_PAGE_SIZE,
+    SECRET_KEY,
+)
+from app.database import get_db, get_db_session
+from app.frames import encode, timestamp
 from app.schemas import UserLogin, UserResponse
-from app.utils import hash_password, verify_password
+from app.user_cache import invalidate_user
+from app.utils import get_token_user, hash_password, page_size, verify_password
 from database.models import User
 
 router = APIRouter()
@@ -44,11 +64,7 @@ async def register(
 
     profile_image_filename = None
     if profile_image:
-        ext = profile_image.filename.split(".")[-1]
-        profile_image_filename = f"profile_{uuid.uuid4()}.{ext}"
-        file_path = os.path.join(UPLOAD_DIR, profile_image_filename)
-        with open(file_path, "wb") as f:
-            f.write(await profile_image.read())
+        profile_image_filename = await store_upload(profile_image, UPLOAD_DIR)
     hashed_pw = hash_password(password)
     db_user = User(
         username=username,
@@ -62,6 +78,8 @@ async def register(
     db.add(db_user)
     db.commit()
     db.refresh(db_user)
+    await invalidate_user(db_user.id)
+    await search_changed()
     return db_user
 
 
@@ -80,7 +98,81 @@ def login(user: UserLogin, db: Session = Depends(get_db)):
     # return {"access_token": access_token, "token_type": "bearer"}
 
 
-@router.get("/users", response_model=list[UserResponse])
-def get_all_users(db: Session = Depends(get_db)):
-    users = db.query(User).all()
-    return users
+# Columns /users may return; password hashes are never selectable
+USER_FIELDS = (
+    "id",
+    "username",
+    "email",
+    "first_name",
+    "middle_name",
+    "last_name",
+    "profile_image",
+    "created_at",
+)
+DEFAULT_USER_FIELDS = ("id", "username", "email")
+EXPORT_BATCH_SIZE = 1000
+
+
+def parse_user_fields(fields: str | None) -> list[str]:
+    if not fields:
+        return list(DEFAULT_USER_FIELDS)
+    requested = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = sorted(set(requested) - set(USER_FIELDS))
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    # The cursor needs the id, so it is always included
+    return ["id", *dict.fromkeys(field for field in requested if field != "id")]
+
+
+def user_row(row) -> dict:
+    return {
+        key: timestamp(value) if isinstance(value, datetime) else value
+        for key, value in row._mapping.items()
+    }
+
+
+def users_query(fields: list[str], after: int | None):
+    query = select(*(getattr(User, field) for field in fields)).order_by(User.id)
+    if after is not None:
+        query = query.where(User.id > after)
+    return query
+
+
+def stream_users(fields: list[str], after: int | None):
+    # Own session: it has to outlive the request handler while the body streams.
+    # yield_per fetches from a server-side cursor, one batch in memory at a time
+    with get_db_session() as db:
+        result = db.execute(
+            users_query(fields, after).execution_options(yield_per=EXPORT_BATCH_SIZE)
+        )
+        for row in result:
+            yield encode(user_row(row)) + "\n"
+
+
+@router.get("/users")
+def get_all_users(
+    after: int | None = Query(None, ge=0),
+    limit: int | None = Query(None, ge=1, le=HISTORY_MAX_PAGE_SIZE),
+    fields: str | None = Query(None, description="Comma-separated, e.g. id,username"),
+    output: Literal["json", "ndjson"] = Query("json", alias="format"),
+    authorization: str | None = Header(None),
+    db: Session = Depends(get_db),
+):
+    fields = parse_user_fields(fields)
+    if output == "ndjson" or not set(fields) <= set(DEFAULT_USER_FIELDS):
+        # Bulk export and profile details are for signed-in users only
+        get_token_user(authorization)
+    if output == "ndjson":
+        # Full export from ``after`` on, one JSON object per line
+        return StreamingResponse(stream_users(fields, after), media_type="application/x-ndjson")
+
+    limit = page_size(limit)
+    rows = db.execute(users_query(fields, after).limit(limit + 1)).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    # Pass next_after back as ``after`` for the next page
+    return {
+        "users": [user_row(row) for row in rows],
+        "next_after": rows[-1].id if rows and has_more else None,
+        "has_more": has_more,
+    }
@@ -1,18 +1,43 @@
 import os
-from uuid import uuid4
-
-from fastapi import APIRouter, Depends, File, Form, HTTPException, UploadFile
+from typing import Literal
+
+from fastapi import (
+    APIRouter,
+    Depends,
+    File,
+    Form,
+    Header,
+    HTTPException,
+    Query,
+    Response,
+    UploadFile,
+)
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
-from app.database import get_db
+from app.attachment_store import release_file, store_upload
+from app.autocomplete import search_changed
+from app.config import HISTORY_MAX_PAGE_SIZE
+from app.database import get_db, get_db_session, run_db
+from app.frames import encode
+from app.media import etag_matches
+from app.room_directory import (
+    adjust_member_count,
+    directory_etag,
+    fetch_directory,
+    touch_room,
+)
+from app.routes.communication import leave_room
 from app.schemas import JoinRoom
+from app.thumbnails import ensure_preview
+from app.user_cache import CachedUser
 from app.utils import (
     check_user_inroom,
-    get_current_user,
+    get_token_user,
     hash_password,
     verify_password,
 )
-from database.models import Chatroom, RoomMembers, User
+from database.models import Chatroom, RoomMembers
 
 router = APIRouter()
 
@@ -26,7 +51,7 @@ async def create_table(
     password: str = Form(None),
     image: UploadFile = File(None),
     db: Session = Depends(get_db),
-    user: User = Depends(get_current_user),
+    user: CachedUser = Depends(get_token_user),
 ):
     is_private = bool(password)
 
@@ -34,11 +59,8 @@ async def create_table(
 
     filename = None
     if image:
-        ext = os.path.splitext(image.filename)[1]
-        filename = f"{uuid4().hex}{ext}"
-        file_path = os.path.join(UPLOAD_FOLDER, filename)
-        with open(file_path, "wb") as f:
-            f.write(await image.read())
+        filename = await store_upload(image, UPLOAD_FOLDER)
+        await ensure_preview(os.path.join(UPLOAD_FOLDER, filename))
 
     # Step 1: Create chatroom
     new_room = Chatroom(
@@ -57,50 +79,69 @@ async def create_table(
     # Step 2: Add creator as member
     room_member = RoomMembers(user_id=user.id, room_id=new_room.id, is_admin=True)
     db.add(room_member)
+    adjust_member_count(db, new_room.id, 1)
     db.commit()
+    await search_changed()
 
     return {"message": "Chatroom created successfully", "room_id": new_room.id}
 
 
 @router.get("/getgroups")
-def get_room(db: Session = Depends(get_db), user: User = Depends(get_current_user)):
-    chat_rooms = db.query(Chatroom).all()
-    
-    room_list = [{
-        "id": room.id,
-        "name": room.roomname,
-        "image_url": room.image
-    } for room in chat_rooms]
-
-    return {"rooms": room_list}
-
-
-
-@router.post("/joingroup")
-def join_room(
-    members: JoinRoom,
+def get_room(
+    show: Literal["all", "joined", "public", "private"] = "all",
+    before: int | None = Query(None, ge=1),
+    limit: int | None = Query(None, ge=1, le=HISTORY_MAX_PAGE_SIZE),
+    if_none_match: str | None = Header(None),
     db: Session = Depends(get_db),
-    user: User = Depends(get_current_user),
+    user: CachedUser = Depends(get_token_user),
 ):
-    room = db.query(Chatroom).filter(Chatroom.id == members.room_id).first()
-    if not room:
-        raise HTTPException(status_code=404, detail="Chatroom not found")
-    user_exist = check_user_inroom(user.id, members.room_id, db)
-    if user_exist:
-        return {"message": "Already in chat"}
+    # Checked before the page is built, so an unchanged page costs two small queries
+    etag = directory_etag(db, user.id, show, before, limit)
+    headers = {"etag": etag, "cache-control": "private, no-cache"}
+    if if_none_match and etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    # Pass next_before back as ``before`` for the next page
+    body = encode(fetch_directory(db, user.id, show, before, limit))
+    return Response(body, media_type="application/json", headers=headers)
+
+
+
+def add_membership(user_id: int, room_id: int, password: str | None) -> str | None:
+    """Join a room; returns its name, or None when already a member."""
+    with get_db_session() as db:
+        room = db.query(Chatroom).filter(Chatroom.id == room_id).first()
+        if not room:
+            raise HTTPException(status_code=404, detail="Chatroom not found")
+        if check_user_inroom(user_id, room_id, db):
+            return None
+
+        if room.is_private:
+            if not password:
+                raise HTTPException(
+                    status_code=401, detail="Password required to join this room"
+                )
+            if not verify_password(password, room.password):
+                raise HTTPException(status_code=403, detail="Incorrect password")
+
+        db.add(RoomMembers(user_id=user_id, room_id=room_id, is_admin=False))
+        try:
+            db.flush()
+        except IntegrityError:
+            # A concurrent join by the same user got there first
+            db.rollback()
+            return None
+        adjust_member_count(db, room_id, 1)
+        db.commit()
+        return room.roomname
 
-    if room.is_private:
-        if not members.password:
-            raise HTTPException(
-                status_code=401, detail="Password required to join this room"
-            )
-        if not verify_password(members.password, room.password):
-            raise HTTPException(status_code=403, detail="Incorrect password")
 
-    new_member = RoomMembers(user_id=user.id, room_id=members.room_id, is_admin=False)
-    db.add(new_member)
-    db.commit()
-    return {"message": f"Joined chat room '{room.roomname}' successfully"}
+@router.post("/joingroup")
+async def join_room(members: JoinRoom, user: CachedUser = Depends(get_token_user)):
+    roomname = await run_db(add_membership, user.id, members.room_id, members.password)
+    if roomname is None:
+        return {"message": "Already in chat"}
+    await search_changed()
+    return {"message": f"Joined chat room '{roomname}' successfully"}
 
 
 @router.put("/group/{room_id}/edit-info")
@@ -109,7 +150,7 @@ async def update_group_info(
     room_name: str = Form(None),
     password: str = Form(None),
     db: Session = Depends(get_db),
-    user: User = Depends(get_current_user),
+    user: CachedUser = Depends(get_token_user),
 ):
     chatroom = db.query(Chatroom).filter(Chatroom.id == room_id).first()
     if not chatroom:
@@ -137,7 +178,9 @@ async def update_group_info(
         updated = True
 
     if updated:
+        touch_room(chatroom)
         db.commit()
+        await search_changed()
         return {"message": "Room updated successfully"}
     else:
         return {"message": "No changes made"}
@@ -149,7 +192,7 @@ async def update_group_image(
     remove_image: bool = Form(False),
     new_image: UploadFile = File(None),
     db: Session = Depends(get_db),
-    user: User = Depends(get_current_user),
+    user: CachedUser = Depends(get_token_user),
 ):
     chatroom = db.query(Chatroom).filter(Chatroom.id == room_id).first()
     if not chatroom:
@@ -166,53 +209,36 @@ async def update_group_image(
             status_code=403, detail="Only admins can update the chatroom"
         )
 
+    # Released only after the commit, so a failed commit never loses the file
+    old_image = chatroom.image
+
     # Remove old image if requested
     if remove_image and chatroom.image:
-        old_path = os.path.join(UPLOAD_FOLDER, chatroom.image)
-        if os.path.exists(old_path):
-            os.remove(old_path)
         chatroom.image = None
 
     # Upload new image
     if new_image:
         print("Uploading new image:", new_image.filename)
-        ext = os.path.splitext(new_image.filename)[1]
-        filename = f"{uuid4().hex}{ext}"
-        file_path = os.path.join(UPLOAD_FOLDER, filename)
         try:
-            with open(file_path, "wb") as f:
-                f.write(await new_image.read())
-        except Exception as e:
+            filename = await store_upload(new_image, UPLOAD_FOLDER)
+            await ensure_preview(os.path.join(UPLOAD_FOLDER, filename))
+        except OSError as e:
             print("Failed to write file:", e)
             raise HTTPException(status_code=500, detail="Image upload failed")
-        # Delete previous image if any
-        if chatroom.image:
-            old_path = os.path.join(UPLOAD_FOLDER, chatroom.image)
-            if os.path.exists(old_path):
-                os.remove(old_path)
-
         chatroom.image = filename
 
+    touch_room(chatroom)
     db.commit()
+    if remove_image or new_image:
+        # Drop our reference to the previous image; it is deleted if unused
+        await release_file(UPLOAD_FOLDER, old_image)
+    await search_changed()
     return {"message": "Group image updated successfully"}
 
     
 @router.post("/leftchat/{room_id}")
-def leave_group(
-    room_id: int,
-    db: Session = Depends(get_db),
-    user: User = Depends(get_current_user),
-):
-    member = (
-        db.query(RoomMembers)
-        .filter(RoomMembers.room_id == room_id, RoomMembers.user_id == user.id)
-        .first()
-    )
-
-    if not member:
+async def leave_group(room_id: int, user: CachedUser = Depends(get_token_user)):
+    if not await leave_room(user, room_id):
         raise HTTPException(status_code=404, detail="You are not a member of this room")
 
-    db.delete(member)
-    db.commit()
-
-    return {"message": f"Left chat room {room_id} successfully"}
\ No newline at end of file
+    return {"message": f"Left chat room {room_id} successfully"}
@@ -1,7 +1,6 @@
 import base64
 import json
 import os
-import uuid
 from datetime import datetime
 
 from fastapi import (
@@ -9,29 +8,50 @@ from fastapi import (
     Depends,
     Header,
     HTTPException,
+    Query,
     WebSocket,
     WebSocketDisconnect,
 )
 from fastapi.responses import HTMLResponse
 from sqlalchemy.orm import Session
 
-from app.connection_manager import ConnectionManager
-from app.database import SessionLocal, get_db
-from app.utils import check_user_inroom, get_current_user, verify_password, verify_token
+from app.attachment_store import store_bytes
+from app.autocomplete import search_changed
+from app.chunked_upload import handle_upload_frame, receive_frame
+from app.config import HISTORY_MAX_PAGE_SIZE, MAX_UPLOAD_BYTES
+from app.connection_manager import ClientConnection, ConnectionManager
+from app.database import get_db, get_db_session, run_db
+from app.frames import (
+    FrameError,
+    encode,
+    error_frame,
+    int_field,
+    message_frame,
+    preview_frame,
+    str_field,
+)
+from app.inbox import mark_room_read_up_to, message_row, record_messages
+from app.message_writer import message_writer
+from app.presence import RoomPresence, presence
+from app.read_receipts import ReadBatcher
+from app.room_directory import adjust_member_count
+from app.room_receipts import RoomReceipts
+from app.thumbnails import cached_preview, follow_up_preview
+from app.user_cache import CachedUser, get_display_name
+from app.utils import (
+    check_user_inroom,
+    get_token_user,
+    page_size,
+    verify_password,
+    verify_token,
+)
 from database.models import Chatroom, Message, RoomMembers, User
 
 
 def json_text(
-
     sender: str, message_id: int, text: str, ts: datetime | None = None
 ) -> dict:
-    return {
-        "type": "text",
-        "message_id": message_id,
-        "timestamp": ts.strftime("%Y-%m-%d %H:%M:%S"),
-        "sender": sender,
-        "text": text,
-    }
+    return message_frame("text", message_id, sender, text, ts)
 
 
 def json_file(
@@ -40,15 +60,16 @@ def json_file(
     url: str,
     caption: str = "",
     ts: datetime | None = None,
+    preview: dict | None = None,
 ) -> dict:
-    return {
-        "type": "file",
-        "message_id": message_id,
-        "timestamp": ts.strftime("%Y-%m-%d %H:%M:%S"),
-        "sender": sender,
-        "file_url": url,
-        "text": caption,
-    }
+    # preview adds thumbnail_url/placeholder/width/height for images
+    return message_frame(
+        "file", message_id, sender, caption, ts, file_url=url, **(preview or {})
+    )
+
+
+def json_status(sender: str, text: str) -> dict:
+    return message_frame("status", None, sender, text)
 
 
 router = APIRouter()
@@ -59,21 +80,19 @@ def get_chatroom_info(
     roomid: int,
     token: str = Header(...),
 ):
-    db = SessionLocal()
-    print("checking")
-    user = verify_token(token, db)
-    room = db.query(Chatroom).filter(Chatroom.id == roomid).first()
-    if not room:
-        raise HTTPException(status_code=404, detail="Room not found")
-
-    creator = db.query(User).filter(User.id == room.created_by).first()
-    return {
-        "user": f"{user.first_name} {user.last_name}",
-        "roomname": room.roomname,
-        "creator": f"{creator.first_name} {creator.last_name}",
-        "created_at": room.created_at.isoformat(),
-        "image_url": room.image,
-    }
+    with get_db_session() as db:
+        user = verify_token(token, db)
+        room = db.query(Chatroom).filter(Chatroom.id == roomid).first()
+        if not room:
+            raise HTTPException(status_code=404, detail="Room not found")
+
+        return {
+            "user": f"{user.first_name} {user.last_name}",
+            "roomname": room.roomname,
+            "creator": get_display_name(db, room.created_by),
+            "created_at": room.created_at.isoformat(),
+            "image_url": room.image,
+        }
 
 
 html = """
@@ -143,7 +162,21 @@ html = """
 
             ws.onmessage = (event) => {
                 const message = document.createElement("li");
-                const text = event.data;
+                let text = event.data;
+                try {
+                    const frame = JSON.parse(event.data);
+                    if (frame.type === "ping") {
+                        ws.send(JSON.stringify({type: "pong"}));
+                        return;
+                    }
+                    if (["history_cursor", "seen_by", "presence", "file_preview"].includes(frame.type)) {
+                        return;
+                    }
+                    text = `Timestamp: ${frame.timestamp}\\n${frame.sender}: ${frame.text || ""}`;
+                    if (frame.file_url) {
+                        text += ` ${frame.file_url}`;
+                    }
+                } catch (e) {}
 
                 if (text.includes("/uploads/")) {
                     const parts = text.split(" ");
@@ -253,128 +286,294 @@ def display_home():
 
 
 manager = ConnectionManager()
+receipts = RoomReceipts(manager.deliver)
+room_presence = RoomPresence(manager.deliver, presence)
+
+
+def authorize_room_socket(token: str, roomid: int, password: str):
+    with get_db_session() as db:
+        try:
+            userinfo = verify_token(token, db)
+        except HTTPException:
+            return None
+
+        room = db.query(Chatroom).filter(Chatroom.id == roomid).first()
+        if not room:
+            return None
+
+        if not check_user_inroom(userinfo.id, roomid, db):
+            return None
+
+        if room.is_private:
+            if not password or not verify_password(password, room.password):
+                return None
+        return userinfo
 
 
 @router.websocket("/chat/{roomid}")
-async def websocket_endpoint(
-    websocket: WebSocket, roomid: str, db: Session = Depends(get_db)
-):
+async def websocket_endpoint(websocket: WebSocket, roomid: str):
     token = websocket.query_params.get("token")
     password = websocket.query_params.get("password", "")
-    userinfo = verify_token(token, db)
-    userid = int(userinfo.id)
     roomid = int(roomid)
 
-    room = db.query(Chatroom).filter(Chatroom.id == roomid).first()
-    if not room:
-        await websocket.close(code=1008)
-        return
-
-    is_member = check_user_inroom(userid, roomid, db)
-    if not is_member:
+    userinfo = await run_db(authorize_room_socket, token, roomid, password)
+    if not userinfo:
         await websocket.close(code=1008)
         return
 
-    if room.is_private:
-        if not password or not verify_password(password, room.password):
-            await websocket.close(code=1008)
-            return
-
-    await manager.connect(websocket, roomid)
-    await send_past_messages_to_user(websocket, roomid)
-    await manager.brodcast(
-        f"{userinfo.first_name} {userinfo.last_name} is online.", roomid
-    )
+    conn = await manager.connect(websocket, roomid)
+    session = presence.track(userinfo.id, conn)
+    reads = ReadBatcher(lambda up_to: room_read(userinfo.id, roomid, up_to))
+    in_receipts = in_presence = False
 
     try:
+        await send_past_messages_to_user(conn, roomid)
+        seen_by = await receipts.join(roomid)
+        in_receipts = True
+        await conn.send(encode(seen_by))
+        # Who is online now; later changes arrive as batched presence frames
+        online = await room_presence.join(roomid, userinfo.id)
+        in_presence = True
+        await conn.send(encode(online))
+
         while True:
-            raw_data = await websocket.receive_text()
+            frame = await receive_frame(websocket)
+            session.touch()  # answers our pings too; "pong" needs no handling
             try:
-                data = json.loads(raw_data)
+                data = frame if isinstance(frame, bytes) else json.loads(frame)
+                if not isinstance(data, (bytes, dict)):
+                    raise FrameError("Expected a JSON object")
 
-                if data["type"] == "text":
-                    stored_msg = store_and_return_message(userid, roomid, data["text"])
+                if isinstance(data, bytes) or str_field(data, "type").startswith("upload_"):
+                    upload = await handle_upload_frame(
+                        conn, userinfo.id, data, UPLOAD_DIR
+                    )
+                    if upload:
+                        await publish_file(
+                            userinfo,
+                            roomid,
+                            upload["path"],
+                            upload["mimetype"],
+                            upload["text"],
+                        )
+
+                elif data["type"] == "text":
+                    stored_msg = await save_message(userinfo, roomid, str_field(data, "text"))
                     await manager.brodcast(
-                        f"Timestamp: {stored_msg['sent_at']}\n{stored_msg['sender']}: {stored_msg['content']}",
+                        json_text(
+                            stored_msg["sender"],
+                            stored_msg["message_id"],
+                            stored_msg["content"],
+                            stored_msg["sent_at"],
+                        ),
                         roomid,
                     )
 
                 elif data["type"] == "file":
-                    header, base64_data = data["data"].split(",", 1)
+                    # Legacy single-frame base64 upload; prefer upload_init/chunks
+                    header, base64_data = str_field(data, "data").split(",", 1)
                     file_data = base64.b64decode(base64_data)
-                    filename = f"{uuid.uuid4()}_{data['filename'].replace(' ', '_')}"
+                    if len(file_data) > MAX_UPLOAD_BYTES:
+                        await conn.send("File too large.")
+                        continue
+                    filename = await store_bytes(
+                        file_data, UPLOAD_DIR, str_field(data, "filename"), str_field(data, "mimetype")
+                    )
                     filepath = os.path.join(UPLOAD_DIR, filename)
 
-                    with open(filepath, "wb") as f:
-                        f.write(file_data)
-
-                    file_url = f"/{UPLOAD_DIR}/{filename}"
-
-                    stored_msg = store_and_return_message(
-                        userid,
-                        roomid,
-                        content=data.get("text"),
-                        file_url=file_url,
-                        file_type=data["mimetype"],
+                    await publish_file(
+                        userinfo, roomid, filepath, data["mimetype"], data.get("text")
                     )
 
-                    await manager.brodcast(
-                        json_file(
-                            stored_msg["sender"],
-                            stored_msg["message_id"],
-                            file_url,
-                            stored_msg["content"],
-                            stored_msg["sent_at"],
-                        ),
+                elif data["type"] == "read":
+                    # {"up_to": N}: everything up to message N has been seen
+                    up_to = int_field(data, "up_to", 1) or int_field(data, "message_id", 1)
+                    if up_to is None:
+                        raise FrameError("'up_to' is required")
+                    reads.mark(up_to)
+
+                elif data["type"] == "load_older":
+                    await send_past_messages_to_user(
+                        conn,
                         roomid,
+                        int_field(data, "before", 1),
+                        int_field(data, "limit", 1),
                     )
             except json.JSONDecodeError:
-                await websocket.send_text("Invalid JSON format.")
+                await conn.send("Invalid JSON format.")
                 continue  # Don't exit the loop
+            except FrameError as exc:
+                await conn.send(encode(error_frame(str(exc))))
+            except (KeyError, TypeError, ValueError, AttributeError):
+                await conn.send(encode(error_frame("Malformed frame")))
     except WebSocketDisconnect:
+        pass
+    finally:
+        # Runs for errors and cancellation too, so no room keeps a dead socket
         manager.disconnect(websocket, roomid)
-        # await manager.brodcast(f"{userinfo.first_name} {userinfo.last_name} is offline", roomid)
+        presence.untrack(session)
+        if in_receipts:
+            receipts.leave(roomid)
+        if in_presence:
+            room_presence.leave(roomid)
+        await reads.close()
 
 
-async def send_past_messages_to_user(websocket: WebSocket, roomid: int):
-    db = SessionLocal()
-    try:
-        results = (
-            db.query(
-                Message.content,
-                Message.id,
-                Message.file_url,
-                Message.file_type,
-                User.first_name,
-                User.last_name,
-                Message.sent_at,
-            )
-            .join(User, Message.sender_id == User.id)
-            .filter(Message.room_id == roomid)
-            .order_by(Message.sent_at)
-            .all()
+def store_room_watermark(user_id: int, roomid: int, up_to: int | None) -> int | None:
+    with get_db_session() as db:
+        return mark_room_read_up_to(db, user_id, roomid, up_to)
+
+
+async def room_read(user_id: int, roomid: int, up_to: int | None = None) -> int | None:
+    watermark = await run_db(store_room_watermark, user_id, roomid, up_to)
+    if watermark:
+        # Every node following the room folds it into its next seen_by frame
+        await receipts.publish(roomid, user_id, watermark)
+    return watermark
+
+
+async def publish_file(
+    userinfo: CachedUser, roomid: int, path: str, mimetype: str, caption: str | None
+):
+    file_url = f"/{UPLOAD_DIR}/{os.path.basename(path)}"
+    stored_msg = await save_message(
+        userinfo,
+        roomid,
+        content=caption,
+        file_url=file_url,
+        file_type=mimetype,
+    )
+    await manager.brodcast(
+        json_file(
+            stored_msg["sender"],
+            stored_msg["message_id"],
+            file_url,
+            stored_msg["content"],
+            stored_msg["sent_at"],
+        ),
+        roomid,
+    )
+    follow_up_preview(
+        path,
+        lambda preview: manager.brodcast(
+            preview_frame(stored_msg["message_id"], file_url, preview), roomid
+        ),
+    )
+
+
+def fetch_room_history(
+    db: Session, roomid: int, before: int | None = None, limit: int | None = None
+) -> dict:
+    limit = page_size(limit)
+    query = (
+        db.query(
+            Message.content,
+            Message.id,
+            Message.file_url,
+            Message.file_type,
+            User.first_name,
+            User.last_name,
+            Message.sent_at,
+        )
+        .join(User, Message.sender_id == User.id)
+        .filter(Message.room_id == roomid)
+    )
+    if before is not None:
+        query = query.filter(Message.id < before)
+
+    # Newest page first via the primary key, one extra row tells us if more exist
+    rows = query.order_by(Message.id.desc()).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    rows.reverse()
+
+    messages = [
+        json_file(
+            f"{first_name} {last_name}",
+            id,
+            file_url,
+            content or "",
+            sent_at,
+            cached_preview(file_url),
         )
+        for content, id, file_url, file_type, first_name, last_name, sent_at in rows
+    ]
+    return {
+        "messages": messages,
+        "next_before": rows[0].id if rows and has_more else None,
+        "has_more": has_more,
+    }
 
-        for content, id, file_url, file_type, first_name, last_name, sent_at in results:
-            payload = json_file(f"{first_name} {last_name}", id, file_url, content or "", sent_at)
-            # if file_url:
-            #     if content:
-            #         message_text = f"Timestamp: {time}\n{first_name} {last_name} sent a file: {content} {file_url}"
-            #     else:
-            #         message_text = f"Timestamp: {time}\n{first_name} {last_name} sent a file: {file_url}"
-            # else:
-            #     message_text = f"Timestamp: {time}\n{first_name} {last_name}: {content}"
-            print(payload)
-            await websocket.send_text(json.dumps(payload))
-    finally:
-        db.close()
+
+def load_room_history(roomid: int, before: int | None, limit: int | None) -> dict:
+    with get_db_session() as db:
+        return fetch_room_history(db, roomid, before, limit)
+
+
+async def send_past_messages_to_user(
+    conn: ClientConnection, roomid: int, before: int | None = None, limit: int | None = None
+):
+    # Queued behind live frames as replies, which never trip the 1013 policy
+    page = await run_db(load_room_history, roomid, before, limit)
+
+    for payload in page["messages"]:
+        await conn.send(encode(payload))
+    await conn.send(
+        encode(
+            {
+                "type": "history_cursor",
+                "next_before": page["next_before"],
+                "has_more": page["has_more"],
+            }
+        )
+    )
+
+
+@router.get("/chatroom/{roomid}/history")
+def get_room_history(
+    roomid: int,
+    before: int | None = Query(None, ge=1),
+    limit: int | None = Query(None, ge=1, le=HISTORY_MAX_PAGE_SIZE),
+    db: Session = Depends(get_db),
+    user: CachedUser = Depends(get_token_user),
+):
+    if not check_user_inroom(user.id, roomid, db):
+        raise HTTPException(status_code=403, detail="You are not a member of this room")
+    return fetch_room_history(db, roomid, before, limit)
+
+
+async def save_message(
+    userinfo: CachedUser,
+    room_id: int,
+    content: str,
+    file_url: str = None,
+    file_type: str = None,
+) -> dict:
+    if not message_writer.enabled:
+        return await run_db(
+            store_and_return_message, userinfo.id, room_id, content, file_url, file_type
+        )
+
+    row = await message_writer.submit(
+        content=content,
+        sender_id=userinfo.id,
+        room_id=room_id,
+        file_url=file_url,
+        file_type=file_type,
+    )
+    return {
+        "message_id": row["id"],
+        "sender": f"{userinfo.first_name} {userinfo.last_name}",
+        "content": row["content"],
+        "file_url": row["file_url"],
+        "sent_at": row["sent_at"],
+    }
 
 
 def store_and_return_message(
     userid: int, room_id: int, content: str, file_url: str = None, file_type: str = None
 ) -> dict:
-    db = SessionLocal()
-    try:
+    with get_db_session() as db:
         print("working")
         new_message = Message(
             content=content,
@@ -384,42 +583,50 @@ def store_and_return_message(
             file_type=file_type,
         )
         db.add(new_message)
+        db.flush()
+        record_messages(db, [message_row(new_message)])
         db.commit()
         db.refresh(new_message)
         print("data sent")
 
-        user = db.query(User).filter(User.id == userid).first()
-
         return {
             "message_id": new_message.id,
-            "sender": f"{user.first_name}  {user.last_name}",
+            "sender": get_display_name(db, userid),
             "content": new_message.content or "",
             "file_url": new_message.file_url,
             "sent_at": new_message.sent_at,
         }
-    finally:
-        db.close()
 
 
-@router.get("/leftchat/{roomid}")
-async def left_chat(
-    roomid: int, db: Session = Depends(get_db), user: User = Depends(get_current_user)
-):
-    userid = user.id
-    userinfo = db.query(User.first_name, User.last_name).filter_by(id=userid).first()
+def delete_membership(user_id: int, roomid: int) -> bool:
+    with get_db_session() as db:
+        removed = db.query(RoomMembers).filter_by(user_id=user_id, room_id=roomid).delete()
+        if not removed:
+            return False
+        adjust_member_count(db, roomid, -removed)
+        db.commit()
+        return True
 
-    if not userinfo:
-        return {"error": "User not found"}
 
-    membership = check_user_inroom(userid, roomid, db)
-    if membership:
-        full_name = f"{userinfo.first_name} {userinfo.last_name}"
+async def leave_room(user: CachedUser, roomid: int) -> bool:
+    """Drop a membership and tell the room; False if there was none.
 
-        db.query(RoomMembers).filter_by(user_id=userid, room_id=roomid).delete()
-        db.commit()
+    Shared by every leave endpoint so receipts and presence never keep a
+    member who has gone.
+    """
+    if not await run_db(delete_membership, user.id, roomid):
+        return False
+
+    await manager.brodcast(json_status(user.full_name, "has left the chat"), roomid)
+    await receipts.publish(roomid, user.id, None)
+    room_presence.remove_member(roomid, user.id)
+    await search_changed()
+    return True
 
-        await manager.brodcast(json_text(full_name, "has left the chat"), roomid)
 
+@router.get("/leftchat/{roomid}")
+async def left_chat(roomid: int, user: CachedUser = Depends(get_token_user)):
+    if await leave_room(user, roomid):
         return {"message": "Leave message stored and broadcasted"}
     else:
         return {"message": "No user in this room"}
@@ -0,0 +1,19 @@
+from fastapi import APIRouter
+
+from app.autocomplete import search_cache, search_stats
+from app.thumbnails import preview_cache
+from app.user_cache import user_cache
+from app.utils import token_cache
+
+router = APIRouter(prefix="/metrics", tags=["Metrics"])
+
+
+@router.get("/cache")
+def cache_metrics():
+    # Hit rates of the in-process caches on this worker since it started
+    return {
+        "search": {**search_cache.stats(), **search_stats},
+        "users": user_cache.stats(),
+        "tokens": token_cache.stats(),
+        "previews": preview_cache.stats(),
+    }
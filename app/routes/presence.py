@@ -0,0 +1,19 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+
+from app.config import PRESENCE_QUERY_LIMIT
+from app.presence import presence
+from app.utils import get_token_user
+
+router = APIRouter()
+
+
+@router.get("/presence", dependencies=[Depends(get_token_user)])
+def get_presence(user_id: list[int] = Query(...)):
+    # /presence?user_id=1&user_id=2 ... answered from memory, no DB round trip
+    if len(user_id) > PRESENCE_QUERY_LIMIT:
+        raise HTTPException(
+            status_code=400, detail=f"At most {PRESENCE_QUERY_LIMIT} users per request"
+        )
+    online = presence.online(user_id)
+    offline = sorted(set(user_id).difference(online))
+    return {"online": online, "offline": offline}
@@ -1,5 +1,4 @@
 import os
-import uuid
 
 from fastapi import (
     APIRouter,
@@ -14,7 +13,10 @@ from fastapi import (
 from sqlalchemy.orm import Session
 
 from app import schemas
+from app.attachment_store import release, release_file, store_upload
+from app.autocomplete import search_changed
 from app.database import get_db
+from app.user_cache import invalidate_user
 from app.utils import get_current_user, hash_password, verify_password
 from database import models
 
@@ -55,21 +57,17 @@ async def update_profile(
     if email is not None:
         current_user.email = email
 
+    old_image = current_user.profile_image
     if profile_image:
-        if current_user.profile_image:
-            old_path = os.path.join("uploads", current_user.profile_image)
-            if os.path.exists(old_path):
-                os.remove(old_path)
-
-        ext = profile_image.filename.split(".")[-1]
-        new_filename = f"profile_{uuid.uuid4()}.{ext}"
-        file_path = os.path.join(UPLOAD_PROFILE_DIR, new_filename)
-        with open(file_path, "wb") as f:
-            f.write(await profile_image.read())
-
+        new_filename = await store_upload(profile_image, UPLOAD_PROFILE_DIR)
         current_user.profile_image = new_filename
     db.commit()
+    if profile_image:
+        # Only after the commit, so a failed commit never loses the file
+        await release_file(UPLOAD_PROFILE_DIR, old_image)
     db.refresh(current_user)
+    await invalidate_user(current_user.id)
+    await search_changed()
     if current_user.profile_image:
         current_user.profile_image = (
             str(request.base_url) + "profile_images/" + current_user.profile_image
@@ -98,10 +96,8 @@ def delete_profile_image(
     if not current_user.profile_image:
         raise HTTPException(status_code=404, detail="No profile image found")
 
-    file_path = os.path.join("uploads", current_user.profile_image)
-    if os.path.exists(file_path):
-        os.remove(file_path)
-
+    old_image = current_user.profile_image
     current_user.profile_image = None
     db.commit()
+    release(UPLOAD_PROFILE_DIR, old_image)
     return {"detail": "Profile image deleted"}
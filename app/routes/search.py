@@ -1,35 +1,46 @@
-from fastapi import APIRouter, Depends, Query,Request
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from sqlalchemy.orm import Session
 
+from app.autocomplete import autocomplete_rooms, autocomplete_users
+from app.config import HISTORY_MAX_PAGE_SIZE
 from app.database import get_db
-from database.models import Chatroom, RoomMembers, User
+from app.message_search import search_messages
+from app.user_cache import CachedUser
+from app.utils import check_user_inroom, get_token_user, page_size
+from database.models import User
 
 router = APIRouter(prefix="/search", tags=["Search"])
 
 
 @router.get("/users")
-def search_users(query: str = Query(..., min_length=1), db: Session = Depends(get_db)):
-    return db.query(User).filter(User.username.ilike(f"{query}%")).limit(10).all()
+async def search_users(query: str = Query(..., min_length=1)):
+    return await autocomplete_users(query)
 
 
 @router.get("/rooms")
-def search_rooms(query: str = Query(..., min_length=1), db: Session = Depends(get_db)):
-    return (
-        db.query(Chatroom).filter(Chatroom.roomname.ilike(f"{query}%")).limit(10).all()
-    )
+async def search_rooms(query: str = Query(..., min_length=1)):
+    return await autocomplete_rooms(query)
 
 
-@router.get("/users-in-room")
-def search_users_in_room(
-    room_id: int, query: str = Query(..., min_length=1), db: Session = Depends(get_db)
+@router.get("/messages")
+def search_message_content(
+    query: str = Query(..., min_length=1, max_length=200),
+    room_id: int | None = None,
+    peer_id: int | None = None,
+    offset: int = Query(0, ge=0),
+    limit: int | None = Query(None, ge=1, le=HISTORY_MAX_PAGE_SIZE),
+    db: Session = Depends(get_db),
+    user: CachedUser = Depends(get_token_user),
 ):
-    return (
-        db.query(User)
-        .join(RoomMembers)
-        .filter(RoomMembers.room_id == room_id, User.username.ilike(f"{query}%"))
-        .limit(10)
-        .all()
-    )
+    # Only rooms the caller is in and their own direct chats are ever searched
+    if room_id is not None and not check_user_inroom(user.id, room_id, db):
+        raise HTTPException(status_code=403, detail="You are not a member of this room")
+    return search_messages(db, user.id, query, room_id, peer_id, offset, page_size(limit))
+
+
+@router.get("/users-in-room")
+async def search_users_in_room(room_id: int, query: str = Query(..., min_length=1)):
+    return await autocomplete_users(query, room_id)
 
 # @router.get("/users/{user_id}")
 # def get_single_user(user_id: int, db: Session = Depends(get_db)):
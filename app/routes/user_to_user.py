@@ -1,16 +1,47 @@
-from fastapi import WebSocket, APIRouter, Depends, WebSocketDisconnect, Header
-from app.database import get_db, SessionLocal
-from sqlalchemy.orm import Session
-from app.utils import verify_token, verify_user
-from app.connection_manager import UserConnectionManager
-from fastapi.responses import HTMLResponse
-from database.models import Message, User
-from sqlalchemy import or_, and_
 import base64
-import uuid
 import json
 import os
-from contextlib import contextmanager
+from types import SimpleNamespace
+
+from fastapi import (
+    APIRouter,
+    Depends,
+    HTTPException,
+    Query,
+    WebSocket,
+    WebSocketDisconnect,
+)
+from fastapi.responses import HTMLResponse
+from sqlalchemy.orm import Session
+
+from app.attachment_store import store_bytes
+from app.chunked_upload import handle_upload_frame, receive_frame
+from app.config import HISTORY_MAX_PAGE_SIZE, MAX_UPLOAD_BYTES
+from app.connection_manager import ClientConnection, UserConnectionManager
+from app.database import get_db, get_db_session, run_db
+from app.frames import (
+    FrameError,
+    encode,
+    error_frame,
+    int_field,
+    preview_frame,
+    str_field,
+    timestamp,
+)
+from app.inbox import (
+    fetch_unread,
+    mark_read_up_to,
+    message_row,
+    record_messages,
+    refresh_unread,
+)
+from app.message_writer import message_writer
+from app.presence import presence
+from app.read_receipts import ReadBatcher
+from app.thumbnails import cached_preview, follow_up_preview
+from app.user_cache import CachedUser, get_display_name
+from app.utils import get_token_user, page_size, verify_token, verify_user
+from database.models import Message, User, conversation_key
 
 router = APIRouter()
 
@@ -51,6 +82,10 @@ html = """
                 ws = new WebSocket(`ws://localhost:8000/userchat/${receiverid}?token=${token}`);
 
                 ws.onmessage = (event) => {
+                    if (event.data === '{"type":"ping"}') {
+                        ws.send(JSON.stringify({type: "pong"}));
+                        return;
+                    }
                     const msgList = document.getElementById("messages");
                     const li = document.createElement("li");
                     li.textContent = event.data;
@@ -119,19 +154,22 @@ os.makedirs(UPLOAD_DIR, exist_ok=True)
 
 usermanager = UserConnectionManager()
 
-@contextmanager
-def get_db_session():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+def peer_presence_frame(peer_id: int, online: bool) -> dict:
+    return {"type": "presence", "online": [peer_id] if online else [], "offline": [] if online else [peer_id]}
 
-def build_message_dict(msg, sender_name, include_file_url_key=True, msg_type="message_history"):
+async def push_peer_presence(changes: dict[int, bool]):
+    # One pass over the local DM sockets per batch of presence flips
+    usermanager.offer_to_watchers(
+        {peer_id: encode(peer_presence_frame(peer_id, online)) for peer_id, online in changes.items()}
+    )
+
+presence.listen(push_peer_presence)
+
+def build_message_dict(msg, sender_name, include_file_url_key=True, msg_type="message_history", with_preview=True):
     base = {
         "type": msg_type,
         "message_id": msg.id,
-        "timestamp": msg.sent_at.strftime("%Y-%m-%d %H:%M:%S"),
+        "timestamp": timestamp(msg.sent_at),
         "sender": sender_name,
         "content": msg.content if msg.content else None,
         "status": msg.status
@@ -141,128 +179,268 @@ def build_message_dict(msg, sender_name, include_file_url_key=True, msg_type="me
         base["file_url"] = msg.file_url if msg.file_url else None
     else:
         base["file_url"] = msg.file_url if msg.file_url else None
+    if with_preview:
+        base.update(cached_preview(msg.file_url) or {})
     return base
 
-async def send_message(websocket: WebSocket, msg_dict: dict):
-    await websocket.send_text(json.dumps(msg_dict))
+async def send_message(conn: ClientConnection, msg_dict: dict):
+    # Through the connection queue, so it never races the writer task
+    await conn.send(encode(msg_dict))
 
 @router.get("/")
 def display():
     return HTMLResponse(html)
 
+def authorize_user_socket(token: str, receiver_id: int):
+    with get_db_session() as db:
+        try:
+            userinfo = verify_token(token, db)
+        except HTTPException:
+            return None
+        if not verify_user(receiver_id, db):
+            return None
+        return userinfo
+
 @router.websocket("/userchat/{receiverid}")
-async def user_websocket_endpoint(websocket: WebSocket, receiverid: str, db: Session = Depends(get_db)):
+async def user_websocket_endpoint(websocket: WebSocket, receiverid: str):
     token = websocket.query_params.get("token")
-    userinfo = verify_token(token, db)
+    receiver_id = int(receiverid)
+
+    userinfo = await run_db(authorize_user_socket, token, receiver_id)
     if not userinfo:
         await websocket.close(code=1008)
         return
 
     sender_id = int(userinfo.id)
-    receiver_id = int(receiverid)
-
-    receiver_exist = verify_user(receiver_id, db)
-    if not receiver_exist:
-        await websocket.close(code=1008)
-        return
     
-    await usermanager.connect(sender_id, receiver_id, websocket)
-    await send_past_message(websocket, sender_id, receiver_id)
+    since = websocket.query_params.get("since")
+    since = int(since) if since and since.isdigit() else None
+
+    conn = await usermanager.connect(sender_id, receiver_id, websocket)
+    session = presence.track(sender_id, conn)
+    reads = ReadBatcher(
+        lambda up_to: mark_conversation_read(sender_id, receiver_id, up_to)
+    )
 
     try:
+        await send_past_message(conn, sender_id, receiver_id, since=since)
+        await send_message(conn, peer_presence_frame(receiver_id, presence.is_online(receiver_id)))
+
         while True:
-            raw_data = await websocket.receive_text()
+            frame = await receive_frame(websocket)
+            session.touch()  # answers our pings too; "pong" needs no handling
             try:
-                data = json.loads(raw_data)
-
-                if data["type"] == "text":
-                    stored_msg = store_and_return_msg(data["text"], sender_id, receiver_id)
-                    # Notify both parties
-                    await usermanager.send_msg(sender_id, receiver_id, {
-                        **stored_msg,
-                        "type": "status_update",
-                        "status": "sent"
-                    })
-
-                    update_status("delivered", stored_msg["message_id"])
-
-                    await websocket.send_text(json.dumps({
-                        **stored_msg,
-                        "type": "status_update",
-                        "status": "delivered"
-                    }))
+                data = frame if isinstance(frame, bytes) else json.loads(frame)
+                if not isinstance(data, (bytes, dict)):
+                    raise FrameError("Expected a JSON object")
+
+                if isinstance(data, bytes) or str_field(data, "type").startswith("upload_"):
+                    upload = await handle_upload_frame(conn, sender_id, data, UPLOAD_DIR)
+                    if upload:
+                        await send_file(
+                            conn, userinfo, receiver_id,
+                            upload["path"], upload["mimetype"], upload["text"]
+                        )
+
+                elif data["type"] == "text":
+                    stored_msg = await save_msg(str_field(data, "text"), userinfo, receiver_id)
+                    await deliver(conn, sender_id, receiver_id, stored_msg)
 
                 elif data["type"] == "file":
-                    header, base64_data = data["data"].split(",", 1)
+                    # Legacy single-frame base64 upload; prefer upload_init/chunks
+                    header, base64_data = str_field(data, "data").split(",", 1)
                     file_data = base64.b64decode(base64_data)
-                    filename = f"{uuid.uuid4()}_{data['filename'].replace(' ', '_')}"
+                    if len(file_data) > MAX_UPLOAD_BYTES:
+                        await conn.send("File too large.")
+                        continue
+                    filename = await store_bytes(
+                        file_data, UPLOAD_DIR, str_field(data, "filename"), str_field(data, "mimetype")
+                    )
                     filepath = os.path.join(UPLOAD_DIR, filename)
 
-                    with open(filepath, "wb") as f:
-                        f.write(file_data)
-
-                    file_url = f"/{UPLOAD_DIR}/{filename}"
-
-                    stored_msg = store_and_return_msg(
-                        content=data.get("text"),
-                        sender_id=sender_id,
-                        receiver_id=receiver_id,
-                        file_url=file_url,
-                        file_type=data["mimetype"]
+                    await send_file(
+                        conn, userinfo, receiver_id,
+                        filepath, data["mimetype"], data.get("text")
                     )
 
-                    await usermanager.send_msg(sender_id, receiver_id, {
-                        **stored_msg,
-                        "type": "status_update",
-                        "status": "sent"
-                    })
-
-                    update_status("delivered", stored_msg["message_id"])
-
-                    await websocket.send_text(json.dumps({
-                        **stored_msg,
-                        "type": "status_update",
-                        "status": "delivered"
-                    }))
-
                 elif data["type"] == "read":
-                    message_id = data["message_id"]
-                    with get_db_session() as db:
-                        msg = db.query(Message).filter(Message.id == message_id).first()
-                        if msg and msg.receiver_id == sender_id:
-                            update_status("read", message_id)
-                            sender = db.query(User).filter(User.id == msg.sender_id).first()
-                            status_msg = build_message_dict(msg, f"{sender.first_name} {sender.last_name}", include_file_url_key=True, msg_type="status_update")
-                            status_msg["status"] = "read"
-                            await websocket.send_text(json.dumps(status_msg))
-                            # Notify sender if connected
-                            await usermanager.send_msg(msg.sender_id, msg.receiver_id, status_msg)
+                    # {"up_to": N} acknowledges everything up to N; older clients
+                    # send one frame per message_id, which coalesces the same way
+                    up_to = int_field(data, "up_to", 1) or int_field(data, "message_id", 1)
+                    if up_to is None:
+                        raise FrameError("'up_to' is required")
+                    reads.mark(up_to)
+
+                elif data["type"] == "load_older":
+                    await send_past_message(
+                        conn, sender_id, receiver_id,
+                        before=int_field(data, "before", 1), limit=int_field(data, "limit", 1)
+                    )
+
+                elif data["type"] == "resume":
+                    await send_past_message(
+                        conn, sender_id, receiver_id,
+                        since=int_field(data, "since"), limit=int_field(data, "limit", 1)
+                    )
 
             except json.JSONDecodeError:
-                await websocket.send_text("Invalid JSON format.")
+                await conn.send("Invalid JSON format.")
                 continue
+            except FrameError as exc:
+                await conn.send(encode(error_frame(str(exc))))
+            except (KeyError, TypeError, ValueError, AttributeError):
+                await conn.send(encode(error_frame("Malformed frame")))
     except WebSocketDisconnect:
+        pass
+    finally:
+        # Runs for errors and cancellation too, so no socket outlives its handler
+        presence.untrack(session)
         await usermanager.disconnect(sender_id, receiver_id, websocket)
+        await reads.close()
         print(userinfo.first_name, "disconnected")
 
-async def send_past_message(websocket: WebSocket, sender_id: int, receiver_id: int):
-    with get_db_session() as db:
-        chat_history = (
-            db.query(Message, User.first_name, User.last_name)
-            .join(User, Message.sender_id == User.id)
-            .filter(
-                or_(
-                    and_(Message.sender_id == sender_id, Message.receiver_id == receiver_id),
-                    and_(Message.sender_id == receiver_id, Message.receiver_id == sender_id)
-                )
-            )
-            .order_by(Message.sent_at)
+async def deliver(conn: ClientConnection, sender_id: int, receiver_id: int, stored_msg: dict):
+    # Notify both parties
+    await usermanager.send_msg(sender_id, receiver_id, {
+        **stored_msg,
+        "type": "status_update",
+        "status": "sent"
+    })
+
+    await set_status("delivered", stored_msg["message_id"])
+
+    await send_message(conn, {
+        **stored_msg,
+        "type": "status_update",
+        "status": "delivered"
+    })
+
+async def send_file(conn: ClientConnection, userinfo: CachedUser, receiver_id: int, path: str, mimetype: str, caption: str | None):
+    file_url = f"/{UPLOAD_DIR}/{os.path.basename(path)}"
+    stored_msg = await save_msg(
+        content=caption,
+        userinfo=userinfo,
+        receiver_id=receiver_id,
+        file_url=file_url,
+        file_type=mimetype
+    )
+    await deliver(conn, userinfo.id, receiver_id, stored_msg)
+    follow_up_preview(
+        path,
+        lambda preview: usermanager.send_msg(
+            userinfo.id, receiver_id, preview_frame(stored_msg["message_id"], file_url, preview)
+        ),
+    )
+
+def fetch_dm_history(
+    db: Session,
+    user_id: int,
+    peer_id: int,
+    before: int | None = None,
+    since: int | None = None,
+    limit: int | None = None,
+) -> dict:
+    limit = page_size(limit)
+    query = (
+        db.query(Message, User.first_name, User.last_name)
+        .join(User, Message.sender_id == User.id)
+        .filter(Message.conversation_key == conversation_key(user_id, peer_id))
+    )
+    if since is not None:
+        # Resume: oldest-first delta after the last message the client has seen
+        rows = (
+            query.filter(Message.id > since)
+            .order_by(Message.id)
+            .limit(limit + 1)
             .all()
         )
-        for msg, first_name, last_name in chat_history:
-            sender_name = f"{first_name} {last_name}"
-            msg_dict = build_message_dict(msg, sender_name)
-            await send_message(websocket, msg_dict)
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+    else:
+        if before is not None:
+            query = query.filter(Message.id < before)
+        rows = query.order_by(Message.id.desc()).limit(limit + 1).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        rows.reverse()
+
+    messages = [
+        build_message_dict(msg, f"{first_name} {last_name}")
+        for msg, first_name, last_name in rows
+    ]
+    return {
+        "messages": messages,
+        "next_before": messages[0]["message_id"] if messages else before,
+        "next_since": messages[-1]["message_id"] if messages else since,
+        "has_more": has_more,
+    }
+
+
+def load_dm_history(
+    user_id: int,
+    peer_id: int,
+    before: int | None,
+    since: int | None,
+    limit: int | None,
+) -> dict:
+    with get_db_session() as db:
+        return fetch_dm_history(db, user_id, peer_id, before, since, limit)
+
+
+async def send_past_message(
+    conn: ClientConnection,
+    sender_id: int,
+    receiver_id: int,
+    before: int | None = None,
+    since: int | None = None,
+    limit: int | None = None,
+):
+    page = await run_db(load_dm_history, sender_id, receiver_id, before, since, limit)
+
+    for msg_dict in page["messages"]:
+        await send_message(conn, msg_dict)
+    await send_message(conn, {
+        "type": "history_cursor",
+        "next_before": page["next_before"],
+        "next_since": page["next_since"],
+        "has_more": page["has_more"],
+    })
+
+
+@router.get("/userchat/{receiverid}/history")
+def get_dm_history(
+    receiverid: int,
+    before: int | None = Query(None, ge=1),
+    since: int | None = Query(None, ge=0),
+    limit: int | None = Query(None, ge=1, le=HISTORY_MAX_PAGE_SIZE),
+    db: Session = Depends(get_db),
+    user: CachedUser = Depends(get_token_user),
+):
+    if not verify_user(receiverid, db):
+        raise HTTPException(status_code=404, detail="User not found")
+    return fetch_dm_history(db, user.id, receiverid, before, since, limit)
+
+async def save_msg(content: str, userinfo: CachedUser, receiver_id: int, file_url: str = None, file_type: str = None) -> dict:
+    if not message_writer.enabled:
+        return await run_db(store_and_return_msg, content, userinfo.id, receiver_id, file_url, file_type)
+
+    row = await message_writer.submit(
+        content=content,
+        sender_id=userinfo.id,
+        receiver_id=receiver_id,
+        conversation_key=conversation_key(userinfo.id, receiver_id),
+        file_url=file_url,
+        file_type=file_type,
+        status="sent"
+    )
+    sender_name = f"{userinfo.first_name} {userinfo.last_name}"
+    # A new file has no preview yet; it follows as a file_preview frame
+    return build_message_dict(SimpleNamespace(**row), sender_name, include_file_url_key=False, with_preview=False)
+
+async def set_status(status: str, message_id: int):
+    # Rows still queued for write-behind take the new status in memory
+    if not message_writer.update_status(message_id, status):
+        await run_db(update_status, status, message_id)
 
 def store_and_return_msg(content: str, sender_id: int, receiver_id: int, file_url: str = None, file_type: str = None) -> dict:
     with get_db_session() as db:
@@ -272,68 +450,111 @@ def store_and_return_msg(content: str, sender_id: int, receiver_id: int, file_ur
             file_url=file_url,
             file_type=file_type,
             receiver_id=receiver_id,
+            conversation_key=conversation_key(sender_id, receiver_id),
             status="sent"
         )
         db.add(new_message)
+        db.flush()
+        record_messages(db, [message_row(new_message)])
         db.commit()
         db.refresh(new_message)
 
-        user = db.query(User).filter(User.id == sender_id).first()
-        sender_name = f"{user.first_name} {user.last_name}"
-        return build_message_dict(new_message, sender_name, include_file_url_key=False)
+        sender_name = get_display_name(db, sender_id)
+        return build_message_dict(new_message, sender_name, include_file_url_key=False, with_preview=False)
+
+def read_ack(reader_id: int, up_to: int) -> dict:
+    # One frame acknowledges every message up to up_to; message_id keeps
+    # older clients (which flip a single message) working
+    return {
+        "type": "status_update",
+        "status": "read",
+        "reader_id": reader_id,
+        "message_id": up_to,
+        "up_to": up_to,
+    }
+
+def store_read_watermark(reader_id: int, peer_id: int, up_to: int | None) -> int | None:
+    with get_db_session() as db:
+        return mark_read_up_to(db, reader_id, peer_id, up_to)
+
+async def mark_conversation_read(reader_id: int, peer_id: int, up_to: int | None = None) -> int | None:
+    # Rows still queued for write-behind take the status in memory
+    pending = message_writer.mark_read(reader_id, peer_id, up_to) if message_writer.enabled else 0
+    watermark = await run_db(store_read_watermark, reader_id, peer_id, up_to)
+    up_to = max(watermark or 0, pending)
+    if not up_to:
+        return None
+    # Reaches the peer and every socket the reader has open on this chat
+    await usermanager.send_msg(reader_id, peer_id, read_ack(reader_id, up_to))
+    return up_to
+
+@router.post("/userchat/{receiverid}/read")
+async def mark_chat_read(
+    receiverid: int,
+    up_to: int | None = Query(None, ge=1),
+    user: CachedUser = Depends(get_token_user),
+):
+    # Bulk "mark conversation read": one watermark write however many messages
+    last_read = await mark_conversation_read(user.id, receiverid, up_to)
+    return {"receiver_id": receiverid, "last_read_message_id": last_read}
+
+@router.get("/unread")
+def get_unread(db: Session = Depends(get_db), user: CachedUser = Depends(get_token_user)):
+    return fetch_unread(db, user.id)
 
 def update_status(status: str, message_id: int):
     with get_db_session() as db:
         msg = db.query(Message).filter(Message.id == message_id).first()
         if msg:
             msg.status = status
+            if status == "read":
+                db.flush()
+                refresh_unread(db, {(msg.receiver_id, msg.sender_id)})
             db.commit()
             return True
     return False
 
 # frontend-url = `ws://localhost:8000/readstatus?messageid=${messageId}&receivertoken=${receiverToken}`;
 # receivertoken mean logged in user ko token
-@router.websocket("/readstatus")
-async def readstatus(websocket: WebSocket, messageid: int, receivertoken: str, db: Session = Depends(get_db)):
-    await websocket.accept()
-
-    try:
+def read_receipt(messageid: int, receivertoken: str) -> dict:
+    with get_db_session() as db:
         userinfo = verify_token(receivertoken, db)
         if not userinfo:
-            await websocket.send_text(json.dumps({"error": "Invalid token"}))
-            await websocket.close()
-            return
+            return {"error": "Invalid token"}
 
         msg = db.query(Message).filter(Message.id == messageid).first()
         if not msg:
-            await websocket.send_text(json.dumps({"error": "Message not found"}))
-            await websocket.close()
-            return
+            return {"error": "Message not found"}
 
         if userinfo.id != msg.receiver_id:
-            await websocket.send_text(json.dumps({"error": "Unauthorized"}))
-            await websocket.close()
-            return
+            return {"error": "Unauthorized"}
 
-        # Update status
-        update_status("read", messageid)
+        # Advance the read watermark through this message
+        mark_read_up_to(db, userinfo.id, msg.sender_id, messageid)
 
-        sender = db.query(User).filter(User.id == msg.sender_id).first()
-        timestamp = msg.sent_at.strftime("%Y-%m-%d %H:%M:%S")
-
-        await websocket.send_text(json.dumps({
+        return {
             "type": "status_update",
             "message_id": messageid,
-            "timestamp": timestamp,
-            "sender": f"{sender.first_name} {sender.last_name}",
+            "timestamp": timestamp(msg.sent_at),
+            "sender": get_display_name(db, msg.sender_id),
             "content": msg.content,
             "file_url": f"messages/{msg.file_url}",
             "status": "read"
-        }))
+        }
+
+@router.websocket("/readstatus")
+async def readstatus(websocket: WebSocket, messageid: int, receivertoken: str):
+    await websocket.accept()
+
+    try:
+        receipt = await run_db(read_receipt, messageid, receivertoken)
+        await websocket.send_text(encode(receipt))
+        if "error" in receipt:
+            await websocket.close()
 
     except WebSocketDisconnect:
         print("WebSocket disconnected")
 
     except Exception as e:
-        await websocket.send_text(json.dumps({"error": str(e)}))
+        await websocket.send_text(encode({"error": str(e)}))
         await websocket.close()
\ No newline at end of file
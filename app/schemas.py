@@ -69,3 +69,10 @@ class LastMessageResponse(BaseModel):
 
     class Config:
         orm_mode = True
+
+
+class DirectUpload(BaseModel):
+    filename: str
+    mimetype: Annotated[str, StringConstraints(min_length=1)]
+    size: int
+    sha256: Annotated[str, StringConstraints(pattern=r"^[0-9a-f]{64}$")]
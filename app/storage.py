@@ -0,0 +1,210 @@
+import base64
+import os
+import tempfile
+from contextlib import contextmanager
+
+from app.config import S3_ENDPOINT_URL, S3_URL_EXPIRES, STORAGE_URL
+from app.media import IMMUTABLE, precompress, remove_variants
+
+# Local staging area and the public URL prefix for stored objects. Keys are
+# "<kind>/<name>", e.g. "messages/<sha256>.png" -> /uploads/messages/<sha256>.png
+UPLOAD_ROOT = "uploads"
+# What S3 (and compatible stores) answer with for a missing object
+MISSING_CODES = ("404", "NoSuchKey", "NotFound")
+
+
+def key_for(path: str) -> str:
+    """Storage key for a path under ``uploads/`` (or a ``/uploads/...`` URL)."""
+    return os.path.relpath(path.lstrip("/"), UPLOAD_ROOT).replace(os.sep, "/")
+
+
+class LocalStorage:
+    """Objects live on this node's disk and are served by ``MediaFiles``."""
+
+    presigned = False
+
+    def __init__(self, root: str = UPLOAD_ROOT):
+        self.root = root
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, *key.split("/"))
+
+    def save(self, key: str, src_path: str, content_type: str | None = None):
+        """Move a finished local file into the store (consumes ``src_path``)."""
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(src_path, path)
+        precompress(path, content_type)
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self.path(key))
+
+    def read(self, key: str) -> bytes | None:
+        try:
+            with open(self.path(key), "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def move(self, src_key: str, key: str):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(self.path(src_key), path)
+
+    def delete(self, key: str):
+        path = self.path(key)
+        if os.path.exists(path):
+            os.remove(path)
+        remove_variants(path)
+
+    @contextmanager
+    def local_file(self, key: str):
+        yield self.path(key)
+
+    def verified_size(self, _key: str, _sha256: str) -> int | None:
+        # Local objects only ever arrive through commit_file, never directly
+        return None
+
+    def url(self, key: str) -> str:
+        return f"/{UPLOAD_ROOT}/{key}"
+
+
+class S3Storage:
+    """Objects in an S3-compatible bucket (AWS, MinIO, a local fake).
+
+    Clients download through short-lived pre-signed URLs (``/uploads/...``
+    redirects there) and can upload straight to the bucket, so attachment
+    bytes never pass through the app workers. ``client`` only needs the
+    boto3 S3 client methods used below, so a fake can stand in for it.
+    """
+
+    presigned = True
+
+    def __init__(
+        self,
+        bucket: str,
+        prefix: str = "",
+        client=None,
+        endpoint_url: str | None = S3_ENDPOINT_URL,
+        expires: int = S3_URL_EXPIRES,
+    ):
+        if client is None:
+            try:
+                import boto3
+            except ImportError as exc:
+                raise RuntimeError(
+                    "STORAGE_URL points at S3 but the 'boto3' package is not installed"
+                ) from exc
+            client = boto3.client("s3", endpoint_url=endpoint_url)
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.strip("/") + "/" if prefix.strip("/") else ""
+        self.expires = expires
+
+    def object_key(self, key: str) -> str:
+        return self.prefix + key
+
+    def save(self, key: str, src_path: str, content_type: str | None = None):
+        extra = {"CacheControl": IMMUTABLE}
+        if content_type:
+            extra["ContentType"] = content_type
+        self.client.upload_file(src_path, self.bucket, self.object_key(key), ExtraArgs=extra)
+        os.remove(src_path)
+
+    def head(self, key: str) -> dict | None:
+        try:
+            return self.client.head_object(
+                Bucket=self.bucket, Key=self.object_key(key), ChecksumMode="ENABLED"
+            )
+        except self.client.exceptions.ClientError as exc:
+            if exc.response.get("Error", {}).get("Code") in MISSING_CODES:
+                return None
+            raise
+
+    def exists(self, key: str) -> bool:
+        return self.head(key) is not None
+
+    def read(self, key: str) -> bytes | None:
+        try:
+            obj = self.client.get_object(Bucket=self.bucket, Key=self.object_key(key))
+        except self.client.exceptions.ClientError as exc:
+            # NoSuchKey is a ClientError too, but some stores only send the code
+            if exc.response.get("Error", {}).get("Code") in MISSING_CODES:
+                return None
+            raise
+        return obj["Body"].read()
+
+    def move(self, src_key: str, key: str):
+        # Server-side copy: the bytes never leave the bucket
+        self.client.copy_object(
+            Bucket=self.bucket,
+            Key=self.object_key(key),
+            CopySource={"Bucket": self.bucket, "Key": self.object_key(src_key)},
+            ChecksumAlgorithm="SHA256",
+        )
+        self.delete(src_key)
+
+    def delete(self, key: str):
+        self.client.delete_object(Bucket=self.bucket, Key=self.object_key(key))
+
+    @contextmanager
+    def local_file(self, key: str):
+        # Thumbnailing needs a real file; fetch a temporary copy
+        fd, path = tempfile.mkstemp(suffix=os.path.splitext(key)[1])
+        try:
+            with os.fdopen(fd, "wb") as f:
+                self.client.download_fileobj(self.bucket, self.object_key(key), f)
+            yield path
+        finally:
+            os.remove(path)
+
+    def verified_size(self, key: str, sha256: str) -> int | None:
+        """Size of a directly uploaded object, if S3 confirms its SHA-256."""
+        head = self.head(key)
+        if head is None or head.get("ChecksumSHA256") != checksum(sha256):
+            return None
+        return head["ContentLength"]
+
+    def url(self, key: str) -> str:
+        return self.client.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": self.bucket, "Key": self.object_key(key)},
+            ExpiresIn=self.expires,
+        )
+
+    def upload_url(self, key: str, content_type: str, size: int, sha256: str) -> dict:
+        # S3 rejects the PUT unless the body matches the declared SHA-256
+        headers = {
+            "Content-Type": content_type,
+            "Cache-Control": IMMUTABLE,
+            "x-amz-checksum-sha256": checksum(sha256),
+        }
+        url = self.client.generate_presigned_url(
+            "put_object",
+            Params={
+                "Bucket": self.bucket,
+                "Key": self.object_key(key),
+                "ContentType": content_type,
+                "ContentLength": size,
+                "CacheControl": IMMUTABLE,
+                "ChecksumSHA256": headers["x-amz-checksum-sha256"],
+            },
+            ExpiresIn=self.expires,
+        )
+        return {"method": "PUT", "url": url, "headers": headers}
+
+
+def checksum(sha256: str) -> str:
+    # S3 reports checksums base64-encoded rather than hex
+    return base64.b64encode(bytes.fromhex(sha256)).decode()
+
+
+def create_storage(url: str | None = STORAGE_URL) -> LocalStorage | S3Storage:
+    # "s3://bucket/optional/prefix"; anything else keeps files under uploads/
+    if url and url.startswith("s3://"):
+        bucket, _, prefix = url[len("s3://") :].partition("/")
+        return S3Storage(bucket, prefix)
+    return LocalStorage()
+
+
+storage = create_storage()
@@ -0,0 +1,240 @@
+import asyncio
+import json
+import logging
+import math
+import os
+import tempfile
+from collections.abc import Awaitable, Callable
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # optional: without Pillow originals are served as-is
+    Image = None
+
+from app.cache import TTLCache
+from app.config import PREVIEW_CACHE_SIZE, THUMBNAIL_SIZE, THUMBNAIL_WORKERS
+from app.storage import UPLOAD_ROOT, key_for, storage
+
+logger = logging.getLogger(__name__)
+
+# uploads/messages/<sha>.png -> uploads/thumbnails/messages/<sha>.webp (+ .json)
+STAGING_DIR = os.path.join(UPLOAD_ROOT, "tmp")
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".webp", ".bmp"}
+
+BASE83 = (
+    "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~"
+)
+PLACEHOLDER_SAMPLE = 32
+
+# file path -> preview dict, or {} (briefly) when there is no sidecar yet
+preview_cache = TTLCache(PREVIEW_CACHE_SIZE, 3600)
+PREVIEW_MISS_TTL = 60
+_pool: ProcessPoolExecutor | None = None
+_pending: dict[str, asyncio.Future] = {}
+# Background renders started by follow_up_preview, referenced until done
+_followups: set[asyncio.Task] = set()
+
+
+def _base83(value: int, length: int) -> str:
+    return "".join(BASE83[value // 83 ** (length - i - 1) % 83] for i in range(length))
+
+
+def _to_linear(value: int) -> float:
+    v = value / 255
+    return v / 12.92 if v <= 0.04045 else ((v + 0.055) / 1.055) ** 2.4
+
+
+def _to_srgb(value: float) -> int:
+    v = max(0.0, min(1.0, value))
+    if v <= 0.0031308:
+        return int(v * 12.92 * 255 + 0.5)
+    return int((1.055 * v ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+
+def blurhash(rgb: bytes, width: int, height: int, x_components: int = 4, y_components: int = 3) -> str:
+    """Encode raw RGB pixels as a BlurHash string (https://blurha.sh)."""
+    pixels = [
+        (_to_linear(rgb[i]), _to_linear(rgb[i + 1]), _to_linear(rgb[i + 2]))
+        for i in range(0, width * height * 3, 3)
+    ]
+    factors = []
+    for j in range(y_components):
+        for i in range(x_components):
+            norm = 1 if i == j == 0 else 2
+            r = g = b = 0.0
+            for y in range(height):
+                cos_y = math.cos(math.pi * j * y / height)
+                for x in range(width):
+                    basis = norm * math.cos(math.pi * i * x / width) * cos_y
+                    pr, pg, pb = pixels[y * width + x]
+                    r += basis * pr
+                    g += basis * pg
+                    b += basis * pb
+            scale = 1 / (width * height)
+            factors.append((r * scale, g * scale, b * scale))
+
+    dc, ac = factors[0], factors[1:]
+    result = _base83(x_components - 1 + (y_components - 1) * 9, 1)
+    if ac:
+        quantised_max = max(0, min(82, int(max(abs(c) for f in ac for c in f) * 166 - 0.5)))
+        max_value = (quantised_max + 1) / 166
+    else:
+        quantised_max, max_value = 0, 1
+    result += _base83(quantised_max, 1)
+    result += _base83((_to_srgb(dc[0]) << 16) + (_to_srgb(dc[1]) << 8) + _to_srgb(dc[2]), 4)
+    for f in ac:
+        r, g, b = (
+            max(0, min(18, math.floor(math.copysign(abs(c / max_value) ** 0.5, c) * 9 + 9.5)))
+            for c in f
+        )
+        result += _base83(r * 19 * 19 + g * 19 + b, 2)
+    return result
+
+
+def preview_keys(path: str) -> tuple[str, str]:
+    kind, name = key_for(path).split("/", 1)
+    stem = os.path.splitext(name)[0]
+    base = f"thumbnails/{kind}/{stem}"
+    return f"{base}.webp", f"{base}.json"
+
+
+def render_preview(source: str, thumb_path: str, thumbnail_url: str, size: int = THUMBNAIL_SIZE) -> dict:
+    """Write a thumbnail and return its metadata (runs in a worker process)."""
+    with Image.open(source) as img:
+        width, height = img.size
+        img.draft("RGB", (size, size))  # JPEG: decode at reduced scale
+        img = ImageOps.exif_transpose(img).convert("RGB")
+        img.thumbnail((size, size))
+        img.save(thumb_path, "WEBP", quality=80)
+        sample = img.resize((PLACEHOLDER_SAMPLE, PLACEHOLDER_SAMPLE))
+
+    return {
+        "thumbnail_url": thumbnail_url,
+        "placeholder": blurhash(sample.tobytes(), PLACEHOLDER_SAMPLE, PLACEHOLDER_SAMPLE),
+        "width": width,
+        "height": height,
+    }
+
+
+def build_preview(path: str) -> dict:
+    # Fetch the original (a no-op on local disk), render in the pool, store both outputs
+    thumb_key, meta_key = preview_keys(path)
+    os.makedirs(STAGING_DIR, exist_ok=True)
+    fd, thumb_tmp = tempfile.mkstemp(dir=STAGING_DIR, suffix=".webp")
+    os.close(fd)
+    try:
+        with storage.local_file(key_for(path)) as source:
+            preview = get_pool().submit(
+                render_preview, source, thumb_tmp, f"/{UPLOAD_ROOT}/{thumb_key}"
+            ).result()
+        storage.save(thumb_key, thumb_tmp, "image/webp")
+    finally:
+        if os.path.exists(thumb_tmp):
+            os.remove(thumb_tmp)
+
+    fd, meta_tmp = tempfile.mkstemp(dir=STAGING_DIR, suffix=".json")
+    with os.fdopen(fd, "w") as f:
+        json.dump(preview, f)
+    storage.save(meta_key, meta_tmp, "application/json")
+    return preview
+
+
+def is_image(path: str) -> bool:
+    return os.path.splitext(path)[1].lower() in IMAGE_EXTENSIONS
+
+
+def cached_preview(file_url: str | None) -> dict | None:
+    """Preview fields for a stored file, from memory or the stored sidecar.
+
+    A miss reads storage (an S3 GET in production), so call it from a worker
+    thread; coroutines use ``load_preview``.
+    """
+    if not file_url or not is_image(file_url):
+        return None
+    path = file_url.lstrip("/")
+    preview = preview_cache.get(path)
+    if preview is None:
+        try:
+            preview = json.loads(storage.read(preview_keys(path)[1]) or b"{}")
+        except ValueError:
+            preview = {}
+        # A render may still be writing the sidecar, so misses expire quickly
+        preview_cache.set(path, preview, None if preview else PREVIEW_MISS_TTL)
+    return preview or None
+
+
+async def load_preview(file_url: str | None) -> dict | None:
+    if not file_url or not is_image(file_url):
+        return None
+    preview = preview_cache.get(file_url.lstrip("/"))
+    if preview is not None:
+        return preview or None
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, cached_preview, file_url)
+
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=THUMBNAIL_WORKERS)
+    return _pool
+
+
+async def ensure_preview(path: str) -> dict | None:
+    """Render (once) the thumbnail and placeholder for an uploaded image."""
+    if Image is None or not is_image(path):
+        return None
+    preview = await load_preview(f"/{path}")
+    if preview:
+        return preview
+
+    # Identical content shares a file, so concurrent senders share one render
+    future = _pending.get(path)
+    if future is None:
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(None, build_preview, path)
+        _pending[path] = future
+    try:
+        preview = await asyncio.shield(future)
+    except Exception:
+        # Not cached, so the next upload or history read tries again
+        logger.exception("Preview generation failed for %s", path)
+        return None
+    finally:
+        _pending.pop(path, None)
+    preview_cache.set(path, preview)
+    return preview or None
+
+
+def follow_up_preview(path: str, publish: Callable[[dict], Awaitable[None]]):
+    """Render in the background and hand the preview to ``publish``.
+
+    Lets a file message go out as soon as it is stored; clients patch the
+    thumbnail in when the follow-up frame arrives.
+    """
+    if Image is None or not is_image(path):
+        return
+    task = asyncio.create_task(_follow_up(path, publish))
+    _followups.add(task)
+    task.add_done_callback(_followups.discard)
+
+
+async def _follow_up(path: str, publish: Callable[[dict], Awaitable[None]]):
+    preview = await ensure_preview(path)
+    if preview:
+        try:
+            await publish(preview)
+        except Exception:
+            logger.exception("Failed to publish preview for %s", path)
+
+
+def remove_preview(path: str):
+    preview_cache.pop(path)
+    for key in preview_keys(path):
+        storage.delete(key)
+
+
+def shutdown():
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
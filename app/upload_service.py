@@ -0,0 +1,57 @@
+import hashlib
+import os
+import uuid
+from typing import NamedTuple
+
+from fastapi import HTTPException, UploadFile
+from fastapi.concurrency import run_in_threadpool
+
+from app.config import MAX_IMAGE_BYTES, UPLOAD_CHUNK_SIZE
+
+
+class StoredFile(NamedTuple):
+    path: str
+    filename: str
+    size: int
+    sha256: str
+
+
+def _write_chunk(f, data: bytes):
+    f.write(data)
+
+
+async def save_upload(
+    upload: UploadFile,
+    directory: str,
+    filename: str,
+    max_bytes: int = MAX_IMAGE_BYTES,
+) -> StoredFile:
+    """Stream an ``UploadFile`` to ``directory/filename`` chunk by chunk.
+
+    Writes happen in the thread pool, the SHA-256 is computed as bytes pass
+    through, and anything over ``max_bytes`` is rejected with a 413 without
+    leaving a partial file behind.
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, filename)
+    tmp_path = os.path.join(directory, f".{uuid.uuid4().hex}.part")
+    digest = hashlib.sha256()
+    size = 0
+
+    f = await run_in_threadpool(open, tmp_path, "wb")
+    try:
+        while chunk := await upload.read(UPLOAD_CHUNK_SIZE):
+            size += len(chunk)
+            if size > max_bytes:
+                raise HTTPException(
+                    status_code=413, detail=f"File exceeds the {max_bytes} byte limit"
+                )
+            digest.update(chunk)
+            await run_in_threadpool(_write_chunk, f, chunk)
+    except BaseException:
+        await run_in_threadpool(f.close)
+        os.remove(tmp_path)
+        raise
+    await run_in_threadpool(f.close)
+    await run_in_threadpool(os.replace, tmp_path, path)
+    return StoredFile(path, filename, size, digest.hexdigest())
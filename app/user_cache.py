@@ -0,0 +1,56 @@
+from typing import NamedTuple
+
+from sqlalchemy.orm import Session
+
+from app.broker import broker
+from app.cache import TTLCache
+from app.config import USER_CACHE_SIZE, USER_CACHE_TTL
+from database.models import User
+
+
+class CachedUser(NamedTuple):
+    id: int
+    username: str
+    first_name: str
+    last_name: str
+    profile_image: str | None
+
+    @property
+    def full_name(self) -> str:
+        return f"{self.first_name} {self.last_name}"
+
+
+user_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+
+
+def remember_user(user: User) -> CachedUser:
+    cached = CachedUser(
+        user.id, user.username, user.first_name, user.last_name, user.profile_image
+    )
+    user_cache.set(cached.id, cached)
+    return cached
+
+
+def get_cached_user(db: Session, user_id: int) -> CachedUser | None:
+    cached = user_cache.get(int(user_id))
+    if cached is not None:
+        return cached
+    user = db.query(User).filter(User.id == user_id).first()
+    return remember_user(user) if user else None
+
+
+def get_display_name(db: Session, user_id: int) -> str:
+    user = get_cached_user(db, user_id)
+    return user.full_name if user else ""
+
+
+async def invalidate_user(user_id: int):
+    # Published so every worker drops its copy, not just this one
+    await broker.publish(f"user:{user_id}", "invalidate")
+
+
+async def _drop_user(key: str, _message: str):
+    user_cache.pop(int(key))
+
+
+broker.subscribe("user:", _drop_user)
@@ -1,10 +1,22 @@
+import hashlib
+import time
+
 import jwt
 from fastapi import Depends, Header, HTTPException, Query
 from passlib.context import CryptContext
 from sqlalchemy.orm import Session
 
-from app.config import ALGORITHM, SECRET_KEY
-from app.database import get_db
+from app.cache import TTLCache
+from app.config import (
+    ALGORITHM,
+    HISTORY_MAX_PAGE_SIZE,
+    HISTORY_PAGE_SIZE,
+    SECRET_KEY,
+    TOKEN_CACHE_SIZE,
+    TOKEN_CACHE_TTL,
+)
+from app.database import get_db, get_db_session
+from app.user_cache import CachedUser, get_cached_user, remember_user, user_cache
 from database.models import RoomMembers, User
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -18,6 +30,38 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
 
+token_cache = TTLCache(TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL)
+
+
+def decode_token(token: str) -> dict:
+    # Keyed by hash so raw tokens never sit in memory as dict keys
+    key = hashlib.sha256(token.encode()).hexdigest()
+    payload = token_cache.get(key)
+    if payload is not None:
+        return payload
+
+    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    ttl = TOKEN_CACHE_TTL
+    if "exp" in payload:
+        # Never cache a token past its own expiry
+        ttl = min(ttl, payload["exp"] - time.time())
+    if ttl > 0:
+        token_cache.set(key, payload, ttl)
+    return payload
+
+
+def user_from_claims(payload: dict, db: Session | None = None) -> CachedUser | None:
+    # Only ``sub`` is trusted: profile fields in the token would outlive
+    # update_profile, and a deleted user must stop resolving
+    user_id = int(payload.get("sub"))
+    cached = user_cache.get(user_id)
+    if cached is not None:
+        return cached
+    if db is not None:
+        return get_cached_user(db, user_id)
+    return None
+
+
 def get_current_user(
     authorization: str | None = Header(...), db: Session = Depends(get_db)
 ):
@@ -26,13 +70,12 @@ def get_current_user(
         if scheme.lower() != "bearer":
             raise HTTPException(status_code=401, detail="Invalid token scheme")
 
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        print(payload)
+        payload = decode_token(token)
         user_id = payload.get("sub")
         user = db.query(User).filter_by(id=user_id).first()
-        print(user)
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
+        remember_user(user)
         return user
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token has expired")
@@ -40,16 +83,35 @@ def get_current_user(
         raise HTTPException(status_code=401, detail="Invalid or missing token")
 
 
+def get_token_user(authorization: str | None = Header(...)) -> CachedUser:
+    # Identity-only dependency: resolves from cache or claims without a session
+    try:
+        scheme, token = authorization.split()
+        if scheme.lower() != "bearer":
+            raise HTTPException(status_code=401, detail="Invalid token scheme")
+
+        payload = decode_token(token)
+        user = user_from_claims(payload)
+        if user is None:
+            with get_db_session() as db:
+                user = user_from_claims(payload, db)
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+        return user
+    except jwt.ExpiredSignatureError as exc:
+        raise HTTPException(status_code=401, detail="Token has expired") from exc
+    except Exception as exc:
+        raise HTTPException(status_code=401, detail="Invalid or missing token") from exc
+
+
 def verify_token(obtained_token: str = Query(...), db: Session = Depends(get_db)):
     try:
         if obtained_token.lower().startswith("bearer "):
             token = obtained_token[7:]  # strip first 7 chars (bearer + space)
         else:
             token = obtained_token
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id = int(payload.get("sub"))
-        print(f"user_id from token: {user_id}")
-        user = db.query(User).filter_by(id=user_id).first()
+        payload = decode_token(token)
+        user = user_from_claims(payload, db)
 
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
@@ -68,3 +130,9 @@ def check_user_inroom(userid: int, roomid: int, db: Session):
 def verify_user(id: int, db: Session):
     userexist = db.query(User).filter_by(id=id).first()
     return userexist is not None
+
+
+def page_size(limit: int | None) -> int:
+    if not limit or limit < 1:
+        return HISTORY_PAGE_SIZE
+    return min(limit, HISTORY_MAX_PAGE_SIZE)
@@ -0,0 +1,40 @@
+"""Drop room rows from conversation summaries
+
+Revision ID: 0c5b8e3d7a16
+Revises: 6a3e9d2c4b71
+Create Date: 2026-10-18 22:04:31.552817
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0c5b8e3d7a16'
+down_revision: Union[str, Sequence[str], None] = '6a3e9d2c4b71'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Room inbox entries are read off chatroom and room_members now
+    op.execute("DELETE FROM conversation_summaries WHERE room_id IS NOT NULL")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # Rebuild a row for every member of a room with messages; unread counts
+    # follow each member's read watermark
+    op.execute(
+        "INSERT INTO conversation_summaries "
+        "(user_id, room_id, last_message_id, last_message_at, last_read_message_id, unread_count) "
+        "SELECT room_members.user_id, chatroom.id, chatroom.last_message_id, "
+        "chatroom.last_activity_at, room_members.last_read_message_id, "
+        "(SELECT COUNT(*) FROM messages WHERE messages.room_id = chatroom.id "
+        " AND messages.id > COALESCE(room_members.last_read_message_id, 0) "
+        " AND messages.sender_id != room_members.user_id) "
+        "FROM room_members JOIN chatroom ON chatroom.id = room_members.room_id "
+        "WHERE chatroom.last_message_id IS NOT NULL"
+    )
@@ -0,0 +1,77 @@
+"""Add conversation summaries
+
+Revision ID: 3a9f6d21b7e5
+Revises: 7e2b5c90d1a4
+Create Date: 2026-10-18 13:26:05.118342
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3a9f6d21b7e5'
+down_revision: Union[str, Sequence[str], None] = '7e2b5c90d1a4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('conversation_summaries',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('peer_id', sa.Integer(), nullable=True),
+    sa.Column('room_id', sa.Integer(), nullable=True),
+    sa.Column('last_message_id', sa.Integer(), nullable=True),
+    sa.Column('last_message_at', sa.DateTime(), nullable=True),
+    sa.Column('unread_count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['last_message_id'], ['messages.id'], ),
+    sa.ForeignKeyConstraint(['peer_id'], ['users.id'], ),
+    sa.ForeignKeyConstraint(['room_id'], ['chatroom.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('user_id', 'peer_id', name='uq_conversation_summaries_user_id_peer_id'),
+    sa.UniqueConstraint('user_id', 'room_id', name='uq_conversation_summaries_user_id_room_id')
+    )
+    op.create_index('ix_conversation_summaries_user_id_last_message_id', 'conversation_summaries', ['user_id', 'last_message_id'], unique=False)
+    op.create_index('ix_conversation_summaries_room_id', 'conversation_summaries', ['room_id'], unique=False)
+
+    # Direct chats: a row for each side; unread counts what the owner received
+    op.execute(
+        "INSERT INTO conversation_summaries "
+        "(user_id, peer_id, last_message_id, unread_count) "
+        "SELECT owner_id, peer_id, MAX(id), SUM(unread) FROM ("
+        "  SELECT sender_id AS owner_id, receiver_id AS peer_id, id, 0 AS unread "
+        "  FROM messages WHERE receiver_id IS NOT NULL "
+        "  UNION ALL "
+        "  SELECT receiver_id, sender_id, id, "
+        "  CASE WHEN status = 'read' THEN 0 ELSE 1 END "
+        "  FROM messages WHERE receiver_id IS NOT NULL"
+        ") AS dm GROUP BY owner_id, peer_id"
+    )
+    # Groups: rooms each member has posted in (what /home listed before)
+    op.execute(
+        "INSERT INTO conversation_summaries "
+        "(user_id, room_id, last_message_id, unread_count) "
+        "SELECT DISTINCT posted.sender_id, posted.room_id, latest.last_id, 0 FROM "
+        "(SELECT DISTINCT sender_id, room_id FROM messages WHERE room_id IS NOT NULL) AS posted "
+        "JOIN (SELECT room_id, MAX(id) AS last_id FROM messages "
+        "      WHERE room_id IS NOT NULL GROUP BY room_id) AS latest "
+        "ON latest.room_id = posted.room_id "
+        "JOIN room_members ON room_members.user_id = posted.sender_id "
+        "AND room_members.room_id = posted.room_id"
+    )
+    op.execute(
+        "UPDATE conversation_summaries SET last_message_at = "
+        "(SELECT sent_at FROM messages WHERE messages.id = conversation_summaries.last_message_id)"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_conversation_summaries_room_id', table_name='conversation_summaries')
+    op.drop_index('ix_conversation_summaries_user_id_last_message_id', table_name='conversation_summaries')
+    op.drop_table('conversation_summaries')
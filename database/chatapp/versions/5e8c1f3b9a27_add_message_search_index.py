@@ -0,0 +1,69 @@
+"""Add full-text search index on message content
+
+Revision ID: 5e8c1f3b9a27
+Revises: d2f7a9e61c38
+Create Date: 2026-10-18 16:12:48.205913
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5e8c1f3b9a27'
+down_revision: Union[str, Sequence[str], None] = 'd2f7a9e61c38'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Frozen copy of the DDL models.py runs under create_all at this revision;
+# later edits there must not change what this migration does
+SEARCH_DDL = {
+    'postgresql': [
+        "ALTER TABLE messages ADD COLUMN search_vector tsvector "
+        "GENERATED ALWAYS AS (to_tsvector('english', coalesce(content, ''))) STORED",
+        "CREATE INDEX IF NOT EXISTS ix_messages_search_vector ON messages USING gin (search_vector)",
+    ],
+    'sqlite': [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5("
+        "content, content='messages', content_rowid='id', tokenize='porter unicode61')",
+        "CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN "
+        "INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content); END",
+        "CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN "
+        "INSERT INTO messages_fts (messages_fts, rowid, content) "
+        "VALUES ('delete', old.id, old.content); END",
+        "CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content ON messages BEGIN "
+        "INSERT INTO messages_fts (messages_fts, rowid, content) "
+        "VALUES ('delete', old.id, old.content); "
+        "INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content); END",
+    ],
+}
+SEARCH_DROP_DDL = {
+    'postgresql': [
+        "DROP INDEX IF EXISTS ix_messages_search_vector",
+        "ALTER TABLE messages DROP COLUMN IF EXISTS search_vector",
+    ],
+    'sqlite': [
+        "DROP TRIGGER IF EXISTS messages_fts_update",
+        "DROP TRIGGER IF EXISTS messages_fts_delete",
+        "DROP TRIGGER IF EXISTS messages_fts_insert",
+        "DROP TABLE IF EXISTS messages_fts",
+    ],
+}
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    dialect = op.get_bind().dialect.name
+    # On PostgreSQL the generated column indexes existing rows as the table
+    # is rewritten
+    for statement in SEARCH_DDL.get(dialect, []):
+        op.execute(statement)
+    if dialect == 'sqlite':
+        op.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for statement in SEARCH_DROP_DDL.get(op.get_bind().dialect.name, []):
+        op.execute(statement)
@@ -0,0 +1,48 @@
+"""Make room membership unique and add a chatroom version
+
+Revision ID: 6a3e9d2c4b71
+Revises: e4a0b7c3d519
+Create Date: 2026-10-18 21:12:47.318204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '6a3e9d2c4b71'
+down_revision: Union[str, Sequence[str], None] = 'e4a0b7c3d519'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Double joins may already exist: keep the oldest row of each pair, as
+    # admin if any duplicate was, then recount before adding the constraint
+    op.execute(
+        "UPDATE room_members SET is_admin = TRUE WHERE id IN ("
+        "SELECT MIN(id) FROM room_members GROUP BY user_id, room_id "
+        "HAVING MAX(CASE WHEN is_admin THEN 1 ELSE 0 END) = 1)"
+    )
+    op.execute(
+        "DELETE FROM room_members WHERE id NOT IN ("
+        "SELECT MIN(id) FROM room_members GROUP BY user_id, room_id)"
+    )
+    op.execute(
+        "UPDATE chatroom SET member_count = (SELECT COUNT(*) FROM room_members "
+        "WHERE room_members.room_id = chatroom.id)"
+    )
+    with op.batch_alter_table('room_members') as batch_op:
+        batch_op.create_unique_constraint('uq_room_members_user_id_room_id', ['user_id', 'room_id'])
+
+    op.add_column('chatroom', sa.Column('version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('chatroom', 'version')
+    with op.batch_alter_table('room_members') as batch_op:
+        batch_op.drop_constraint('uq_room_members_user_id_room_id', type_='unique')
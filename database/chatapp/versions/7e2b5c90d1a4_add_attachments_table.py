@@ -0,0 +1,40 @@
+"""Add attachments table
+
+Revision ID: 7e2b5c90d1a4
+Revises: c4d1e8a92f07
+Create Date: 2026-10-18 11:02:17.540913
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7e2b5c90d1a4'
+down_revision: Union[str, Sequence[str], None] = 'c4d1e8a92f07'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('attachments',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('kind', sa.String(), nullable=False),
+    sa.Column('sha256', sa.String(length=64), nullable=False),
+    sa.Column('filename', sa.String(), nullable=False),
+    sa.Column('size', sa.Integer(), nullable=False),
+    sa.Column('mimetype', sa.String(), nullable=True),
+    sa.Column('ref_count', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('kind', 'sha256', name='uq_attachments_kind_sha256'),
+    sa.UniqueConstraint('kind', 'filename', name='uq_attachments_kind_filename')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('attachments')
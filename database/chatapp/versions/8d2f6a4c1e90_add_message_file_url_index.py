@@ -0,0 +1,27 @@
+"""Add an index on message file URLs
+
+Revision ID: 8d2f6a4c1e90
+Revises: 0c5b8e3d7a16
+Create Date: 2026-10-18 22:41:09.604125
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8d2f6a4c1e90'
+down_revision: Union[str, Sequence[str], None] = '0c5b8e3d7a16'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_messages_file_url', 'messages', ['file_url'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_messages_file_url', table_name='messages')
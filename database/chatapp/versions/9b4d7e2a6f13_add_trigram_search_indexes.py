@@ -0,0 +1,48 @@
+"""Add trigram indexes for user and room autocomplete
+
+Revision ID: 9b4d7e2a6f13
+Revises: 5e8c1f3b9a27
+Create Date: 2026-10-18 16:58:21.377104
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9b4d7e2a6f13'
+down_revision: Union[str, Sequence[str], None] = '5e8c1f3b9a27'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Trigram indexes behind autocomplete (PostgreSQL only): one GIN index per
+# searched column serves both prefix (LIKE 'q%') and similarity lookups.
+# pg_trgm needs rights to create extensions, so this lives here and not in
+# the create_all run at startup
+TRIGRAM_INDEXES = {
+    'users': ('username', 'first_name', 'last_name'),
+    'chatroom': ('roomname',),
+}
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for table, columns in TRIGRAM_INDEXES.items():
+        for column in columns:
+            op.execute(
+                f"CREATE INDEX ix_{table}_{column}_trgm ON {table} "
+                f"USING gin (lower({column}) gin_trgm_ops)"
+            )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    for table, columns in TRIGRAM_INDEXES.items():
+        for column in columns:
+            op.drop_index(f'ix_{table}_{column}_trgm', table_name=table)
@@ -0,0 +1,37 @@
+"""Add read watermarks to conversation summaries
+
+Revision ID: b6e0c3f48a12
+Revises: 3a9f6d21b7e5
+Create Date: 2026-10-18 14:41:52.660197
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b6e0c3f48a12'
+down_revision: Union[str, Sequence[str], None] = '3a9f6d21b7e5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('conversation_summaries', sa.Column('last_read_message_id', sa.Integer(), nullable=True))
+    # Everything below the oldest unread message from the peer counts as read
+    op.execute(
+        "UPDATE conversation_summaries SET last_read_message_id = COALESCE("
+        "(SELECT MIN(id) - 1 FROM messages WHERE messages.receiver_id = conversation_summaries.user_id "
+        " AND messages.sender_id = conversation_summaries.peer_id AND messages.status != 'read'), "
+        "(SELECT MAX(id) FROM messages WHERE messages.receiver_id = conversation_summaries.user_id "
+        " AND messages.sender_id = conversation_summaries.peer_id)) "
+        "WHERE peer_id IS NOT NULL"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('conversation_summaries', 'last_read_message_id')
@@ -0,0 +1,45 @@
+"""Add message indexes and conversation key
+
+Revision ID: c4d1e8a92f07
+Revises: 8379cc4d7602
+Create Date: 2026-10-18 09:12:41.318204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4d1e8a92f07'
+down_revision: Union[str, Sequence[str], None] = '8379cc4d7602'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('messages', sa.Column('conversation_key', sa.String(), nullable=True))
+    # Backfill direct messages as "<lower user id>:<higher user id>"
+    op.execute(
+        "UPDATE messages SET conversation_key = "
+        "CAST(LEAST(sender_id, receiver_id) AS VARCHAR) || ':' || "
+        "CAST(GREATEST(sender_id, receiver_id) AS VARCHAR) "
+        "WHERE receiver_id IS NOT NULL"
+    )
+    op.create_index('ix_messages_room_id_id', 'messages', ['room_id', 'id'], unique=False)
+    op.create_index('ix_messages_room_id_sent_at', 'messages', ['room_id', 'sent_at'], unique=False)
+    op.create_index('ix_messages_sender_id_receiver_id_sent_at', 'messages', ['sender_id', 'receiver_id', 'sent_at'], unique=False)
+    op.create_index('ix_messages_receiver_id_status', 'messages', ['receiver_id', 'status'], unique=False)
+    op.create_index('ix_messages_conversation_key_id', 'messages', ['conversation_key', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_messages_conversation_key_id', table_name='messages')
+    op.drop_index('ix_messages_receiver_id_status', table_name='messages')
+    op.drop_index('ix_messages_sender_id_receiver_id_sent_at', table_name='messages')
+    op.drop_index('ix_messages_room_id_sent_at', table_name='messages')
+    op.drop_index('ix_messages_room_id_id', table_name='messages')
+    op.drop_column('messages', 'conversation_key')
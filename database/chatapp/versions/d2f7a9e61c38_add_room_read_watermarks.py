@@ -0,0 +1,30 @@
+"""Add room read watermarks
+
+Revision ID: d2f7a9e61c38
+Revises: b6e0c3f48a12
+Create Date: 2026-10-18 15:37:10.904415
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd2f7a9e61c38'
+down_revision: Union[str, Sequence[str], None] = 'b6e0c3f48a12'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('room_members', sa.Column('last_read_message_id', sa.Integer(), nullable=True))
+    op.create_index('ix_room_members_room_id_user_id', 'room_members', ['room_id', 'user_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_room_members_room_id_user_id', table_name='room_members')
+    op.drop_column('room_members', 'last_read_message_id')
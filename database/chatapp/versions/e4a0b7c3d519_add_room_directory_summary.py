@@ -0,0 +1,47 @@
+"""Add member count and last activity to chatroom
+
+Revision ID: e4a0b7c3d519
+Revises: 9b4d7e2a6f13
+Create Date: 2026-10-18 17:40:05.612830
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e4a0b7c3d519'
+down_revision: Union[str, Sequence[str], None] = '9b4d7e2a6f13'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('chatroom', sa.Column('member_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('chatroom', sa.Column('last_message_id', sa.Integer(), nullable=True))
+    op.add_column('chatroom', sa.Column('last_activity_at', sa.DateTime(), nullable=True))
+    op.create_index('ix_chatroom_is_private_id', 'chatroom', ['is_private', 'id'], unique=False)
+
+    op.execute(
+        "UPDATE chatroom SET "
+        "member_count = (SELECT COUNT(*) FROM room_members "
+        "WHERE room_members.room_id = chatroom.id), "
+        "last_message_id = (SELECT MAX(id) FROM messages "
+        "WHERE messages.room_id = chatroom.id)"
+    )
+    op.execute(
+        "UPDATE chatroom SET last_activity_at = "
+        "(SELECT sent_at FROM messages WHERE messages.id = chatroom.last_message_id) "
+        "WHERE last_message_id IS NOT NULL"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_chatroom_is_private_id', table_name='chatroom')
+    op.drop_column('chatroom', 'last_activity_at')
+    op.drop_column('chatroom', 'last_message_id')
+    op.drop_column('chatroom', 'member_count')
@@ -5,11 +5,14 @@ from sqlalchemy import (
     Column,
     DateTime,
     ForeignKey,
+    Index,
     Integer,
     String,
     Text,
+    UniqueConstraint,
     func, Enum,
 )
+from sqlalchemy import DDL, event
 from sqlalchemy.orm import declarative_base, relationship
 
 Base = declarative_base()
@@ -20,6 +23,12 @@ class MessageStatus(str, enum.Enum):
     delivered = "delivered"
     read = "read"
 
+def conversation_key(user_a: int, user_b: int) -> str:
+    # Same key for both directions of a direct conversation
+    low, high = sorted((int(user_a), int(user_b)))
+    return f"{low}:{high}"
+
+
 class User(Base):
     __tablename__ = "users"
 
@@ -57,6 +66,12 @@ class Chatroom(Base):
     created_at = Column(DateTime, default=func.now())
     password = Column(String, nullable=True)
     image = Column(String, nullable=True)
+    # Directory summary, kept current as members join/leave and messages arrive
+    member_count = Column(Integer, nullable=False, default=0, server_default="0")
+    last_message_id = Column(Integer, nullable=True)
+    last_activity_at = Column(DateTime, nullable=True)
+    # Bumped with every change /getgroups shows; feeds its cheap ETag
+    version = Column(Integer, nullable=False, default=0, server_default="0")
 
     # Creator of the room
     creator = relationship("User", back_populates="chatrooms")
@@ -65,6 +80,8 @@ class Chatroom(Base):
     # Messages in the room
     messages = relationship("Message", back_populates="room")
 
+    __table_args__ = (Index("ix_chatroom_is_private_id", "is_private", "id"),)
+
 
 class RoomMembers(Base):
     __tablename__ = "room_members"
@@ -74,11 +91,19 @@ class RoomMembers(Base):
     room_id = Column(Integer, ForeignKey("chatroom.id"), nullable=False)
     is_admin = Column(Boolean, default=False)
     joined_at = Column(DateTime, default=func.now())
+    # Read watermark: every room message up to this id has been seen
+    last_read_message_id = Column(Integer, nullable=True)
 
     # Relationships
     user = relationship("User", back_populates="member_of")
     chatroom = relationship("Chatroom", back_populates="members")
 
+    # A concurrent double join fails here instead of counting twice
+    __table_args__ = (
+        UniqueConstraint("user_id", "room_id", name="uq_room_members_user_id_room_id"),
+        Index("ix_room_members_room_id_user_id", "room_id", "user_id"),
+    )
+
 
 class Message(Base):
     __tablename__ = "messages"
@@ -92,6 +117,22 @@ class Message(Base):
     status = Column(Enum(MessageStatus), default=MessageStatus.sent)
     file_url = Column(String, nullable=True)
     file_type = Column(String, nullable=True)
+    conversation_key = Column(String, nullable=True)
+
+    __table_args__ = (
+        Index("ix_messages_room_id_id", "room_id", "id"),
+        Index("ix_messages_room_id_sent_at", "room_id", "sent_at"),
+        Index(
+            "ix_messages_sender_id_receiver_id_sent_at",
+            "sender_id",
+            "receiver_id",
+            "sent_at",
+        ),
+        Index("ix_messages_receiver_id_status", "receiver_id", "status"),
+        # Attachment dedup checks who can already see a stored file
+        Index("ix_messages_file_url", "file_url"),
+        Index("ix_messages_conversation_key_id", "conversation_key", "id"),
+    )
 
     # Relationships
     sender = relationship(
@@ -101,3 +142,99 @@ class Message(Base):
         "User", back_populates="messages_received", foreign_keys=[receiver_id]
     )
     room = relationship("Chatroom", back_populates="messages")
+
+
+# Full-text index over message content, kept current by the database itself on
+# every insert (including write-behind batches): a generated tsvector column with
+# a GIN index on PostgreSQL, an external-content FTS5 table fed by triggers on SQLite.
+# The 5e8c1f3b9a27 migration runs these same statements against existing databases
+TEXT_SEARCH_CONFIG = "english"
+MESSAGE_SEARCH_DDL = {
+    "postgresql": [
+        "ALTER TABLE messages ADD COLUMN search_vector tsvector "
+        f"GENERATED ALWAYS AS (to_tsvector('{TEXT_SEARCH_CONFIG}', coalesce(content, ''))) STORED",
+        "CREATE INDEX IF NOT EXISTS ix_messages_search_vector ON messages USING gin (search_vector)",
+    ],
+    "sqlite": [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5("
+        "content, content='messages', content_rowid='id', tokenize='porter unicode61')",
+        "CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN "
+        "INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content); END",
+        "CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN "
+        "INSERT INTO messages_fts (messages_fts, rowid, content) "
+        "VALUES ('delete', old.id, old.content); END",
+        "CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content ON messages BEGIN "
+        "INSERT INTO messages_fts (messages_fts, rowid, content) "
+        "VALUES ('delete', old.id, old.content); "
+        "INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content); END",
+    ],
+}
+MESSAGE_SEARCH_DROP_DDL = {
+    "postgresql": [
+        "DROP INDEX IF EXISTS ix_messages_search_vector",
+        "ALTER TABLE messages DROP COLUMN IF EXISTS search_vector",
+    ],
+    "sqlite": [
+        "DROP TRIGGER IF EXISTS messages_fts_update",
+        "DROP TRIGGER IF EXISTS messages_fts_delete",
+        "DROP TRIGGER IF EXISTS messages_fts_insert",
+        "DROP TABLE IF EXISTS messages_fts",
+    ],
+}
+for _dialect, _statements in MESSAGE_SEARCH_DDL.items():
+    for _statement in _statements:
+        event.listen(
+            Message.__table__, "after_create", DDL(_statement).execute_if(dialect=_dialect)
+        )
+# The FTS5 table is not part of the metadata, so drop_all would leave it behind
+event.listen(
+    Message.__table__,
+    "after_drop",
+    DDL("DROP TABLE IF EXISTS messages_fts").execute_if(dialect="sqlite"),
+)
+
+
+class Attachment(Base):
+    __tablename__ = "attachments"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    # Upload directory the file lives in: messages, group-image or profile_pics
+    kind = Column(String, nullable=False)
+    sha256 = Column(String(64), nullable=False)
+    filename = Column(String, nullable=False)
+    size = Column(Integer, nullable=False)
+    mimetype = Column(String, nullable=True)
+    ref_count = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=func.now())
+
+    __table_args__ = (
+        UniqueConstraint("kind", "sha256", name="uq_attachments_kind_sha256"),
+        UniqueConstraint("kind", "filename", name="uq_attachments_kind_filename"),
+    )
+
+
+class ConversationSummary(Base):
+    """One inbox row per user and direct chat, kept current as messages arrive.
+
+    Only ``peer_id`` rows are written; ``room_id`` is left over from when rooms
+    were fanned out per member, and room entries now come from ``Chatroom``.
+    """
+
+    __tablename__ = "conversation_summaries"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    peer_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    room_id = Column(Integer, ForeignKey("chatroom.id"), nullable=True)
+    last_message_id = Column(Integer, ForeignKey("messages.id"), nullable=True)
+    last_message_at = Column(DateTime, nullable=True)
+    unread_count = Column(Integer, nullable=False, default=0)
+    # Read watermark: every message up to this id has been read by user_id
+    last_read_message_id = Column(Integer, nullable=True)
+
+    __table_args__ = (
+        UniqueConstraint("user_id", "peer_id", name="uq_conversation_summaries_user_id_peer_id"),
+        UniqueConstraint("user_id", "room_id", name="uq_conversation_summaries_user_id_room_id"),
+        Index("ix_conversation_summaries_user_id_last_message_id", "user_id", "last_message_id"),
+        Index("ix_conversation_summaries_room_id", "room_id"),
+    )
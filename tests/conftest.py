@@ -0,0 +1,85 @@
+import os
+import tempfile
+
+# app.config reads the environment once, at import, so set it up first:
+# a throwaway SQLite file, the in-memory broker and local storage
+_db_dir = tempfile.mkdtemp(prefix="chatapp-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_db_dir, 'test.db')}"
+os.environ.setdefault("SECRET_KEY", "test-secret-long-enough-for-hs256-signing")
+os.environ["BROKER_URL"] = ""
+os.environ["STORAGE_URL"] = ""
+
+import jwt  # noqa: E402
+import pytest  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+from app.autocomplete import search_cache, search_stats  # noqa: E402
+from app.config import ALGORITHM, SECRET_KEY  # noqa: E402
+from app.database import SessionLocal, engine  # noqa: E402
+from app.user_cache import user_cache  # noqa: E402
+from app.utils import token_cache  # noqa: E402
+from database.models import Base, Chatroom, RoomMembers, User  # noqa: E402
+
+
+@pytest.fixture
+def db():
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    # Ids restart with every test, so nothing cached may outlive one
+    for cache in (user_cache, token_cache, search_cache):
+        cache.clear()
+    search_stats.update(dict.fromkeys(search_stats, 0))
+    session = SessionLocal()
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def client(db):
+    from app.main import app
+
+    # Not used as a context manager: the lifespan would shut down the shared
+    # db executor that later tests still need
+    return TestClient(app)
+
+
+@pytest.fixture
+def make_user(db):
+    def make(username: str, first_name: str = "Test", last_name: str = "User") -> User:
+        user = User(
+            username=username,
+            first_name=first_name,
+            last_name=last_name,
+            email=f"{username}@example.com",
+            password="not-a-real-hash",
+        )
+        db.add(user)
+        db.commit()
+        return user
+
+    return make
+
+
+@pytest.fixture
+def make_room(db):
+    def make(name: str, owner: User, *members: User, is_private: bool = False) -> Chatroom:
+        room = Chatroom(roomname=name, created_by=owner.id, is_private=is_private)
+        db.add(room)
+        db.flush()
+        for member in (owner, *members):
+            db.add(RoomMembers(user_id=member.id, room_id=room.id, is_admin=member is owner))
+        room.member_count = 1 + len(members)
+        db.commit()
+        return room
+
+    return make
+
+
+def auth_header(user: User) -> dict:
+    token = jwt.encode({"sub": str(user.id)}, SECRET_KEY, algorithm=ALGORITHM)
+    return {"Authorization": f"Bearer {token}"}
+
+
+@pytest.fixture
+def auth():
+    return auth_header
@@ -0,0 +1,141 @@
+import asyncio
+
+from app.broker import InMemoryBroker
+from app.connection_manager import ClientConnection, ConnectionManager
+from app.frames import encode
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent: list[str] = []
+        self.close_code: int | None = None
+        self.gate = asyncio.Event()
+        self.gate.set()
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, msg: str):
+        await self.gate.wait()
+        self.sent.append(msg)
+
+    async def close(self, code: int = 1000):
+        self.close_code = code
+
+
+async def settle():
+    # Let the writer tasks drain what was queued
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_publish_reaches_the_handler_for_its_prefix():
+    broker = InMemoryBroker()
+    received = []
+
+    async def on_room(key, msg):
+        received.append(("room", key, msg))
+
+    async def on_dm(key, msg):
+        received.append(("dm", key, msg))
+
+    broker.subscribe("room:", on_room)
+    broker.subscribe("dm:", on_dm)
+
+    async def main():
+        await broker.publish("room:12", "hello")
+        await broker.publish("dm:1:2", "hi")
+        await broker.publish("presence:3", "ignored")
+
+    asyncio.run(main())
+    assert received == [("room", "12", "hello"), ("dm", "1:2", "hi")]
+
+
+def test_room_broadcast_fans_out_to_every_local_socket_in_the_room():
+    async def main():
+        manager = ConnectionManager(broker=InMemoryBroker())
+        sockets = [FakeWebSocket() for _ in range(3)]
+        conns = [
+            await manager.connect(sockets[0], 1),
+            await manager.connect(sockets[1], 1),
+            await manager.connect(sockets[2], 2),
+        ]
+        await manager.brodcast({"type": "message", "text": "hi"}, 1)
+        await settle()
+        for conn in conns:
+            conn.close()
+        return sockets
+
+    sockets = asyncio.run(main())
+    frame = encode({"type": "message", "text": "hi"})
+    assert sockets[0].sent == [frame]
+    assert sockets[1].sent == [frame]
+    assert sockets[2].sent == []
+
+
+def test_closed_connection_is_pruned_from_the_room():
+    async def main():
+        manager = ConnectionManager(broker=InMemoryBroker())
+        conn = await manager.connect(FakeWebSocket(), 7)
+        conn.close()
+        return manager.rooms_active_user
+
+    assert asyncio.run(main()) == {}
+
+
+def test_slow_consumer_is_closed_when_fan_out_overflows():
+    async def main():
+        ws = FakeWebSocket()
+        ws.gate.clear()
+        conn = ClientConnection(ws, queue_size=2, policy="disconnect")
+        accepted = [conn.offer("frame 0")]
+        await settle()
+        accepted += [conn.offer(f"frame {i}") for i in range(1, 4)]
+        await settle()
+        return conn, ws, accepted
+
+    conn, ws, accepted = asyncio.run(main())
+    # One frame is already with the writer, two fill the queue, the next overflows
+    assert accepted == [True, True, True, False]
+    assert conn.closed
+    assert ws.close_code == 1013
+
+
+def test_drop_policy_discards_the_oldest_fan_out_frame():
+    async def main():
+        ws = FakeWebSocket()
+        ws.gate.clear()
+        conn = ClientConnection(ws, queue_size=2, policy="drop")
+        for msg in ("a", "b", "c", "d"):
+            conn.offer(msg)
+        queued = [msg for msg, _ in conn.frames]
+        conn.close()
+        return queued
+
+    assert asyncio.run(main()) == ["c", "d"]
+
+
+def test_requested_replies_never_trip_the_slow_consumer_policy():
+    async def main():
+        ws = FakeWebSocket()
+        ws.gate.clear()
+        conn = ClientConnection(ws, queue_size=2, policy="disconnect")
+
+        async def history_page():
+            for i in range(6):
+                await conn.send(f"history {i}")
+
+        page = asyncio.create_task(history_page())
+        await settle()
+        # Replies fill their own slots; fan-out still has room
+        assert not page.done()
+        assert conn.offer("live")
+        ws.gate.set()
+        await page
+        await settle()
+        conn.close()
+        return conn, ws
+
+    conn, ws = asyncio.run(main())
+    assert ws.close_code is None
+    assert sorted(ws.sent) == sorted([f"history {i}" for i in range(6)] + ["live"])
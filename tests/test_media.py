@@ -0,0 +1,121 @@
+import hashlib
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.applications import Starlette
+from starlette.routing import Mount
+
+from app.media import MediaFiles, etag_matches, parse_range
+
+BODY = bytes(range(256)) * 4  # 1024 bytes
+SHA256 = hashlib.sha256(BODY).hexdigest()
+
+
+@pytest.mark.parametrize(
+    ("header", "expected"),
+    [
+        ("bytes=0-9", (0, 9)),
+        ("bytes=1000-", (1000, 1023)),
+        ("bytes=-24", (1000, 1023)),
+        ("bytes=-5000", (0, 1023)),
+        ("bytes=1000-5000", (1000, 1023)),
+        ("bytes=1023-1023", (1023, 1023)),
+        # Served whole: not a single bytes= range
+        ("bytes=-", None),
+        ("bytes=0-1,5-6", None),
+        ("items=0-9", None),
+    ],
+)
+def test_parse_range(header, expected):
+    assert parse_range(header, len(BODY)) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=1024-", "bytes=9-3", "bytes=5000-6000"])
+def test_parse_range_rejects_unsatisfiable_ranges(header):
+    with pytest.raises(ValueError):
+        parse_range(header, len(BODY))
+
+
+@pytest.mark.parametrize(
+    ("header", "matches"),
+    [
+        ('"abc"', True),
+        ('W/"abc"', True),
+        ('"xyz", "abc"', True),
+        ("*", True),
+        ('"abcd"', False),
+        ('"xyz"', False),
+    ],
+)
+def test_etag_matches_uses_weak_comparison(header, matches):
+    assert etag_matches(header, '"abc"') is matches
+
+
+@pytest.fixture
+def media(tmp_path):
+    (tmp_path / "messages").mkdir()
+    (tmp_path / "messages" / f"{SHA256}.bin").write_bytes(BODY)
+    (tmp_path / "messages" / "legacy.bin").write_bytes(BODY)
+    (tmp_path / "messages" / ".in-flight.upload").write_bytes(BODY)
+    (tmp_path / "tmp").mkdir()
+    (tmp_path / "tmp" / "staged.bin").write_bytes(BODY)
+    app = Starlette(
+        routes=[Mount("/uploads", MediaFiles(directory=str(tmp_path), hidden=("tmp",)))]
+    )
+    return TestClient(app)
+
+
+def test_content_addressed_files_use_their_hash_as_etag(media):
+    response = media.get(f"/uploads/messages/{SHA256}.bin")
+    assert response.status_code == 200
+    assert response.content == BODY
+    assert response.headers["etag"] == f'"{SHA256}"'
+    assert "immutable" in response.headers["cache-control"]
+    assert response.headers["accept-ranges"] == "bytes"
+
+
+def test_other_files_get_an_mtime_and_size_etag(media):
+    etag = media.get("/uploads/messages/legacy.bin").headers["etag"]
+    assert etag.startswith('"') and etag.endswith(f'-{len(BODY):x}"')
+
+
+@pytest.mark.parametrize("header", [f'"{SHA256}"', f'W/"{SHA256}"', '"other", *'])
+def test_if_none_match_answers_not_modified(media, header):
+    response = media.get(f"/uploads/messages/{SHA256}.bin", headers={"If-None-Match": header})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["etag"] == f'"{SHA256}"'
+
+
+def test_stale_if_none_match_gets_the_full_body(media):
+    response = media.get(f"/uploads/messages/{SHA256}.bin", headers={"If-None-Match": '"old"'})
+    assert response.status_code == 200
+    assert response.content == BODY
+
+
+def test_range_request_returns_partial_content(media):
+    response = media.get(f"/uploads/messages/{SHA256}.bin", headers={"Range": "bytes=10-19"})
+    assert response.status_code == 206
+    assert response.content == BODY[10:20]
+    assert response.headers["content-range"] == f"bytes 10-19/{len(BODY)}"
+    assert response.headers["content-length"] == "10"
+
+
+def test_unsatisfiable_range_is_416(media):
+    response = media.get(f"/uploads/messages/{SHA256}.bin", headers={"Range": "bytes=4096-"})
+    assert response.status_code == 416
+    assert response.headers["content-range"] == f"bytes */{len(BODY)}"
+
+
+def test_if_range_with_a_stale_etag_sends_the_whole_file(media):
+    path = f"/uploads/messages/{SHA256}.bin"
+    fresh = media.get(path, headers={"Range": "bytes=0-9", "If-Range": f'"{SHA256}"'})
+    stale = media.get(path, headers={"Range": "bytes=0-9", "If-Range": '"old"'})
+    assert fresh.status_code == 206
+    assert stale.status_code == 200
+    assert stale.content == BODY
+
+
+@pytest.mark.parametrize("path", ["/uploads/tmp/staged.bin", "/uploads/messages/.in-flight.upload"])
+def test_hidden_directories_and_dot_files_are_never_served(media, path):
+    assert media.get(path).status_code == 404
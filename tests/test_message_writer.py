@@ -0,0 +1,102 @@
+import asyncio
+import itertools
+from datetime import datetime
+
+from sqlalchemy.exc import OperationalError
+
+import app.message_writer as writer_module
+from app.message_writer import COLUMNS, MessageWriter
+from database.models import ConversationSummary, Message
+
+
+def message(message_id: int, sender_id: int, receiver_id: int, content: str = "hi") -> dict:
+    row = dict.fromkeys(COLUMNS)
+    row.update(
+        id=message_id,
+        content=content,
+        sender_id=sender_id,
+        receiver_id=receiver_id,
+        conversation_key=f"{min(sender_id, receiver_id)}:{max(sender_id, receiver_id)}",
+        sent_at=datetime.now(),
+        status="sent",
+    )
+    return row
+
+
+def stored(db) -> dict[int, str]:
+    db.expire_all()
+    return {row.id: row.content for row in db.query(Message).order_by(Message.id)}
+
+
+def test_flush_inserts_the_batch_and_updates_the_inbox(db, make_user):
+    alice, bob = make_user("alice"), make_user("bob")
+    writer = MessageWriter(enabled=False)
+    batch = [message(1, alice.id, bob.id), message(2, bob.id, alice.id)]
+
+    asyncio.run(writer.flush(batch))
+
+    assert stored(db) == {1: "hi", 2: "hi"}
+    summary = db.query(ConversationSummary).filter_by(user_id=alice.id, peer_id=bob.id).one()
+    assert summary.last_message_id == 2
+    assert summary.unread_count == 1
+
+
+def test_transient_failures_are_retried_until_the_batch_lands(db, make_user, monkeypatch):
+    alice, bob = make_user("alice"), make_user("bob")
+    attempts = []
+    real_insert = writer_module.insert_messages
+
+    def flaky_insert(rows):
+        attempts.append(len(rows))
+        if len(attempts) <= 3:
+            raise OperationalError("INSERT", {}, Exception("connection reset"))
+        real_insert(rows)
+
+    monkeypatch.setattr(writer_module, "insert_messages", flaky_insert)
+    writer = MessageWriter(enabled=False, retry_delay=0)
+
+    asyncio.run(writer.flush([message(1, alice.id, bob.id), message(2, alice.id, bob.id)]))
+
+    # Retried whole, never split or dropped
+    assert attempts == [2, 2, 2, 2]
+    assert stored(db) == {1: "hi", 2: "hi"}
+
+
+def test_rows_the_database_rejects_are_dropped_and_the_rest_kept(db, make_user):
+    alice, bob = make_user("alice"), make_user("bob")
+    db.add(Message(id=2, content="already here", sender_id=bob.id, receiver_id=alice.id))
+    db.commit()
+    writer = MessageWriter(enabled=False, retry_delay=0)
+    batch = [message(1, alice.id, bob.id), message(2, alice.id, bob.id), message(3, alice.id, bob.id)]
+
+    asyncio.run(writer.flush(batch))
+
+    assert stored(db) == {1: "hi", 2: "already here", 3: "hi"}
+    assert writer.pending == {}
+
+
+def test_submitted_rows_are_flushed_in_batches_and_on_stop(db, make_user, monkeypatch):
+    alice, bob = make_user("alice"), make_user("bob")
+    ids = itertools.count(1)
+    writer = MessageWriter(enabled=False, batch_size=2, flush_interval=0.01)
+
+    async def next_id():
+        return next(ids)
+
+    monkeypatch.setattr(writer, "next_id", next_id)
+
+    async def main():
+        rows = [
+            await writer.submit(content=f"m{i}", sender_id=alice.id, receiver_id=bob.id)
+            for i in range(5)
+        ]
+        # Folded into the pending row before it is written
+        assert writer.update_status(rows[-1]["id"], "read")
+        await writer.stop()
+        return rows
+
+    rows = asyncio.run(main())
+    assert [row["id"] for row in rows] == [1, 2, 3, 4, 5]
+    assert stored(db) == {i + 1: f"m{i}" for i in range(5)}
+    assert db.get(Message, 5).status.value == "read"
+    assert writer.pending == {}
@@ -0,0 +1,153 @@
+from database.models import Message, conversation_key
+
+
+def test_users_pages_by_id_after_the_cursor(client, make_user):
+    users = [make_user(f"user{i}") for i in range(5)]
+    ids = [user.id for user in users]
+
+    first = client.get("/users", params={"limit": 2}).json()
+    assert [row["id"] for row in first["users"]] == ids[:2]
+    assert first["has_more"] is True
+    assert first["next_after"] == ids[1]
+
+    second = client.get("/users", params={"limit": 2, "after": first["next_after"]}).json()
+    assert [row["id"] for row in second["users"]] == ids[2:4]
+
+    last = client.get("/users", params={"limit": 2, "after": second["next_after"]}).json()
+    assert [row["id"] for row in last["users"]] == ids[4:]
+    assert last["has_more"] is False
+    assert last["next_after"] is None
+
+
+def test_users_page_that_ends_exactly_at_the_limit_has_no_more(client, make_user):
+    for i in range(3):
+        make_user(f"user{i}")
+
+    page = client.get("/users", params={"limit": 3}).json()
+    assert len(page["users"]) == 3
+    assert page["has_more"] is False
+    assert page["next_after"] is None
+    assert set(page["users"][0]) == {"id", "username", "email"}
+
+
+def test_users_past_the_last_id_is_an_empty_page(client, make_user):
+    last = make_user("only")
+    page = client.get("/users", params={"after": last.id}).json()
+    assert page == {"users": [], "next_after": None, "has_more": False}
+
+
+def test_getgroups_pages_newest_first_before_the_cursor(client, make_user, make_room, auth):
+    owner = make_user("owner")
+    ids = [make_room(f"room{i}", owner).id for i in range(5)]
+    headers = auth(owner)
+
+    first = client.get("/getgroups", params={"limit": 2}, headers=headers).json()
+    assert [room["id"] for room in first["rooms"]] == ids[:-3:-1]
+    assert first["next_before"] == ids[3]
+
+    second = client.get(
+        "/getgroups", params={"limit": 2, "before": first["next_before"]}, headers=headers
+    ).json()
+    assert [room["id"] for room in second["rooms"]] == [ids[2], ids[1]]
+    assert second["has_more"] is True
+
+    last = client.get(
+        "/getgroups", params={"limit": 2, "before": second["next_before"]}, headers=headers
+    ).json()
+    assert [room["id"] for room in last["rooms"]] == [ids[0]]
+    assert last["has_more"] is False
+    assert last["next_before"] is None
+
+
+def test_getgroups_etag_revalidates_until_the_page_changes(client, make_user, make_room, auth):
+    owner, guest = make_user("owner"), make_user("guest")
+    room = make_room("lobby", owner)
+    headers = auth(guest)
+
+    first = client.get("/getgroups", headers=headers)
+    etag = first.headers["etag"]
+    again = client.get("/getgroups", headers={**headers, "If-None-Match": etag})
+    assert again.status_code == 304
+
+    client.post("/joingroup", json={"room_id": room.id}, headers=headers)
+    changed = client.get("/getgroups", headers={**headers, "If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["etag"] != etag
+    assert changed.json()["rooms"][0]["joined"] is True
+
+
+def test_room_history_pages_back_from_the_newest_message(db, client, make_user, make_room, auth):
+    owner = make_user("owner")
+    room = make_room("lobby", owner)
+    for i in range(5):
+        db.add(Message(content=f"m{i}", sender_id=owner.id, room_id=room.id))
+    db.commit()
+    ids = [row.id for row in db.query(Message.id).order_by(Message.id)]
+    url = f"/chatroom/{room.id}/history"
+    headers = auth(owner)
+
+    first = client.get(url, params={"limit": 2}, headers=headers).json()
+    # Each page reads oldest to newest
+    assert [msg["message_id"] for msg in first["messages"]] == ids[3:]
+    assert first["next_before"] == ids[3]
+
+    second = client.get(
+        url, params={"limit": 2, "before": first["next_before"]}, headers=headers
+    ).json()
+    assert [msg["message_id"] for msg in second["messages"]] == ids[1:3]
+
+    last = client.get(
+        url, params={"limit": 2, "before": second["next_before"]}, headers=headers
+    ).json()
+    assert [msg["message_id"] for msg in last["messages"]] == ids[:1]
+    assert last["has_more"] is False
+    assert last["next_before"] is None
+
+
+def test_room_history_is_for_members_only(client, make_user, make_room, auth):
+    owner, stranger = make_user("owner"), make_user("stranger")
+    room = make_room("lobby", owner)
+    response = client.get(f"/chatroom/{room.id}/history", headers=auth(stranger))
+    assert response.status_code == 403
+
+
+def test_dm_history_pages_back_and_resumes_forward(db, client, make_user, auth):
+    alice, bob, carol = make_user("alice"), make_user("bob"), make_user("carol")
+    key = conversation_key(alice.id, bob.id)
+    for i in range(5):
+        sender, receiver = (alice, bob) if i % 2 else (bob, alice)
+        db.add(
+            Message(
+                content=f"m{i}",
+                sender_id=sender.id,
+                receiver_id=receiver.id,
+                conversation_key=key,
+            )
+        )
+    # Another conversation must never leak into the page
+    db.add(
+        Message(
+            content="other",
+            sender_id=carol.id,
+            receiver_id=alice.id,
+            conversation_key=conversation_key(alice.id, carol.id),
+        )
+    )
+    db.commit()
+    ids = [row.id for row in db.query(Message.id).filter_by(conversation_key=key).order_by(Message.id)]
+    url = f"/userchat/{bob.id}/history"
+    headers = auth(alice)
+
+    first = client.get(url, params={"limit": 3}, headers=headers).json()
+    assert [msg["message_id"] for msg in first["messages"]] == ids[2:]
+    assert first["has_more"] is True
+
+    older = client.get(
+        url, params={"limit": 3, "before": first["next_before"]}, headers=headers
+    ).json()
+    assert [msg["message_id"] for msg in older["messages"]] == ids[:2]
+    assert older["has_more"] is False
+
+    resumed = client.get(url, params={"limit": 3, "since": ids[1]}, headers=headers).json()
+    assert [msg["message_id"] for msg in resumed["messages"]] == ids[2:]
+    assert resumed["next_since"] == ids[-1]
@@ -0,0 +1,140 @@
+import asyncio
+import threading
+
+import app.autocomplete as autocomplete
+from app.autocomplete import autocomplete_users, search_changed, search_stats
+from app.message_search import search_messages
+from database.models import Message, conversation_key
+
+
+def add_message(db, sender, content, room=None, receiver=None) -> Message:
+    msg = Message(
+        content=content,
+        sender_id=sender.id,
+        room_id=room.id if room else None,
+        receiver_id=receiver.id if receiver else None,
+        conversation_key=conversation_key(sender.id, receiver.id) if receiver else None,
+    )
+    db.add(msg)
+    db.commit()
+    return msg
+
+
+def test_message_search_only_covers_what_the_user_can_read(db, make_user, make_room):
+    alice, bob, carol = make_user("alice"), make_user("bob"), make_user("carol")
+    shared = make_room("shared", alice, bob)
+    private = make_room("private", carol)
+    in_room = add_message(db, bob, "the deploy is done", room=shared)
+    direct = add_message(db, alice, "deploy notes attached", receiver=bob)
+    add_message(db, carol, "secret deploy plan", room=private)
+    add_message(db, bob, "deploy with carol", receiver=carol)
+    add_message(db, bob, "lunch later?", room=shared)
+
+    found = search_messages(db, alice.id, "deploy")
+    assert {row["message_id"] for row in found["results"]} == {in_room.id, direct.id}
+
+    in_shared = search_messages(db, alice.id, "deploy", room_id=shared.id)
+    assert [row["message_id"] for row in in_shared["results"]] == [in_room.id]
+    with_bob = search_messages(db, alice.id, "deploy", peer_id=bob.id)
+    assert [row["message_id"] for row in with_bob["results"]] == [direct.id]
+
+
+def test_message_search_stems_and_highlights_safely(db, make_user, make_room):
+    alice = make_user("alice")
+    room = make_room("lobby", alice)
+    add_message(db, alice, "<b>Deploying</b> tonight", room=room)
+
+    (result,) = search_messages(db, alice.id, "deploy")["results"]
+    # Porter stemming matches "deploying"; markup in the message stays escaped
+    assert "<mark>Deploying</mark>" in result["snippet"]
+    assert "&lt;b&gt;" in result["snippet"]
+    assert "<b>" not in result["snippet"]
+
+
+def test_message_search_treats_query_syntax_as_words(db, make_user, make_room):
+    alice = make_user("alice")
+    room = make_room("lobby", alice)
+    add_message(db, alice, "deploy OR rollback", room=room)
+
+    assert len(search_messages(db, alice.id, 'deploy OR "rollback')["results"]) == 1
+    assert search_messages(db, alice.id, '"*()')["results"] == []
+
+
+def test_message_search_pages_by_offset(db, make_user, make_room):
+    alice = make_user("alice")
+    room = make_room("lobby", alice)
+    for i in range(5):
+        add_message(db, alice, f"deploy number {i}", room=room)
+
+    first = search_messages(db, alice.id, "deploy", limit=3)
+    assert len(first["results"]) == 3
+    assert first["next_offset"] == 3
+    rest = search_messages(db, alice.id, "deploy", offset=first["next_offset"], limit=3)
+    assert len(rest["results"]) == 2
+    assert rest["has_more"] is False
+    seen = {row["message_id"] for row in first["results"] + rest["results"]}
+    assert len(seen) == 5
+
+
+def test_autocomplete_serves_from_cache_until_search_changed(db, make_user):
+    make_user("alice")
+
+    async def main():
+        before = await autocomplete_users("al")
+        make_user("alan")
+        cached = await autocomplete_users("al")
+        await search_changed()
+        fresh = await autocomplete_users("al")
+        return before, cached, fresh
+
+    before, cached, fresh = asyncio.run(main())
+    assert [user["username"] for user in before] == ["alice"]
+    assert cached == before
+    assert {user["username"] for user in fresh} == {"alan", "alice"}
+    assert search_stats["queries"] == 2
+
+
+def test_autocomplete_narrows_longer_queries_from_a_complete_result(db, make_user):
+    make_user("alice")
+    make_user("albert")
+
+    async def main():
+        await autocomplete_users("al")
+        return await autocomplete_users("ali")
+
+    narrowed = asyncio.run(main())
+    assert [user["username"] for user in narrowed] == ["alice"]
+    assert search_stats["queries"] == 1
+    assert search_stats["narrowed"] == 1
+
+
+def test_autocomplete_never_caches_a_load_that_started_before_a_change(db, make_user, monkeypatch):
+    make_user("alice")
+    release = threading.Event()
+    real_load = autocomplete.load_users
+
+    def slow_load(query, room_id):
+        # Reads now, answers once released
+        result = real_load(query, room_id)
+        release.wait(5)
+        return result
+
+    monkeypatch.setattr(autocomplete, "load_users", slow_load)
+
+    async def main():
+        stale = asyncio.create_task(autocomplete_users("al"))
+        await asyncio.sleep(0.05)
+        make_user("alan")
+        await search_changed()
+        # Does not join the load already in flight
+        fresh = asyncio.create_task(autocomplete_users("al"))
+        await asyncio.sleep(0.05)
+        release.set()
+        return await stale, await fresh
+
+    stale, fresh = asyncio.run(main())
+    assert [user["username"] for user in stale] == ["alice"]
+    assert {user["username"] for user in fresh} == {"alan", "alice"}
+    assert search_stats["coalesced"] == 0
+    cached = autocomplete.search_cache.peek(("users", None, "al"))
+    assert {user["username"] for user in cached["results"]} == {"alan", "alice"}